@@ -0,0 +1,376 @@
+#!/usr/bin/python3
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import pstats
+import cProfile
+import argparse
+import tempfile
+import datetime
+import resource
+import threading
+import contextlib
+import subprocess
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SIGRID_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'greenability')) # write_greenability.py and friends
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'churn')) # write_churn.py
+import instrumentation
+import write_greenability as wg
+import write_churn as wc
+from scoring_model import load_model, score_records
+from write_correlation import read_metrics, read_churn, correlate, write_results
+from sigrid_fetch import greenability_jobs, churn_jobs, osh_jobs, run_jobs
+from synthetic_sigrid import make_greenability_tree, make_churn_tree, greenability_system, system_name, REFACTORINGS
+
+'''
+This file performs the following tasks:
+1. creates synthetic greenability and churn trees with synthetic_sigrid.py (--systems systems,
+    --refactorings refactorings with --runs runs each, --findings findings per findings export)
+2. runs the whole pipeline on them, one stage at a time:
+    - fetch: downloads both trees (and the OSH results) with sigrid_fetch.py from a local stub of the Sigrid API
+    - extract: reads the json files of every system (write_greenability.read_systems)
+    - score: scores all systems under the Greenability model (scoring_model.score_records)
+    - combine: writes greenability_scores.csv, its store and combined_systems (write_greenability.py)
+    - churn: writes churn-<system>.csv and churn.csv (write_churn.py)
+    - correlate: correlates all metrics with churn (write_correlation.py)
+3. measures the time and peak memory (RSS) of every stage, keeps the timers and counters of the
+    steps within it (instrumentation.py: json_read, json_decode, ...), and with --profile writes a cProfile
+    of every stage to <stage>.prof and the 30 slowest functions to <stage>.txt
+4. appends the results to a json history (benchmark_history.json), and reports the stages that
+    got more than --threshold slower than the last run with the same parameters
+
+Peak RSS is reset before every stage (Linux /proc/self/clear_refs), so every stage gets its own peak.
+Where this is not possible, the peak of the whole run so far is reported. Worker processes
+(--workers > 1) are reported separately as the largest child process. The stub runs in the same
+process as the fetcher, so the fetch stage measures both ends of the connection.
+
+To Run file:
+    python3 benchmark_pipeline.py --systems 1000
+    python3 benchmark_pipeline.py --systems 50000 --findings 100 --workers 8 --profile ~/Desktop/profiles
+
+This file is structured as follows:
+1. Stub of the Sigrid API:
+    StubHandler
+    start_stub()
+2. Measuring stages:
+    reset_peak_rss()
+    peak_rss()
+    run_stage()
+3. Pipeline:
+    run_pipeline()
+4. History:
+    load_history()
+    find_regressions()
+    save_history()
+5. Main
+
+'''
+
+DEFAULT_HISTORY_FILE = os.path.join(SIGRID_DIRECTORY, 'benchmark_history.json')
+
+################################
+# Stub of the Sigrid API
+################################
+
+# answers the requests of sigrid_fetch.py with the files of the synthetic trees
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep connections open, like Sigrid
+    disable_nagle_algorithm = True # headers and body are separate writes, which would otherwise wait for a delayed ACK
+
+    def path_of(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        greenability_directory, churn_directory = self.server.trees
+        if parts[:4] == ['rest', 'analysis-results', 'api', 'v1']:
+            quality, system = parts[4], parts[6]
+            if quality == 'model-ratings':
+                quality = 'internal_reliability-findings'
+            return os.path.join(greenability_directory, system, f'{system}_{quality}.json')
+        if parts[:3] == ['rest', 'analysis-results', 'libraryDependencies']:
+            system = parts[4]
+            return os.path.join(greenability_directory, system, f'{system}_internal_osh-findings.json')
+        if parts[:3] == ['rest', 'analysis-results', 'changequality']:
+            name = parts[4].removeprefix('churn2-') # eg. synthetic00001-inline-1
+            return os.path.join(churn_directory, name.split('-')[0], f'churn-{name}.json')
+        return None
+
+    def answer(self):
+        if 'Content-Length' in self.headers:
+            self.rfile.read(int(self.headers['Content-Length'])) # request body is not needed
+        path = self.path_of()
+        if path is None:
+            self.send_response(404)
+            content = b''
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                content = b'[]' # exports that are not generated (osh-findings) are empty
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self, format, *args):
+        pass # one line per request is too much output
+
+# serve the trees on a free local port, returns the server and its base url
+def start_stub(greenability_directory, churn_directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.trees = (greenability_directory, churn_directory)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+################################
+# Measuring stages
+################################
+
+# start a new peak, returns False where the peak cannot be reset
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# peak RSS in MB of this process (since the last reset), and of the largest finished child process
+def peak_rss():
+    peak = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024 # ru_maxrss is in bytes on macOS, in KB on Linux
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+
+# run one stage, quietly, and measure it; returns (result of the stage, measurements)
+def run_stage(name, stage, profile_directory=None):
+    reset = reset_peak_rss()
+    instrumentation.reset()
+    profiler = cProfile.Profile() if profile_directory else None
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()): # the pipeline prints one line per system or file
+        if profiler:
+            profiler.enable()
+        result = stage()
+        if profiler:
+            profiler.disable()
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    peak, children_peak = peak_rss()
+
+    if profiler:
+        os.makedirs(profile_directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_directory, f'{name}.prof'))
+        with open(os.path.join(profile_directory, f'{name}.txt'), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(30)
+
+    print(f'{name:>10}  {seconds:8.2f}s  {cpu_seconds:8.2f}s cpu  {peak:8.1f} MB' +
+          (f'  {children_peak:8.1f} MB workers' if children_peak else ''))
+    return result, {
+                    'seconds': round(seconds, 4),
+                    'cpu_seconds': round(cpu_seconds, 4),
+                    'peak_rss_mb': round(peak, 1),
+                    'peak_rss_stage': reset, # False: peak of the whole run so far
+                    'children_peak_rss_mb': round(children_peak, 1),
+                    'counters': instrumentation.metrics_json()['stages'] # timers and bytes of the steps within the stage
+                    }
+
+################################
+# Pipeline
+################################
+
+# run all stages on the trees in source_directory, the results are written to work_directory
+def run_pipeline(source_directory, work_directory, params, model=None, profile_directory=None, fetch=True):
+    greenability_source = os.path.join(source_directory, 'greenability')
+    churn_source = os.path.join(source_directory, 'churn')
+    greenability_directory = os.path.join(work_directory, 'greenability')
+    churn_directory = os.path.join(work_directory, 'churn')
+    correlation_directory = os.path.join(work_directory, 'correlation')
+    os.makedirs(correlation_directory, exist_ok=True)
+    stages = {}
+    data = {}
+
+    def fetch_stage():
+        server, base_url = start_stub(greenability_source, churn_source)
+        systems = [greenability_system(i) for i in range(params['systems'])]
+        churn_systems = ['churn2-' + system_name(i) for i in range(params['systems'])]
+        jobs = (greenability_jobs(greenability_directory, systems, base_url=base_url) +
+                osh_jobs(greenability_directory, systems, 'x', 'x', base_url=base_url) +
+                churn_jobs(churn_directory, churn_systems, params['refactorings'], params['runs'], base_url=base_url))
+        try:
+            failed = run_jobs(jobs, params['workers'] * 4, requests_per_second=0) # no rate limit on a local stub
+        finally:
+            server.shutdown()
+            server.server_close()
+        if failed:
+            raise SystemExit(f'{len(failed)} files could not be fetched from the stub')
+        return len(jobs)
+
+    def extract_stage():
+        data['records'] = wg.read_systems(greenability_directory, wg.list_systems(greenability_directory),
+                                          params['workers'], findings=params['findings'] > 0)
+
+    def score_stage():
+        score_records(data['records'], model)
+
+    def combine_stage():
+        csv_file = os.path.join(greenability_directory, 'greenability_scores.csv')
+        wg.write_headings(csv_file, list(data['records'][0]['scores']) if data['records'] else None)
+        wg.calculate_greenability(data['records'], csv_file, model)
+        wg.store_greenability_scores(greenability_directory, data['records'])
+        wg.combine_all_metrics(greenability_directory, data['records'])
+
+    def churn_stage():
+        runs = wc.read_churn_runs(churn_directory)
+        wc.write_churn(churn_directory, runs)
+        wc.combine_churn_results(churn_directory, runs)
+
+    def correlate_stage():
+        metrics, metric_names, metric_systems = read_metrics(os.path.join(greenability_directory, 'combined_systems'))
+        churn, refactorings, churn_systems = read_churn(os.path.join(churn_directory, 'churn.csv'))
+        results = correlate(metrics, metric_names, metric_systems, churn, refactorings, churn_systems)
+        write_results(results, os.path.join(correlation_directory, 'all_correlation_results.csv'))
+
+    if fetch:
+        _, stages['fetch'] = run_stage('fetch', fetch_stage, profile_directory)
+    else: # read the synthetic trees where they are
+        shutil.copytree(greenability_source, greenability_directory, dirs_exist_ok=True)
+        shutil.copytree(churn_source, churn_directory, dirs_exist_ok=True)
+    for name, stage in [('extract', extract_stage), ('score', score_stage), ('combine', combine_stage),
+                        ('churn', churn_stage), ('correlate', correlate_stage)]:
+        _, stages[name] = run_stage(name, stage, profile_directory)
+    return stages
+
+################################
+# History
+################################
+
+def load_history(history_file):
+    if not os.path.isfile(history_file):
+        return []
+    with open(history_file, 'r') as f:
+        return json.load(f)
+
+# stages that took more than threshold longer than in the last run with the same parameters
+# (stages under min_seconds are too short to compare)
+def find_regressions(history, entry, threshold=0.2, min_seconds=0.05):
+    previous = [run for run in history if run['params'] == entry['params']]
+    if not previous:
+        return None, []
+    last = previous[-1]
+    regressions = []
+    for stage, result in entry['stages'].items():
+        before = last['stages'].get(stage)
+        if before and max(before['seconds'], result['seconds']) >= min_seconds and result['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append((stage, before['seconds'], result['seconds']))
+    return last, regressions
+
+# write to a temporary file first, so a crashed run never loses the history
+def save_history(history_file, history):
+    directory = os.path.dirname(os.path.abspath(history_file))
+    os.makedirs(directory, exist_ok=True)
+    with open(history_file + '.part', 'w') as f:
+        json.dump(history, f, indent=2)
+        f.write('\n')
+    os.replace(history_file + '.part', history_file)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SIGRID_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the whole Sigrid pipeline on synthetic systems.')
+    parser.add_argument('--systems', type=int, default=1000)
+    parser.add_argument('--refactorings', type=int, default=len(REFACTORINGS))
+    parser.add_argument('--runs', type=int, default=4, help='runs per refactoring')
+    parser.add_argument('--findings', type=int, default=0, help='findings per security and reliability export')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='processes reading systems (fetch uses 4 threads per worker)')
+    parser.add_argument('--model', help='json or yaml Greenability model (default: greenability_model.json)')
+    parser.add_argument('--no-fetch', action='store_true', help='leave out the fetch stage')
+    parser.add_argument('--profile', help='directory for a cProfile of every stage')
+    parser.add_argument('--directory', help='directory for the synthetic trees and outputs (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic trees and outputs')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_FILE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='report stages more than this share slower than last time')
+    parser.add_argument('--label', help='note stored with the run in the history')
+    args = parser.parse_args()
+
+    refactorings = (REFACTORINGS + [f'refactoring{i}' for i in range(len(REFACTORINGS), args.refactorings)])[:args.refactorings]
+    params = {
+            'systems': args.systems,
+            'refactorings': refactorings,
+            'runs': args.runs,
+            'findings': args.findings,
+            'seed': args.seed,
+            'workers': args.workers,
+            'model': args.model,
+            'fetch': not args.no_fetch
+            }
+
+    directory = os.path.expanduser(args.directory) if args.directory else tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    source_directory = os.path.join(directory, 'synthetic')
+    work_directory = os.path.join(directory, 'pipeline')
+    try:
+        print(f'Creating {args.systems} synthetic systems in {source_directory}')
+        start = time.perf_counter()
+        make_greenability_tree(os.path.join(source_directory, 'greenability'), args.systems, args.findings, args.seed)
+        make_churn_tree(os.path.join(source_directory, 'churn'), args.systems, refactorings, args.runs, seed=args.seed)
+        print(f'Created in {time.perf_counter() - start:.2f}s')
+
+        model = load_model(args.model and os.path.expanduser(args.model))
+        profile_directory = args.profile and os.path.expanduser(args.profile)
+        print(f'{"stage":>10}  {"wall":>9}  {"cpu":>13}  {"peak RSS":>11}')
+        stages = run_pipeline(source_directory, work_directory, params, model, profile_directory, not args.no_fetch)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    entry = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'label': args.label,
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+            'params': params,
+            'stages': stages,
+            'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 4)
+            }
+    history_file = os.path.expanduser(args.history)
+    history = load_history(history_file)
+    last, regressions = find_regressions(history, entry, args.threshold)
+    print(f'{"total":>10}  {entry["total_seconds"]:8.2f}s')
+    if last is None:
+        print('No earlier run with the same parameters to compare with')
+    elif regressions:
+        for stage, before, after in regressions:
+            print(f'Regression in {stage}: {before:.2f}s -> {after:.2f}s (+{(after / before - 1) * 100:.0f}%) since {last["time"]} ({last["commit"]})')
+    else:
+        print(f'No stage more than {args.threshold * 100:.0f}% slower than on {last["time"]} ({last["commit"]})')
+    save_history(history_file, history + [entry])
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+import write_churn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+from synthetic_sigrid import make_churn_tree, REFACTORINGS
+
+'''
+This file performs the following tasks:
+1. creates a synthetic churn tree with synthetic_sigrid.py (100,000 refactoring runs by default), with the same
+    churn-<system>-<refactoring>-<n>.json naming as the real exports, including empty
+    files for extractvariable runs that were not implemented
+2. runs the previous row-by-row implementation of write_churn.py (kept below) on it
+3. runs the current columnar implementation of write_churn.py on it
+4. checks that churn.csv and every churn-<system>.csv are byte for byte the same
+5. prints the time of both implementations
+
+To Run file:
+    python3 benchmark_churn.py --runs 100000
+
+'''
+
+RUNS_PER_REFACTORING = 4
+
+################################
+# Previous implementation of write_churn.py, one row at a time
+################################
+
+def legacy_combine_churn_results(input_directory):
+    results = defaultdict(lambda: [0, 0, 0, 0])  # [count, totalNewFiles, totalNewVolumeInMonths, totalNewVolumeInLoc]
+    output_file = os.path.join(input_directory, 'churn.csv')
+    for system in sorted(os.listdir(input_directory)):
+        system_path = os.path.join(input_directory, system)
+        if system != 'virtualenv' and os.path.isdir(system_path):
+            csv_file = os.path.join(system_path, 'churn-' + system + '.csv')
+            if os.path.isfile(csv_file):
+                with open(csv_file, 'r') as f:
+                    reader = csv.DictReader(f)
+                    for row in reader:
+                        key = (row['System'], row['Refactoring'])
+                        if (row['Refactoring']!="extractvariable"):
+                            results[key][0] += 1
+                        else:
+                            if(int(row['totalNewFiles'])!=0):
+                                results[key][0] += 1
+                        results[key][1] += int(row['totalNewFiles'])
+                        results[key][2] += float(row['totalNewVolumeInMonths'])
+                        results[key][3] += int(row['totalNewVolumeInLoc'])
+
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['System', 'Refactoring', 'average totalNewFiles', 'average totalNewVolumeInMonths', 'average totalNewVolumeInLoc'])
+        for (system, refactoring), (count, total_files, total_months, total_loc) in results.items():
+            if(count!=0):
+                writer.writerow([system, refactoring, total_files / count, total_months / count, total_loc / count])
+            else:
+                writer.writerow([system, refactoring, 0, 0, 0])
+
+def legacy_write_churn(input_directory):
+    for system in sorted(os.listdir(input_directory)):
+        system_path = os.path.join(input_directory, system)
+        if system!='virtualenv' and os.path.isdir(system_path):
+            csv_file = os.path.join(system_path, 'churn-' + system + '.csv')
+            with open(csv_file, 'w', newline='') as cf:
+                    writer = csv.writer(cf)
+                    writer.writerow(write_churn.CHURN_HEADINGS)
+            for json_file in sorted(os.listdir(system_path)):
+                if json_file.endswith('.json'):
+                    refactoring = '-'.join(json_file.split('-')[2:]).rstrip('.json')
+                    refactoring_name, refactoring_number = refactoring.rsplit('-', 1)
+                    json_file_path = os.path.join(system_path, json_file)
+                    try:
+                        with open(json_file_path, 'r') as jf:
+                            data = json.load(jf)
+                    except json.JSONDecodeError:
+                        data = None
+                    with open(csv_file, 'a', newline='') as cf:
+                        writer = csv.writer(cf)
+                        if data is None or not data:
+                            writer.writerow([system, refactoring_name, refactoring_number, 0, 0, 0])
+                        else:
+                            writer.writerow([
+                                system,
+                                refactoring_name,
+                                refactoring_number,
+                                data.get('totalNewFiles', 0),
+                                data.get('totalNewVolumeInMonths', 0),
+                                data.get('totalNewVolumeInLoc', 0)
+                            ])
+
+################################
+# Benchmark
+################################
+
+def read_outputs(directory):
+    outputs = {}
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.csv'):
+                with open(os.path.join(root, file), 'rb') as f:
+                    outputs[os.path.relpath(os.path.join(root, file), directory)] = f.read()
+    return outputs
+
+def time_stages(stages):
+    times = []
+    for stage in stages:
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+    return times
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark write_churn.py against its previous implementation.')
+    parser.add_argument('--runs', type=int, default=100000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='churn_benchmark_')
+    try:
+        systems = max(1, args.runs // (len(REFACTORINGS) * RUNS_PER_REFACTORING))
+        make_churn_tree(directory, systems, REFACTORINGS, RUNS_PER_REFACTORING)
+        print(f'Created {systems} synthetic systems with {systems * len(REFACTORINGS) * RUNS_PER_REFACTORING} runs in {directory}')
+
+        legacy_times = time_stages([
+                                    lambda: legacy_write_churn(directory),
+                                    lambda: legacy_combine_churn_results(directory)
+                                    ])
+        legacy_outputs = read_outputs(directory)
+
+        runs = {}
+        current_times = time_stages([
+                                    lambda: runs.update(write_churn.read_churn_runs(directory)),
+                                    lambda: write_churn.write_churn(directory, runs),
+                                    lambda: write_churn.combine_churn_results(directory, runs)
+                                    ])
+        if read_outputs(directory) != legacy_outputs:
+            raise SystemExit('Outputs of the two implementations differ')
+
+        print('Outputs of both implementations are identical')
+        print(f'previous: write_churn {legacy_times[0]:.2f}s, combine_churn_results {legacy_times[1]:.2f}s, total {sum(legacy_times):.2f}s')
+        print(f'current:  read json {current_times[0]:.2f}s, write_churn {current_times[1]:.2f}s, '
+              f'combine_churn_results {current_times[2]:.2f}s, total {sum(current_times):.2f}s')
+        print(f'aggregation only: {legacy_times[1] / current_times[2]:.1f}x faster, end to end: {sum(legacy_times) / sum(current_times):.1f}x faster')
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+import os
+import json
+import argparse
+import numpy as np
+from write_churn import list_systems
+
+'''
+This file performs the following tasks:
+1. reads the newFiles list of every churn-<system>-<refactoring>-<n>.json once
+2. stores one row per (system, refactoring, run, file) in a numpy structured array, saved as
+    churn_files.npy next to churn.csv, with the repeated strings (systems, refactorings, paths,
+    statuses) kept once each in churn_files.json
+3. opens the index memory-mapped, so questions about single files are answered without
+    parsing any json file again, eg. the top N files by duplicationRiskDelta across all
+    inline refactorings
+
+To Run file:
+    python3 churn_file_index.py build ~/Desktop/uploads/Sahin/churn
+    python3 churn_file_index.py top ~/Desktop/uploads/Sahin/churn duplicationRiskDelta --refactoring inline -n 10
+
+This file is structured as follows:
+1. Layout of the index
+2. Building the index:
+    build_index()
+3. Reading the index:
+    load_index()
+    select_rows()
+    top_files()
+4. Main
+
+'''
+
+################################
+# Layout of the index
+################################
+
+INDEX_FILE = 'churn_files.npy'
+STRINGS_FILE = 'churn_files.json'
+
+RISK_DELTAS = [
+            'duplicationRiskDelta',
+            'unitSizeRiskDelta',
+            'unitComplexityRiskDelta',
+            'unitInterfacingRiskDelta',
+            'moduleCouplingRiskDelta'
+            ]
+
+# strings are stored as numbers pointing into the lists in churn_files.json
+FILE_DTYPE = np.dtype([
+                    ('system', np.int32),
+                    ('refactoring', np.int16),
+                    ('run', np.int16),
+                    ('path', np.int32),
+                    ('status', np.int8),
+                    ('moduleId', np.int64),
+                    ('volumeInMonths', np.float64)
+                    ] + [(delta, np.float64) for delta in RISK_DELTAS]) # missing deltas are NaN
+
+################################
+# Building the index
+################################
+
+# position of a string in its list, adding it the first time it is seen
+def intern(strings, positions, value):
+    if value not in positions:
+        positions[value] = len(strings)
+        strings.append(value)
+    return positions[value]
+
+def build_index(input_directory):
+    strings = {'system': [], 'refactoring': [], 'path': [], 'status': []}
+    positions = {name: {} for name in strings}
+    rows = []
+    for system in list_systems(input_directory): # only system folders (see write_churn.is_system)
+        system_path = os.path.join(input_directory, system) # eg. uploads/sahin/cbeanutils
+        for json_file in sorted(os.listdir(system_path)):
+            if json_file.endswith('.json'):
+                refactoring = '-'.join(json_file.split('-')[2:]).removesuffix('.json') # eg. inline-1
+                refactoring_name, refactoring_number = refactoring.rsplit('-', 1)
+                try:
+                    with open(os.path.join(system_path, json_file), 'r') as jf:
+                        data = json.load(jf)
+                except json.JSONDecodeError:  # empty file, refactoring was not implemented
+                    continue
+                for new_file in (data or {}).get('newFiles', []):
+                    rows.append((
+                                intern(strings['system'], positions['system'], system),
+                                intern(strings['refactoring'], positions['refactoring'], refactoring_name),
+                                int(refactoring_number),
+                                intern(strings['path'], positions['path'], new_file.get('path')),
+                                intern(strings['status'], positions['status'], new_file.get('status')),
+                                new_file.get('moduleId') or 0,
+                                new_file.get('volumeInMonths', np.nan)
+                                ) + tuple(
+                                    np.nan if new_file.get(delta) is None else new_file[delta]
+                                    for delta in RISK_DELTAS
+                                ))
+
+    index = np.array(rows, dtype=FILE_DTYPE)
+    np.save(os.path.join(input_directory, INDEX_FILE), index)
+    with open(os.path.join(input_directory, STRINGS_FILE), 'w') as f:
+        json.dump(strings, f)
+    print(f'Indexed {len(index)} files from {len(strings["system"])} systems')
+    return index, strings
+
+################################
+# Reading the index
+################################
+
+# the rows are memory-mapped, only the parts a query touches are read from disk
+def load_index(input_directory):
+    index = np.load(os.path.join(input_directory, INDEX_FILE), mmap_mode='r')
+    with open(os.path.join(input_directory, STRINGS_FILE), 'r') as f:
+        strings = json.load(f)
+    return index, strings
+
+# boolean mask of the rows matching the given system, refactoring and status names (None = all)
+def select_rows(index, strings, system=None, refactoring=None, status=None):
+    mask = np.ones(len(index), dtype=bool)
+    for column, value in (('system', system), ('refactoring', refactoring), ('status', status)):
+        if value is not None:
+            if value not in strings[column]:
+                return np.zeros(len(index), dtype=bool)
+            mask &= index[column] == strings[column].index(value)
+    return mask
+
+# the n rows with the largest (or smallest) value in column, as dicts with the strings filled in
+def top_files(index, strings, column, n=10, system=None, refactoring=None, status=None, smallest=False):
+    mask = select_rows(index, strings, system, refactoring, status)
+    values = index[column]
+    mask &= ~np.isnan(values)
+    candidates = np.flatnonzero(mask)
+    keys = values[candidates] if smallest else -values[candidates]
+    if len(candidates) > n:
+        # only sort the n best instead of all candidates
+        best = np.argpartition(keys, n)[:n]
+        candidates, keys = candidates[best], keys[best]
+    candidates = candidates[np.argsort(keys, kind='stable')]
+
+    results = []
+    for row in index[candidates]:
+        result = {name: row[name].item() for name in FILE_DTYPE.names}
+        for name in strings:
+            result[name] = strings[name][result[name]]
+        results.append(result)
+    return results
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or query the file-level churn index.')
+    parser.add_argument('command', choices=['build', 'top'])
+    parser.add_argument('input_directory', nargs='?', default='~/Desktop/uploads/Sahin/churn')
+    parser.add_argument('column', nargs='?', default='duplicationRiskDelta', choices=['volumeInMonths'] + RISK_DELTAS)
+    parser.add_argument('-n', type=int, default=10)
+    parser.add_argument('--system')
+    parser.add_argument('--refactoring')
+    parser.add_argument('--status', choices=['new', 'changed'])
+    parser.add_argument('--smallest', action='store_true', help='lowest values first instead of highest')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory)
+    if args.command == 'build':
+        build_index(input_directory)
+    else:
+        index, strings = load_index(input_directory)
+        for result in top_files(index, strings, args.column, args.n, args.system, args.refactoring, args.status, args.smallest):
+            print(f'{result[args.column]:>12.6f}  {result["system"]}  {result["refactoring"]}-{result["run"]}  {result["path"]}')
@@ -5,7 +5,7 @@
 # June 2024
 
 # Requirements to run file:
-#   1. write_results.py is in the current directory
+#   1. write_churn.py is in the same directory as this file
 #   2. Your SIGRID_CI_TOKEN is saved in your shell configuration file 
 #       (please see https://docs.sigrid-says.com/organization-integration/authentication-tokens.html 
 #       for instructions on creating a SigridCI Authentication Token)
@@ -16,54 +16,13 @@
 #   3. Save SSO token to environment variables as well
 #   3. chmod +x get_results.sh
 #   4. ./get_results.sh  
+#
+# run_pipeline.py (one folder up) runs this together with get_greenability.sh and write_correlation.py,
+# side by side and without creating a virtualenv every run:
+#   python3 ../run_pipeline.py
 
 
-# Lists
-SYSTEMS=(
-    'churn2-cbeanutils'
-    'churn2-ccollections'
-    'churn2-clang'
-    'churn2-jodaconvert'
-    'churn2-sudoku'
-    'churn2-ccli'
-    'churn2-cio'
-    'churn2-cmath'
-    'churn2-jodatime'
-    )
-
-REFACTORINGS=(
-    'extractmethod'
-    'extractvariable'
-    'inline'
-    'introduceindirection'
-    'introducepo'
-    'variabletofield'
-)
-
-CUSTOMER="sigdelivery"
-
-for SYSTEM in "${SYSTEMS[@]}"; do
-    cd ~/Desktop/uploads/Sahin/churn
-    SYSTEM_BASE="${SYSTEM#churn2-}" # get rid of 'churn2-' in the front
-    mkdir -p "${SYSTEM_BASE}" # make folder for each system
-    cd "${SYSTEM_BASE}"
-    for REFACTORING in "${REFACTORINGS[@]}"; do
-        for i in {1..4}; do
-            NAME="${SYSTEM}-${REFACTORING}-${i}"
-            NAME_BASE="${NAME#churn2-}"
-            echo $NAME
-
-            # get delta quality results
-            curl -X POST "https://sigrid-says.com/rest/analysis-results/changequality/sigdelivery/${NAME}" \
-            -H 'content-type: application/json' \
-            -H "cookie: ssoToken=${SSO_TOKEN}; XSRF-TOKEN=x" \
-            -H 'x-xsrf-token: x' \
-            --data-raw '{"startDate":"2024-06-11","endDate":"2024-06-13","changeQualityType":"NEW_AND_CHANGED_CODE_QUALITY"}'\
-            | jq . > "churn-${NAME#churn2-}.json"
-
-        done
-    done
-done
+SCRIPT_DIRECTORY="$(cd "$(dirname "$0")" && pwd)" # write_churn.py lives here, sigrid_fetch.py one folder up
 
 cd ~/Desktop/uploads/Sahin/churn
 
@@ -74,9 +33,11 @@ source virtualenv/bin/activate
 # install libraries
 pip3 install python-dotenv  
 pip3 install requests
+pip3 install numpy
 
-#python3 get_osh_results.py 
-python3 write_churn.py
-
-    
+# get delta quality results for every system, refactoring and run
+# (the systems, refactorings and dates fetched are listed in sigrid_fetch.py)
+python3 "${SCRIPT_DIRECTORY}/../sigrid_fetch.py" churn --output "$(pwd)"
 
+#python3 get_osh_results.py 
+python3 "${SCRIPT_DIRECTORY}/write_churn.py"
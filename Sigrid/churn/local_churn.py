@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from upload_churn import find_variants
+
+'''
+This file performs the following tasks:
+1. finds every refactored variant and the *original folder it was made from, in the layout
+    of upload_churn.sh / upload_churn.py:
+    | OUTER DIRECTORY  eg. ~/Repositories/Sahin
+    |----- DIRECTORY   eg. ~/Repositories/Sahin/CBeanutils
+    |---------- FOLDER eg. ~/Repositories/Sahin/CBeanutils/cBeanutils_extractmethod_1
+2. compares the source files of each variant with the original, without Sigrid:
+    - a file that is not in the original is new, a file with other content is changed
+    - only files with the same size as in the original are hashed, a different size is a change;
+        the original of each system is hashed once for all its variants
+    - LOC is counted like Sigrid: lines that are not blank and not only a comment
+    - volume in months is LOC / 750, like Sigrid
+3. writes one json file per variant with the totals the changequality endpoint returns, to the
+    same path get_churn.sh / sigrid_fetch.py use, so write_churn.py reads them as it is:
+        churn/<system>/churn-<system>-<refactoring>-<n>.json
+    {"totalNewFiles": ..., "totalNewVolumeInLoc": ..., "totalNewVolumeInMonths": ..., "newFiles": [...]}
+4. variants are compared on a pool of --workers processes
+
+This is an estimate of Sigrid's numbers: Sigrid leaves out test and generated code depending on
+the scope file of each system, here only the --extensions are counted and nothing is left out.
+
+To Run file:
+    python3 local_churn.py --source ~/Repositories/Sahin --output ~/Desktop/uploads/Sahin/churn --workers 8
+    python3 write_churn.py
+
+This file is structured as follows:
+1. Reading source files:
+    opens_block()
+    count_loc()
+    file_digest()
+    list_sources()
+    index_tree()
+2. Comparing trees:
+    variant_name()
+    compare_variant()
+3. Writing churn files:
+    churn_summary()
+    write_variant()
+    local_churn()
+4. Main
+
+'''
+
+LOC_PER_MONTH = 750 # Sigrid volume in person-months is lines of code / 750
+
+# extension: (line comment, block comment start, block comment end)
+COMMENTS = {
+            '.java': ('//', '/*', '*/'),
+            '.kt': ('//', '/*', '*/'),
+            '.scala': ('//', '/*', '*/'),
+            '.c': ('//', '/*', '*/'),
+            '.h': ('//', '/*', '*/'),
+            '.cpp': ('//', '/*', '*/'),
+            '.cs': ('//', '/*', '*/'),
+            '.js': ('//', '/*', '*/'),
+            '.ts': ('//', '/*', '*/'),
+            '.go': ('//', '/*', '*/'),
+            '.py': ('#', None, None),
+            '.rb': ('#', None, None),
+            '.sh': ('#', None, None),
+            '.r': ('#', None, None)
+            }
+
+DEFAULT_EXTENSIONS = ['.java']
+
+SKIPPED_DIRECTORIES = {'.git', 'target', 'build', 'node_modules'}
+
+################################
+# Reading source files
+################################
+
+# whether a block comment that starts after code on a line is still open at its end, eg. int a; /* start
+def opens_block(line, line_comment, block_start, block_end):
+    while block_start:
+        start = line.find(block_start)
+        if start < 0:
+            return False
+        comment = line.find(line_comment) if line_comment else -1
+        if 0 <= comment < start: # eg. int a; // not a /* block
+            return False
+        end = line.find(block_end, start + len(block_start))
+        if end < 0:
+            return True
+        line = line[end + len(block_end):]
+    return False
+
+# lines that are not blank and not only a comment
+def count_loc(content, extension):
+    line_comment, block_start, block_end = COMMENTS.get(extension, (None, None, None))
+    loc = 0
+    in_block = False
+    for line in content.decode('utf-8', errors='replace').splitlines():
+        line = line.strip()
+        code = False
+        while line:
+            if in_block:
+                end = line.find(block_end)
+                if end < 0:
+                    line = ''
+                else:
+                    in_block = False
+                    line = line[end + len(block_end):].strip()
+            elif line_comment and line.startswith(line_comment):
+                line = ''
+            elif block_start and line.startswith(block_start):
+                in_block = True
+                line = line[len(block_start):]
+            else:
+                code = True
+                in_block = opens_block(line, line_comment, block_start, block_end)
+                break
+        if code:
+            loc += 1
+    return loc
+
+def file_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+# {relative path: size} of the source files of a tree
+def list_sources(root, extensions):
+    sources = {}
+    for directory, directories, names in os.walk(root):
+        directories[:] = [d for d in directories if d not in SKIPPED_DIRECTORIES]
+        for name in names:
+            if os.path.splitext(name)[1].lower() in extensions:
+                path = os.path.join(directory, name)
+                sources[os.path.relpath(path, root).replace(os.sep, '/')] = os.path.getsize(path)
+    return sources
+
+# {relative path: (size, sha256)} of the source files of an original tree
+def index_tree(root, extensions):
+    index = {}
+    for relative, size in list_sources(root, extensions).items():
+        with open(os.path.join(root, relative), 'rb') as f:
+            index[relative] = (size, file_digest(f.read()))
+    return index
+
+################################
+# Comparing trees
+################################
+
+# ('cbeanutils', 'extractmethod', '1') for the folder cBeanutils_extractmethod_1, None for the original
+def variant_name(folder):
+    parts = os.path.basename(folder).replace('_', '-').lower().split('-')
+    if len(parts) < 3 or not parts[-1].isdigit():
+        return None
+    return parts[0], '-'.join(parts[1:-1]), parts[-1]
+
+# new and changed source files of a variant: [{'path': ..., 'status': 'new'/'changed', 'loc': ...}]
+def compare_variant(variant_root, original_index, extensions):
+    changes = []
+    for relative, size in sorted(list_sources(variant_root, extensions).items()):
+        original = original_index.get(relative)
+        if original is None:
+            status = 'new'
+        elif original[0] != size:
+            status = 'changed' # a different size is a change, without a hash
+        else:
+            status = None # the same size, changed only if the content is
+        with open(os.path.join(variant_root, relative), 'rb') as f:
+            content = f.read()
+        if status is None:
+            if file_digest(content) == original[1]: # only files of the same size are hashed
+                continue # identical to the original, its LOC is not counted
+            status = 'changed'
+        changes.append({'path': relative, 'status': status, 'loc': count_loc(content, os.path.splitext(relative)[1].lower())})
+    return changes
+
+################################
+# Writing churn files
+################################
+
+# the totals of the changequality endpoint for a list of changed files
+def churn_summary(changes):
+    loc = sum(change['loc'] for change in changes)
+    return {
+            'totalNewFiles': len(changes),
+            'totalNewVolumeInLoc': loc,
+            'totalNewVolumeInMonths': loc / LOC_PER_MONTH,
+            'newFiles': [{
+                        'path': change['path'],
+                        'status': change['status'],
+                        'volumeInLoc': change['loc'],
+                        'volumeInMonths': change['loc'] / LOC_PER_MONTH
+                        } for change in changes]
+            }
+
+# compare one variant with its original and write its churn file, returns (path, totals)
+def write_variant(variant, original_index, output_directory, extensions):
+    system, refactoring, number = variant_name(variant['folder'])
+    summary = churn_summary(compare_variant(variant['folder'], original_index, extensions))
+    path = os.path.join(output_directory, system, f'churn-{system}-{refactoring}-{number}.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.part', 'w') as f: # a crashed run never leaves half a json file behind
+        json.dump(summary, f, indent=2)
+    os.replace(path + '.part', path)
+    return path, summary['totalNewFiles'], summary['totalNewVolumeInLoc']
+
+# churn files for all variants in outer_directory, the originals are hashed once per system
+def local_churn(outer_directory, output_directory, extensions=DEFAULT_EXTENSIONS, workers=1):
+    extensions = {extension.lower() for extension in extensions}
+    variants = [variant for variant in find_variants(outer_directory, original=True) if variant_name(variant['folder'])]
+    originals = sorted({variant['source'] for variant in variants})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        indexes = dict(zip(originals, executor.map(index_tree, originals, [extensions] * len(originals))))
+        results = list(executor.map(write_variant, variants, [indexes[variant['source']] for variant in variants],
+                                    [output_directory] * len(variants), [extensions] * len(variants)))
+    for path, files, loc in results:
+        print(f'Churn written to {path}: {files} new or changed files, {loc} LOC')
+    return results
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Churn of refactored variants compared with their original, without Sigrid.')
+    parser.add_argument('--source', default='~/Repositories/Sahin', help='outer directory with one directory of variants per system')
+    parser.add_argument('--output', default='~/Desktop/uploads/Sahin/churn')
+    parser.add_argument('--extensions', nargs='+', default=DEFAULT_EXTENSIONS, help='source files that are compared')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    results = local_churn(os.path.expanduser(args.source), os.path.expanduser(args.output), args.extensions, args.workers)
+    print(f'Compared {len(results)} variants with their original')
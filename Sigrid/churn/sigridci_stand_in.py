@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+import os
+import json
+import time
+import random
+import argparse
+
+'''
+This file performs the following tasks:
+1. takes the same arguments as sigridci.py (--customer, --system, --source, --publish), so
+    upload_churn.py can be tried out without uploading anything to Sigrid
+2. counts the files in --source and waits a while, like an upload
+3. appends every upload to a json lines file (SIGRIDCI_STAND_IN_LOG), to check what was uploaded
+4. fails some uploads on purpose, to try out retries and resuming:
+    SIGRIDCI_STAND_IN_FAIL   share of uploads that fail (0 to 1)
+    SIGRIDCI_STAND_IN_DELAY  seconds an upload takes (default 0.1)
+
+To Run file:
+    python3 upload_churn.py --sigridci sigridci_stand_in.py
+    SIGRIDCI_STAND_IN_FAIL=0.3 python3 upload_churn.py --sigridci sigridci_stand_in.py --retries 2
+
+'''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stand-in for sigridci.py that does not upload anything.')
+    parser.add_argument('--customer', required=True)
+    parser.add_argument('--system', required=True)
+    parser.add_argument('--source', required=True)
+    parser.add_argument('--publish', action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f'Source directory {args.source} does not exist')
+        raise SystemExit(1)
+    files = sum(len(names) for _, _, names in os.walk(args.source))
+    print(f'Uploading {files} files of {args.source} as {args.customer}/{args.system}')
+    time.sleep(float(os.getenv('SIGRIDCI_STAND_IN_DELAY', '0.1')))
+
+    if random.random() < float(os.getenv('SIGRIDCI_STAND_IN_FAIL', '0')):
+        print('Upload failed (stand-in)')
+        raise SystemExit(1)
+    log_file = os.getenv('SIGRIDCI_STAND_IN_LOG')
+    if log_file:
+        with open(log_file, 'a') as f:
+            f.write(json.dumps({'customer': args.customer, 'system': args.system, 'source': args.source,
+                                'files': files, 'publish': args.publish}) + '\n')
+    print('Upload done (stand-in)')
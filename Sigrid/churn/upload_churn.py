@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+from manifest import file_hash
+from instrumentation import timer
+
+'''
+This file performs the following tasks:
+1. finds every system variant to upload, like upload_churn.sh:
+    | OUTER DIRECTORY  eg. ~/Repositories/Sahin
+    |----- DIRECTORY   eg. ~/Repositories/Sahin/CBeanutils
+    |---------- FOLDER eg. ~/Repositories/Sahin/CBeanutils/cBeanutils_original
+    every FOLDER is uploaded as system churn2-<folder name with _ replaced by ->
+    (with --original, the *original folder of its DIRECTORY is uploaded under the name of every variant,
+    for the first of the two uploads that churn is measured between)
+2. uploads the variants with sigridci.py --publish on a pool of --workers processes at a time,
+    retrying failed uploads --retries times
+3. writes every upload to a job journal (.upload_journal.jsonl in the outer directory), one json line
+    per event, flushed straight away: a crashed or interrupted run resumes where it stopped, as every
+    variant that finished is skipped the next time
+4. hashes the source tree of every variant (all files except .git), and skips variants whose tree
+    did not change since their last successful upload (use --force to upload everything again)
+5. prints the progress and time of every upload, and the slowest uploads at the end
+    (the output of sigridci.py goes to .upload_logs/<system>.log next to the journal)
+
+sigridci_stand_in.py takes the same arguments as sigridci.py without uploading anything, to try
+this file out:
+    python3 upload_churn.py --sigridci sigridci_stand_in.py
+
+To Run file:
+1. Your SIGRID_CI_TOKEN is saved in your shell configuration file
+2. python3 upload_churn.py --source ~/Repositories/Sahin --workers 4
+   python3 upload_churn.py --source ~/Repositories/Sahin --original     (first upload)
+   python3 upload_churn.py --source ~/Repositories/Sahin --dry-run      (list what would be uploaded)
+
+This file is structured as follows:
+1. Finding variants:
+    find_variants()
+    tree_hash()
+2. Job journal:
+    read_journal()
+    Journal
+3. Uploading:
+    upload_command()
+    upload_variant()
+    upload_all()
+4. Main
+
+'''
+
+DEFAULT_SIGRIDCI = '~/sigridci/sigridci/sigridci/sigridci.py'
+JOURNAL_FILE = '.upload_journal.jsonl'
+SKIPPED_DIRECTORIES = {'.git'}
+
+################################
+# Finding variants
+################################
+
+# one upload per variant folder: {'system': 'churn2-cbeanutils-original', 'folder': ..., 'source': folder that is uploaded}
+def find_variants(outer_directory, original=False):
+    variants = []
+    for directory in sorted(os.listdir(outer_directory)):
+        directory_path = os.path.join(outer_directory, directory)
+        if directory.startswith('.') or not os.path.isdir(directory_path):
+            continue
+        folders = [folder for folder in sorted(os.listdir(directory_path))
+                   if not folder.startswith('.') and os.path.isdir(os.path.join(directory_path, folder))]
+        originals = [folder for folder in folders if folder.endswith('original')]
+        if original and not originals:
+            print(f'No original folder in {directory_path}, its variants are left out')
+            continue
+        for folder in folders:
+            source = originals[-1] if original else folder
+            variants.append({
+                            'system': 'churn2-' + folder.replace('_', '-'),
+                            'folder': os.path.join(directory_path, folder),
+                            'source': os.path.join(directory_path, source)
+                            })
+    return variants
+
+# sha256 of the relative path and content of every file in a source tree
+def tree_hash(source):
+    files = []
+    for root, directories, names in os.walk(source):
+        directories[:] = sorted(d for d in directories if d not in SKIPPED_DIRECTORIES)
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                files.append((os.path.relpath(path, source), path))
+    digest = hashlib.sha256()
+    for relative, path in sorted(files):
+        digest.update(f'{relative}\0{file_hash(path)}\n'.encode())
+    return digest.hexdigest()
+
+################################
+# Job journal
+################################
+
+# last event of every system in the journal; a line cut off by a crash is ignored
+def read_journal(journal_file):
+    last = {}
+    if not os.path.isfile(journal_file):
+        return last
+    with open(journal_file, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            last[event['system']] = event
+    return last
+
+# appends events to the journal, one line at a time, from any number of threads
+class Journal:
+    def __init__(self, journal_file):
+        os.makedirs(os.path.dirname(os.path.abspath(journal_file)), exist_ok=True)
+        self.file = open(journal_file, 'a')
+        self.lock = threading.Lock()
+
+    def write(self, system, status, **fields):
+        event = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'system': system, 'status': status, **fields}
+        with self.lock:
+            self.file.write(json.dumps(event) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno()) # an event is on disk before the next upload starts
+
+    def close(self):
+        self.file.close()
+
+################################
+# Uploading
+################################
+
+def upload_command(sigridci, customer, variant):
+    command = [sys.executable, sigridci] if sigridci.endswith('.py') else [sigridci]
+    return command + ['--customer', customer, '--system', variant['system'], '--source', variant['source'], '--publish']
+
+# hash, skip or upload one variant; returns (status, seconds)
+# (a variant is only skipped if its last upload finished, an upload that was interrupted or failed is done again)
+def upload_variant(variant, sigridci, customer, journal, last, log_directory, retries=1, force=False, dry_run=False):
+    system = variant['system']
+    start = time.perf_counter()
+    source_hash = tree_hash(variant['source'])
+    previous = last.get(system, {})
+    if not force and previous.get('status') == 'uploaded' and previous.get('hash') == source_hash and previous.get('source') == variant['source']:
+        return 'unchanged', time.perf_counter() - start
+    if dry_run:
+        return 'to upload', time.perf_counter() - start
+
+    log_file = os.path.join(log_directory, system + '.log')
+    command = upload_command(sigridci, customer, variant)
+    for attempt in range(1, retries + 2):
+        journal.write(system, 'started', source=variant['source'], hash=source_hash, attempt=attempt)
+        attempt_start = time.perf_counter()
+        with timer('upload', system), open(log_file, 'a') as log:
+            log.write(f'$ {" ".join(command)}\n')
+            log.flush()
+            result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - attempt_start
+        if result.returncode == 0:
+            journal.write(system, 'uploaded', source=variant['source'], hash=source_hash, attempt=attempt, seconds=round(seconds, 3))
+            return 'uploaded', time.perf_counter() - start
+        journal.write(system, 'failed', source=variant['source'], hash=source_hash, attempt=attempt,
+                      seconds=round(seconds, 3), returncode=result.returncode)
+        if attempt <= retries:
+            time.sleep(2 ** (attempt - 1)) # back off before trying again
+    return 'failed', time.perf_counter() - start
+
+# upload every variant on a pool of workers, returns {system: (status, seconds)}
+def upload_all(variants, sigridci, customer, journal_file, workers=4, retries=1, force=False, dry_run=False):
+    last = read_journal(journal_file)
+    interrupted = [system for system, event in last.items() if event['status'] == 'started']
+    if interrupted:
+        print(f'Resuming: {len(interrupted)} uploads did not finish last time ({", ".join(sorted(interrupted))})')
+    log_directory = os.path.join(os.path.dirname(os.path.abspath(journal_file)), '.upload_logs')
+    os.makedirs(log_directory, exist_ok=True)
+    journal = Journal(journal_file)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(upload_variant, variant, sigridci, customer, journal, last, log_directory,
+                                       retries, force, dry_run): variant for variant in variants}
+            for done, future in enumerate(as_completed(futures), 1):
+                system = futures[future]['system']
+                try:
+                    results[system] = future.result()
+                except Exception as error: # eg. a source folder that cannot be read
+                    journal.write(system, 'failed', error=str(error))
+                    results[system] = ('failed', 0.0)
+                status, seconds = results[system]
+                print(f'{status.capitalize()}: {done}/{len(variants)} {system} ({seconds:.1f}s)')
+    finally:
+        journal.close()
+    return results
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload all system variants to Sigrid, in parallel and resumable.')
+    parser.add_argument('--source', default='~/Repositories/Sahin', help='outer directory with one directory of variants per system')
+    parser.add_argument('--original', action='store_true', help='upload the original folder under the name of every variant')
+    parser.add_argument('--customer', default='sigdelivery')
+    parser.add_argument('--sigridci', default=DEFAULT_SIGRIDCI, help='sigridci.py, or a stand-in with the same arguments')
+    parser.add_argument('--workers', type=int, default=4, help='uploads running at the same time')
+    parser.add_argument('--retries', type=int, default=1, help='times a failed upload is tried again')
+    parser.add_argument('--journal', help=f'job journal (default: {JOURNAL_FILE} in the source directory)')
+    parser.add_argument('--force', action='store_true', help='also upload variants that did not change since their last upload')
+    parser.add_argument('--dry-run', action='store_true', help='only list the variants that would be uploaded')
+    args = parser.parse_args()
+
+    outer_directory = os.path.expanduser(args.source)
+    journal_file = os.path.expanduser(args.journal or os.path.join(outer_directory, JOURNAL_FILE))
+    variants = find_variants(outer_directory, args.original)
+    print(f'Found {len(variants)} variants in {outer_directory}')
+
+    start = time.perf_counter()
+    results = upload_all(variants, os.path.expanduser(args.sigridci), args.customer, journal_file,
+                         args.workers, args.retries, args.force, args.dry_run)
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print(f'{", ".join(f"{count} {status}" for status, count in sorted(counts.items()))} in {time.perf_counter() - start:.1f}s')
+    slowest = sorted(((seconds, system) for system, (status, seconds) in results.items() if status != 'unchanged'), reverse=True)[:5]
+    for seconds, system in slowest:
+        print(f'  {seconds:8.1f}s  {system}')
+    raise SystemExit(1 if counts.get('failed') else 0)
@@ -3,53 +3,32 @@
 ###
 # TODO before uploading:
 # 1. make sure YAML files are correct and in correct directories
-# 2. remove already uploaded systems from directory
-# 3. Run file using:
+# 2. Run file using:
 #       chmod +x upload_churn.sh
-#       ./upload_churn.sh  
+#       ./upload_churn.sh              (upload every variant)
+#       ./upload_churn.sh --original   (upload the original files under the names of the refactored versions)
 
 # Remember: to view churn, upload the two versions on different days
+#
+# Uploads are done by upload_churn.py, a few at a time (--workers). Variants that were uploaded
+# before and did not change are skipped, so there is no need to remove them from the directory,
+# and a run that stopped halfway continues where it stopped when started again.
 ###
 
 ########################
 # Code for uploading Sahin systems
 ########################
 
-cd ~
-cd sigridci
+SCRIPT_DIRECTORY="$(cd "$(dirname "$0")" && pwd)" # upload_churn.py lives here
 
 OUTER_DIRECTORY="/Users/kirstengericke/Repositories/Sahin" #directory storing all system to be uploaded
-LOCATIONS=() # Array to store paths to folders to upload to sigrid
 
 # | OUTER DIRECTORY  eg. /Users/kirstengericke/Repositories/Sahin
 # |----- DIRECTORY   eg. /Users/kirstengericke/Repositories/Sahin/CBeanutils
 # |---------- FOLDER eg. /Users/kirstengericke/Repositories/Sahin/CBeanutils/cBeanutils_original
 
-COUNT=0
-for DIRECTORY in "$OUTER_DIRECTORY"/*/; do
-    DIRECTORY=${DIRECTORY%/}
-    # this is needed for original uploads
-    for FOLDER in "$DIRECTORY"/*/; do
-        if [[ "$FOLDER" == *original/ ]]; then
-            ORIGINAL_LOCATION="$FOLDER"
-        fi
-    done 
-    for FOLDER in "$DIRECTORY"/*/; do
-        echo "$FOLDER"
-        # upload original files to sigrid but name them the names of the refactored versions
-        for LOCATION in "${FOLDER[@]}"; do
-            BASENAME=$(basename "$LOCATION" | tr '_' '-') # Extract the basename and replace underscores with hyphens
-            SYSTEM="churn2-$BASENAME" # Construct the SYSTEM variable
-            echo "Uploading $SYSTEM from $LOCATION"
-            # NB! Change the location to either LOCATION or ORIGINAL_LOCATION
-            ./sigridci/sigridci/sigridci.py --customer sigdelivery --system ${SYSTEM} --source ${LOCATION} --publish
-            ((COUNT++))
-            echo "Uploaded: $COUNT/206"
-       done
-    done
-done
-
-
-
-
-
+python3 "${SCRIPT_DIRECTORY}/upload_churn.py" \
+    --source "$OUTER_DIRECTORY" \
+    --sigridci ~/sigridci/sigridci/sigridci/sigridci.py \
+    --customer sigdelivery \
+    "$@"
@@ -4,106 +4,215 @@
 
 #!/usr/bin/python3
 import os
+import sys
 import json
 import csv
-import requests
-import datetime
-from dotenv import load_dotenv
-from collections import defaultdict
-
-def combine_churn_results(input_directory):
-    #results = defaultdict(lambda: defaultdict(lambda: [0, 0, 0, 0]))  # [count, totalNewFiles, totalNewVolumeInMonths, totalNewVolumeInLoc]
-    results = defaultdict(lambda: [0, 0, 0, 0])  # [count, totalNewFiles, totalNewVolumeInMonths, totalNewVolumeInLoc]
-    
-    
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+from manifest import empty_manifest, load_manifest, save_manifest, changed_systems, update_system
+import instrumentation
+from instrumentation import timer, count_bytes
+
+# All churn-<system>-<refactoring>-<n>.json summaries are read once into one set of columns,
+# the per-system csv files are written from it in one go, and the averages per
+# (System, Refactoring) in churn.csv are calculated with vectorised group-bys.
+# Only systems whose json files changed since the last run are read again (see .churn_manifest.json),
+# use --full to read every system again.
+# With --metrics run.json (or run.prom), the time and bytes of every stage and system are written
+# at the end (see instrumentation.py).
+
+CHURN_HEADINGS = [
+                'System',
+                'Refactoring',
+                'Refactoring Number',
+                'totalNewFiles',
+                'totalNewVolumeInMonths',
+                'totalNewVolumeInLoc'
+                ]
+
+# a system folder holds the json files of the refactoring runs of one system, eg. cio/churn-cio-extractmethod-1.json;
+# other folders (virtualenv, __pycache__, ...) are not systems
+def is_system(input_directory, system):
+    try:
+        names = os.listdir(os.path.join(input_directory, system)) # eg. uploads/sahin/cbeanutils
+    except OSError: # a file, or removed
+        return False
+    return any(name.startswith(f'churn-{system}-') and name.endswith('.json') for name in names)
+
+def list_systems(input_directory):
+    return [system for system in sorted(os.listdir(input_directory)) if is_system(input_directory, system)]
+
+# the rows of churn-<system>.csv, as read from the json files of one system
+def read_system_runs(input_directory, system):
+    with timer('churn_read', system):
+        return read_system_files(input_directory, system)
+
+def read_system_files(input_directory, system):
+    system_path = os.path.join(input_directory, system)
+    rows = []
+    for json_file in sorted(os.listdir(system_path)):
+        if json_file.endswith('.json'):
+            rows.append(read_run_file(system_path, system, json_file))
+    return rows
+
+# one row of churn-<system>.csv, from the json file of one refactoring run
+def read_run_file(system_path, system, json_file):
+    refactoring = '-'.join(json_file.split('-')[2:]).removesuffix('.json') # get rid of system name at beginning and .json at end
+    refactoring_name, refactoring_number = refactoring.rsplit('-', 1)  # Split the refactoring name and number
+    json_file_path = os.path.join(system_path, json_file)
+
+    with open(json_file_path, 'rb') as jf:
+        content = jf.read()
+    count_bytes('churn_read', len(content), system)
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:  # Handle empty or invalid JSON files
+        data = None
+
+    if data is None or not data:
+        return [system, refactoring_name, refactoring_number, 0, 0, 0]
+    return [
+            system,
+            refactoring_name,
+            refactoring_number,
+            data.get('totalNewFiles', 0),
+            data.get('totalNewVolumeInMonths', 0),
+            data.get('totalNewVolumeInLoc', 0)
+            ]
+
+# Columns of all runs:
+#   runs['rows'] are the rows of the per-system csv files, as read from the json files
+#   runs['system'], runs['refactoring'], runs['files'], runs['months'], runs['loc'] are numpy arrays
+def runs_from_rows(rows):
+    return {
+            'rows': rows,
+            'system': np.array([row[0] for row in rows], dtype=str),
+            'refactoring': np.array([row[1] for row in rows], dtype=str),
+            'files': np.array([row[3] for row in rows], dtype=np.int64),
+            'months': np.array([row[4] for row in rows], dtype=np.float64),
+            'loc': np.array([row[5] for row in rows], dtype=np.int64)
+            }
+
+# Read every churn json file of every system into columns
+def read_churn_runs(input_directory):
+    rows = []
+    with timer('churn_read'):
+        for system in list_systems(input_directory):
+            rows += read_system_runs(input_directory, system)
+        return runs_from_rows(rows)
+
+# Like read_churn_runs(), but only the systems whose json files changed since the last run are
+# read again, the rows of the other systems come from the manifest
+def read_changed_runs(input_directory, manifest):
+    systems = list_systems(input_directory)
+    with timer('manifest'):
+        changed, states, removed = changed_systems(input_directory, systems, manifest)
+    rows = []
+    with timer('churn_read'):
+        for system in systems:
+            if system in changed:
+                system_rows = read_system_runs(input_directory, system)
+            else:
+                system_rows = manifest['systems'][system]['result']
+            update_system(manifest, system, states[system], system_rows)
+            rows += system_rows
+        for system in removed:
+            del manifest['systems'][system]
+        instrumentation.count('churn_read', 'reused', len(systems) - len(changed))
+        return runs_from_rows(rows), changed, removed
+
+# one bulk write of churn-<system>.csv per system (only the given systems, if any are given)
+def write_churn(input_directory, runs=None, systems=None):
+    if runs is None:
+        runs = read_churn_runs(input_directory)
+    with timer('churn_write'):
+        rows_per_system = {}
+        for row in runs['rows']:
+            rows_per_system.setdefault(row[0], []).append(row)
+        for system in list_systems(input_directory) if systems is None else systems:
+            csv_file = os.path.join(input_directory, system, 'churn-' + system + '.csv')  # eg. cbeanutils.csv
+            with open(csv_file + '.part', 'w', newline='') as cf:
+                writer = csv.writer(cf)
+                writer.writerow(CHURN_HEADINGS)
+                writer.writerows(rows_per_system.get(system, []))
+            os.replace(csv_file + '.part', csv_file)
+            count_bytes('churn_write', os.path.getsize(csv_file), system)
+    return runs
+
+def combine_churn_results(input_directory, runs=None):
+    if runs is None:
+        runs = read_churn_runs(input_directory)
+    with timer('churn_combine'):
+        combine_runs(input_directory, runs)
+
+def combine_runs(input_directory, runs):
     output_file = os.path.join(input_directory, 'churn.csv')
-    for system in sorted(os.listdir(input_directory)):
-        system_path = os.path.join(input_directory, system)
-        if system != 'virtualenv' and os.path.isdir(system_path):
-            csv_file = os.path.join(system_path, 'churn-' + system + '.csv')  # eg. cbeanutils.csv
-            if os.path.isfile(csv_file):
-                with open(csv_file, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        key = (row['System'], row['Refactoring'])
-
-                        if (row['Refactoring']!="extractvariable"):
-                            results[key][0] += 1  # Increment count
-                        else:
-                            # account for extractvariable not being implemented 4 times in all systems
-                            if(int(row['totalNewFiles'])!=0): 
-                                results[key][0] += 1  # Increment count
-
-                        results[key][1] += int(row['totalNewFiles'])
-                        results[key][2] += float(row['totalNewVolumeInMonths'])
-                        results[key][3] += int(row['totalNewVolumeInLoc'])
-    
-    with open(output_file, 'w', newline='') as f:
+    rows = average_runs(runs)
+    with open(output_file + '.part', 'w', newline='') as f: # a reader never sees half a csv file
         writer = csv.writer(f)
         writer.writerow(['System', 'Refactoring', 'average totalNewFiles', 'average totalNewVolumeInMonths', 'average totalNewVolumeInLoc'])
-        
-        for (system, refactoring), (count, total_files, total_months, total_loc) in results.items():
-            if(count!=0): # only if the refactoring was implemented at least once
-                avg_files = total_files / count
-                avg_months = total_months / count
-                avg_loc = total_loc / count
-                writer.writerow([system, refactoring, avg_files, avg_months, avg_loc])
-            else:
-                writer.writerow([system, refactoring, 0, 0, 0])
-         
-
-def write_churn(input_directory):
-    for system in sorted(os.listdir(input_directory)): 
-        system_path = os.path.join(input_directory, system) # eg. uploads/sahin/cbeanutils
-        if system!='virtualenv' and os.path.isdir(system_path): # only look at folders not files
-            csv_file = os.path.join(system_path, 'churn-' + system + '.csv')  # eg. cbeanutils.csv
-            with open(csv_file, 'w', newline='') as cf:
-                    writer = csv.writer(cf)
-                    writer.writerow([
-                                    'System',
-                                    'Refactoring', 
-                                    'Refactoring Number', 
-                                    'totalNewFiles', 
-                                    'totalNewVolumeInMonths', 
-                                    'totalNewVolumeInLoc'
-                                    ]) 
-            for json_file in sorted(os.listdir(system_path)): 
-                if json_file.endswith('.json'):
-                    
-                    refactoring = '-'.join(json_file.split('-')[2:]).rstrip('.json') # get rid of system name at beginning and .json at end
-                    refactoring_name, refactoring_number = refactoring.rsplit('-', 1)  # Split the refactoring name and number
-                    json_file_path = os.path.join(system_path, json_file)
-                    
-                    try:
-                        with open(json_file_path, 'r') as jf:
-                            data = json.load(jf)
-                    except json.JSONDecodeError:  # Handle empty or invalid JSON files
-                        data = None
-
-                    with open(csv_file, 'a', newline='') as cf:
-                        writer = csv.writer(cf)
-                        if data is None or not data:
-                            writer.writerow([
-                                system, 
-                                refactoring_name, 
-                                refactoring_number,  
-                                0, 0, 0
-                            ])
-                        else:
-                            writer.writerow([
-                                system, 
-                                refactoring_name, 
-                                refactoring_number, 
-                                data.get('totalNewFiles', 0), 
-                                data.get('totalNewVolumeInMonths', 0), 
-                                data.get('totalNewVolumeInLoc', 0)
-                            ])
+        writer.writerows(rows)
+    os.replace(output_file + '.part', output_file)
+    instrumentation.count('churn_combine', 'rows', len(rows))
+
+# the rows of churn.csv: the average runs of every (System, Refactoring), in order of first appearance
+def average_runs(runs):
+    # one group per (System, Refactoring), numbered in order of first appearance
+    systems, system_code = np.unique(runs['system'], return_inverse=True)
+    refactorings, refactoring_code = np.unique(runs['refactoring'], return_inverse=True)
+    keys = system_code * len(refactorings) + refactoring_code
+    unique_keys, first_index, group = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    groups = len(unique_keys)
+
+    # account for extractvariable not being implemented 4 times in all systems:
+    # runs without new files are left out of its average
+    implemented = (runs['refactoring'] != 'extractvariable') | (runs['files'] != 0)
+
+    # bincount adds the runs in file order, so sums are the same as adding them one by one
+    count = np.bincount(group, weights=implemented, minlength=groups)
+    total_files = np.bincount(group, weights=runs['files'], minlength=groups)
+    total_months = np.bincount(group, weights=runs['months'], minlength=groups)
+    total_loc = np.bincount(group, weights=runs['loc'], minlength=groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_files = (total_files / count).tolist()
+        average_months = (total_months / count).tolist()
+        average_loc = (total_loc / count).tolist()
+
+    rows = []
+    for i in order:
+        system = systems[unique_keys[i] // len(refactorings)]
+        refactoring = refactorings[unique_keys[i] % len(refactorings)]
+        if count[i] != 0: # only if the refactoring was implemented at least once
+            rows.append([system, refactoring, average_files[i], average_months[i], average_loc[i]])
+        else:
+            rows.append([system, refactoring, 0, 0, 0])
+    return rows
 
 ################################
 # Main
 ################################
 
 if __name__ == "__main__":
-    input_directory = os.path.expanduser('~/Desktop/uploads/Sahin/churn')
-    write_churn(input_directory)
-    combine_churn_results(input_directory)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Write churn results from Sigrid change quality exports.')
+    parser.add_argument('--full', action='store_true', help='read every system again, not only the ones that changed')
+    parser.add_argument('--input', default='~/Desktop/uploads/Sahin/churn', help='directory with one folder of json files per system')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
+    input_directory = os.path.expanduser(args.input)
+
+    # the manifest remembers the json files and rows of the last run
+    manifest_file = os.path.join(input_directory, '.churn_manifest.json')
+    manifest = empty_manifest() if args.full else load_manifest(manifest_file)
+    runs, changed, removed = read_changed_runs(input_directory, manifest)
+    print(f'{len(changed)} of {len(manifest["systems"])} systems changed since the last run')
+
+    if changed or removed or not os.path.isfile(os.path.join(input_directory, 'churn.csv')):
+        write_churn(input_directory, runs, changed)
+        combine_churn_results(input_directory, runs)
+    save_manifest(manifest_file, manifest)
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'greenability')) # readers and correlation of write_correlation.py
+from write_correlation import spearman_matrix, spearman_p_values, REFACTORING_LABELS, CHURN_COLUMN
+
+'''
+This file performs the following tasks:
+1. reads churn.csv, greenability_scores.csv and the correlation results of write_correlation.py
+    (metric_correlation_results.csv, property_correlation_results.csv)
+2. describes every chart as a plot spec: the kind of chart, its labels and the numbers it shows
+    - the six heatmaps of R/heatmaps/correlation.R: metric.png, metric_pvalue.png, metric_pvalue_005.png,
+      properties.png, properties_pvalue.png, properties_pvalue_005.png
+    - ratio_vs_greenability_<refactoring>.png: Greenability score vs. new volume / system volume of
+      every system, with a straight line and Spearman's rho (like Sigrid/correlation/churn.R)
+    - ratio_vs_average_greenability.png: the same, with the ratio averaged per system
+    - churn_<system>.png: average new volume in person-months of every refactoring of one system
+3. hashes every spec (its numbers included), and only draws the charts whose hash is not the one in
+    .chart_cache.json, or whose png is missing; pngs of charts that are no longer made are removed
+4. draws the charts in --workers processes, each png is written to a temporary file first and replaced
+
+matplotlib is only needed when a chart has to be drawn, a run in which nothing changed does not import it.
+
+To Run file:
+    python3 render_charts.py
+    python3 render_charts.py --workers 8 --output ~/Desktop/uploads/Sahin/correlation/graphs
+
+This file is structured as follows:
+1. Reading the data:
+    read_rows()
+    read_scores()
+    read_results()
+2. Plot specs:
+    heatmap_specs()
+    scatter_spec()
+    ratio_specs()
+    system_specs()
+    chart_specs()
+3. Drawing charts:
+    draw_heatmap()
+    draw_scatter()
+    draw_bars()
+    render_chart()
+4. Cache:
+    spec_hash()
+    load_cache()
+    save_cache()
+    render_charts()
+5. Main
+
+'''
+
+CHART_VERSION = 1 # change when the drawing code changes, so every chart is drawn again
+CACHE_FILE = '.chart_cache.json'
+
+HEATMAPS = {'metric': 'metric_correlation_results.csv', 'properties': 'property_correlation_results.csv'}
+
+################################
+# Reading the data
+################################
+
+def read_rows(csv_file):
+    with open(csv_file, 'r', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError): # empty cell or NA
+        return np.nan
+
+# {system: {column: value}} of greenability_scores.csv
+def read_scores(scores_file):
+    return {row['System Name']: {column: to_float(value) for column, value in row.items() if column != 'System Name'}
+            for row in read_rows(scores_file)}
+
+# rows of (Metric, Refactoring, cor_value, p_value) of a results csv of write_correlation.py
+def read_results(results_file):
+    return [(row['Metric'], row['Refactoring'], to_float(row['cor_value']), to_float(row['p_value'])) for row in read_rows(results_file)]
+
+################################
+# Plot specs
+################################
+
+def nan_list(values):
+    return [None if np.isnan(value) else float(value) for value in values]
+
+# cor_value, p_value and cor_value where p < 0.05, as a metric x refactoring grid
+def heatmap_specs(name, results):
+    metrics = sorted({row[0] for row in results})
+    refactorings = list(dict.fromkeys(row[1] for row in results))
+    cor_value = np.full((len(metrics), len(refactorings)), np.nan)
+    p_value = np.full((len(metrics), len(refactorings)), np.nan)
+    for metric, refactoring, cor, p in results:
+        cor_value[metrics.index(metric), refactorings.index(refactoring)] = cor
+        p_value[metrics.index(metric), refactorings.index(refactoring)] = p
+    significant = np.where(p_value < 0.05, cor_value, np.nan)
+    heatmap = {'kind': 'heatmap', 'rows': metrics, 'columns': [REFACTORING_LABELS.get(refactoring, refactoring) for refactoring in refactorings]}
+    return {
+            f'{name}.png': {**heatmap, 'title': 'Spearman Correlation', 'values': [nan_list(row) for row in cor_value],
+                            'limits': [-1, 1], 'colormap': 'bwr'},
+            f'{name}_pvalue.png': {**heatmap, 'title': 'p-value', 'values': [nan_list(row) for row in p_value],
+                                   'limits': [0, 1], 'colormap': 'viridis_r'},
+            f'{name}_pvalue_005.png': {**heatmap, 'title': 'Spearman Correlation (p < 0.05)', 'values': [nan_list(row) for row in significant],
+                                       'limits': [-1, 1], 'colormap': 'bwr'}
+            }
+
+# points with a straight line and Spearman's rho and p, like cor.test(method = "spearman") in churn.R
+def scatter_spec(title, x_label, y_label, labels, x, y):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    present = ~np.isnan(x) & ~np.isnan(y)
+    labels, x, y = [label for label, keep in zip(labels, present) if keep], x[present], y[present]
+    spec = {'kind': 'scatter', 'title': title, 'x_label': x_label, 'y_label': y_label,
+            'labels': labels, 'x': x.tolist(), 'y': y.tolist(), 'line': None, 'legend': None}
+    if len(x) >= 3 and np.ptp(x) > 0:
+        spec['line'] = np.polyfit(x, y, 1).tolist()
+        rho, ties = spearman_matrix(x[None, :], y[None, :])
+        p_value = spearman_p_values(rho, ties, len(x))
+        spec['legend'] = f'rho = {rho[0, 0]:.3f}\np = {p_value[0, 0]:.3g}'
+    return spec
+
+# Greenability vs. new volume / system volume (person-months), per refactoring and averaged per system
+def ratio_specs(churn_rows, scores):
+    ratios = {} # refactoring: [(system, ratio, greenability)]
+    for row in churn_rows:
+        score = scores.get(row['System'])
+        if score is None or not score.get('Volume (PM)'):
+            continue # like the left join in churn.R, systems without scores get no ratio
+        ratio = to_float(row[CHURN_COLUMN]) / score['Volume (PM)']
+        ratios.setdefault(row['Refactoring'], []).append((row['System'], ratio, score['Greenability Score']))
+    specs = {}
+    for refactoring, points in ratios.items():
+        specs[f'ratio_vs_greenability_{refactoring}.png'] = scatter_spec(
+            REFACTORING_LABELS.get(refactoring, refactoring), 'Ratio of New Volume to PM', 'Greenability Score',
+            [system for system, _, _ in points], [ratio for _, ratio, _ in points], [score for _, _, score in points])
+    per_system = {}
+    for points in ratios.values():
+        for system, ratio, score in points:
+            per_system.setdefault(system, ([], score))[0].append(ratio)
+    systems = sorted(per_system)
+    specs['ratio_vs_average_greenability.png'] = scatter_spec(
+        'Greenability vs. Average Ratio', 'Average Ratio', 'Greenability Score', systems,
+        [np.nanmean(per_system[system][0]) if not np.isnan(per_system[system][0]).all() else np.nan for system in systems],
+        [per_system[system][1] for system in systems])
+    return specs
+
+# one bar per refactoring of a system
+def system_specs(churn_rows):
+    systems = {}
+    for row in churn_rows:
+        systems.setdefault(row['System'], []).append((REFACTORING_LABELS.get(row['Refactoring'], row['Refactoring']), to_float(row[CHURN_COLUMN])))
+    return {f'churn_{system}.png': {'kind': 'bars', 'title': system, 'y_label': 'Average New Volume (PM)',
+                                    'labels': [label for label, _ in bars], 'values': nan_list([value for _, value in bars])}
+            for system, bars in systems.items()}
+
+# {png name: spec} of every chart, heatmaps only for the results files that are there
+def chart_specs(churn_file, scores_file, results_directory):
+    churn_rows = read_rows(churn_file)
+    specs = {}
+    for name, results_file in HEATMAPS.items():
+        if os.path.isfile(os.path.join(results_directory, results_file)):
+            specs.update(heatmap_specs(name, read_results(os.path.join(results_directory, results_file))))
+        else:
+            print(f'No {results_file} in {results_directory}, run write_correlation.py for the {name} heatmaps')
+    specs.update(ratio_specs(churn_rows, read_scores(scores_file)))
+    specs.update(system_specs(churn_rows))
+    return specs
+
+################################
+# Drawing charts
+################################
+
+def draw_heatmap(figure, spec):
+    values = np.array([[np.nan if value is None else value for value in row] for row in spec['values']], dtype=np.float64)
+    axes = figure.add_subplot()
+    image = axes.imshow(np.ma.masked_invalid(values), cmap=spec['colormap'], vmin=spec['limits'][0], vmax=spec['limits'][1], aspect='auto')
+    axes.set_xticks(range(len(spec['columns'])), spec['columns'], rotation=45, ha='right')
+    axes.set_yticks(range(len(spec['rows'])), spec['rows'])
+    for (i, j), value in np.ndenumerate(values):
+        if not np.isnan(value):
+            axes.text(j, i, f'{value:.2f}', ha='center', va='center', fontsize=8)
+    figure.colorbar(image, ax=axes, label=spec['title'])
+    axes.set_title(spec['title'])
+    figure.set_size_inches(2 + 1.1 * len(spec['columns']), 1.5 + 0.35 * len(spec['rows']))
+
+def draw_scatter(figure, spec):
+    axes = figure.add_subplot()
+    axes.scatter(spec['x'], spec['y'], color='green')
+    for label, x, y in zip(spec['labels'], spec['x'], spec['y']):
+        axes.annotate(label, (x, y), textcoords='offset points', xytext=(3, 3), fontsize=7)
+    if spec['line']:
+        slope, intercept = spec['line']
+        line_x = np.array([min(spec['x']), max(spec['x'])])
+        axes.plot(line_x, slope * line_x + intercept, color='blue')
+    if spec['legend']:
+        axes.text(0.98, 0.98, spec['legend'], transform=axes.transAxes, ha='right', va='top')
+    axes.set(title=spec['title'], xlabel=spec['x_label'], ylabel=spec['y_label'])
+
+def draw_bars(figure, spec):
+    axes = figure.add_subplot()
+    axes.bar(range(len(spec['labels'])), [0 if value is None else value for value in spec['values']])
+    axes.set_xticks(range(len(spec['labels'])), spec['labels'], rotation=45, ha='right')
+    axes.set(title=spec['title'], ylabel=spec['y_label'])
+
+DRAW = {'heatmap': draw_heatmap, 'scatter': draw_scatter, 'bars': draw_bars}
+
+# draw one chart to png_file, runs in a worker process
+def render_chart(png_file, spec):
+    import matplotlib # only needed when a chart is drawn
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(7, 5))
+    DRAW[spec['kind']](figure, spec)
+    figure.tight_layout()
+    with open(png_file + '.part', 'wb') as f:
+        figure.savefig(f, format='png', dpi=150)
+    os.replace(png_file + '.part', png_file)
+    return png_file
+
+################################
+# Cache
+################################
+
+# hash of the spec, numbers included, and of the drawing code version
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps({'version': CHART_VERSION, 'spec': spec}, sort_keys=True).encode()).hexdigest()
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_cache(cache_file, cache):
+    with open(cache_file + '.part', 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(cache_file + '.part', cache_file)
+
+# draw the charts whose spec changed, returns (drawn, failed, removed) png names
+def render_charts(specs, output_directory, workers=1):
+    os.makedirs(output_directory, exist_ok=True)
+    cache_file = os.path.join(output_directory, CACHE_FILE)
+    cache = load_cache(cache_file)
+    hashes = {name: spec_hash(spec) for name, spec in specs.items()}
+    stale = [name for name in specs if cache.get(name) != hashes[name] or not os.path.isfile(os.path.join(output_directory, name))]
+
+    removed = [name for name in cache if name not in specs]
+    for name in removed: # charts of systems or refactorings that are gone
+        if os.path.isfile(os.path.join(output_directory, name)):
+            os.remove(os.path.join(output_directory, name))
+        del cache[name]
+
+    drawn, failed = [], []
+    if stale and importlib.util.find_spec('matplotlib') is None:
+        raise SystemExit(f'{len(stale)} charts changed, drawing them needs matplotlib (pip install matplotlib)')
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(render_chart, os.path.join(output_directory, name), specs[name]): name for name in stale}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as error: # the other charts are still drawn and cached
+                print(f'Failed to draw {name}: {error}')
+                failed.append(name)
+                continue
+            cache[name] = hashes[name]
+            drawn.append(name)
+    save_cache(cache_file, cache) # also when nothing changed, so run_pipeline.py sees the charts are up to date
+    return drawn, failed, removed
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Draw the correlation charts and heatmaps, only the ones whose data changed.')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/correlation/churn.csv')
+    parser.add_argument('--scores', default='~/Desktop/uploads/Sahin/correlation/greenability_scores.csv')
+    parser.add_argument('--results', default='~/Desktop/uploads/Sahin/correlation', help='directory with the results of write_correlation.py')
+    parser.add_argument('--output', default='~/Desktop/uploads/Sahin/correlation/graphs')
+    parser.add_argument('--workers', type=int, default=1, help='processes drawing charts')
+    parser.add_argument('--force', action='store_true', help='draw every chart again')
+    args = parser.parse_args()
+
+    output_directory = os.path.expanduser(args.output)
+    if args.force and os.path.isfile(os.path.join(output_directory, CACHE_FILE)):
+        os.remove(os.path.join(output_directory, CACHE_FILE))
+    specs = chart_specs(os.path.expanduser(args.churn), os.path.expanduser(args.scores), os.path.expanduser(args.results))
+    drawn, failed, removed = render_charts(specs, output_directory, args.workers)
+    print(f'Drew {len(drawn)} of {len(specs)} charts, {len(specs) - len(drawn) - len(failed)} were unchanged'
+          + (f', {len(failed)} failed' if failed else '') + (f', removed {len(removed)}' if removed else ''))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+import os
+import sys
+import csv
+import math
+import argparse
+import warnings
+from itertools import permutations
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'greenability')) # readers and ranks of write_correlation.py
+from write_correlation import read_metrics, read_churn, rank_rows, CHURN_COLUMN
+
+'''
+This file performs the following tasks:
+1. reads churn.csv and greenability_scores.csv (and optionally the metrics of combined_systems.csv)
+2. for every (metric, refactoring) pair, calculates the Spearman (or Pearson) correlation of the
+    metric with the average churn of the refactoring over the systems
+3. permutation test: the p-value is the share of relabellings of the churn values that correlate at
+    least as strongly (two-sided) as the real data
+    - exact, over all n! relabellings, when there are few systems (9 systems: 362,880)
+    - otherwise from --permutations random relabellings
+4. bootstrap: the confidence interval of each correlation is the percentile interval over
+    --bootstrap resamples of the systems (drawn with replacement)
+5. writes one line per pair to resampling_results.csv
+
+Resamples are generated as arrays of system indices, a chunk at a time, and all pairs are tested
+on a chunk with one matrix product. Chunks are spread over a pool of --workers processes. Every
+chunk has its own random generator, spawned from --seed, so the results do not depend on the
+number of workers.
+
+To Run file:
+    python3 resample_correlation.py
+    python3 resample_correlation.py --bootstrap 50000 --permutations 50000 --workers 8 --metrics combined_systems.csv
+
+This file is structured as follows:
+1. Reading the data:
+    read_scores()
+    read_data()
+2. Resampling one chunk:
+    normalise()
+    permutation_chunk()
+    exact_permutation_chunk()
+    bootstrap_chunk()
+3. Resampling all pairs:
+    resample()
+4. Writing results:
+    write_results()
+5. Main
+
+'''
+
+CHUNK_SIZE = 2000 # resamples per task
+
+################################
+# Reading the data
+################################
+
+# metric x system matrix of the numbers in greenability_scores.csv
+def read_scores(scores_file):
+    with open(scores_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)[1:]
+        rows = list(reader)
+    systems = [row[0] for row in rows]
+    matrix = np.array([[float(value) if value not in ('', 'NA') else np.nan for value in row[1:]] for row in rows], dtype=np.float64)
+    return matrix.reshape(len(rows), len(columns)).T, columns, systems
+
+# metrics and churn over the systems that are in both, as (metrics, metric names, churn, refactorings, systems)
+def read_data(scores_file, churn_file, metrics_file=None, churn_column=CHURN_COLUMN):
+    metrics, metric_names, metric_systems = read_scores(scores_file)
+    if metrics_file:
+        extra, extra_names, extra_systems = read_metrics(metrics_file)
+        systems = [system for system in metric_systems if system in extra_systems]
+        metrics = np.vstack([metrics[:, [metric_systems.index(s) for s in systems]],
+                             extra[:, [extra_systems.index(s) for s in systems]]])
+        metric_names, metric_systems = metric_names + extra_names, systems
+    churn, refactorings, churn_systems = read_churn(churn_file, churn_column)
+    systems = [system for system in metric_systems if system in churn_systems]
+    return (metrics[:, [metric_systems.index(s) for s in systems]], metric_names,
+            churn[:, [churn_systems.index(s) for s in systems]], refactorings, systems)
+
+################################
+# Resampling one chunk
+################################
+
+# rows scaled so the dot product of two rows is their correlation (of ranks for spearman)
+def normalise(values, method):
+    if method == 'spearman':
+        values, _ = rank_rows(values)
+    values = values - values.mean(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'): # constant rows have no correlation
+        return values / np.sqrt((values ** 2).sum(axis=-1, keepdims=True))
+
+# number of relabellings per pair that correlate at least as strongly as observed
+def count_extreme(x, y, orders, observed):
+    # x: metric x system, y: refactoring x system, orders: relabelling x system
+    statistics = np.einsum('ms,brs->bmr', x, y[:, orders].transpose(1, 0, 2))
+    return (np.abs(statistics) >= np.abs(observed) - 1e-12).sum(axis=0)
+
+# random relabellings of the churn values (permuting values also permutes their ranks, so no ranking is needed)
+def permutation_chunk(x, y, observed, seed, size):
+    rng = np.random.default_rng(seed)
+    orders = rng.permuted(np.tile(np.arange(x.shape[1]), (size, 1)), axis=1)
+    return count_extreme(x, y, orders, observed)
+
+# all relabellings that start with the given system
+def exact_permutation_chunk(x, y, observed, first):
+    n = x.shape[1]
+    rest = [i for i in range(n) if i != first]
+    counts = np.zeros(observed.shape, dtype=np.int64)
+    orders = permutations(rest)
+    while True:
+        chunk = np.array([order for _, order in zip(range(CHUNK_SIZE), orders)], dtype=np.int64).reshape(-1, n - 1)
+        if not len(chunk):
+            return counts
+        counts += count_extreme(x, y, np.hstack([np.full((len(chunk), 1), first), chunk]), observed)
+
+# correlations of every pair in size resamples of the systems drawn with replacement
+def bootstrap_chunk(metrics, churn, method, seed, size):
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, metrics.shape[1], size=(size, metrics.shape[1]))
+    x = normalise(metrics[:, samples].transpose(1, 0, 2).reshape(-1, metrics.shape[1]), method).reshape(size, len(metrics), -1)
+    y = normalise(churn[:, samples].transpose(1, 0, 2).reshape(-1, metrics.shape[1]), method).reshape(size, len(churn), -1)
+    return np.einsum('bms,brs->bmr', x, y)
+
+################################
+# Resampling all pairs
+################################
+
+# sizes of the chunks of a number of resamples
+def chunk_sizes(count, chunk_size=CHUNK_SIZE):
+    return [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+# correlation, p-value and confidence interval of all pairs of metrics and churn over the same systems
+def resample_group(executor, metrics, churn, method, permutation_count, bootstrap_count, confidence, max_exact, seed):
+    n = metrics.shape[1]
+    x, y = normalise(metrics, method), normalise(churn, method)
+    observed = x @ y.T
+    if n < 3:
+        nan = np.full(observed.shape, np.nan)
+        return observed, nan, 'none', 0, nan, nan
+
+    permutation_seed, bootstrap_seed = seed.spawn(2)
+    if math.factorial(n) <= max_exact:
+        tasks = [executor.submit(exact_permutation_chunk, x, y, observed, first) for first in range(n)]
+        p_method, resamples = 'exact', math.factorial(n)
+    else:
+        sizes = chunk_sizes(permutation_count)
+        tasks = [executor.submit(permutation_chunk, x, y, observed, child, size)
+                 for child, size in zip(permutation_seed.spawn(len(sizes)), sizes)]
+        p_method, resamples = 'monte carlo', permutation_count
+
+    sizes = chunk_sizes(bootstrap_count)
+    bootstraps = [executor.submit(bootstrap_chunk, metrics, churn, method, child, size)
+                  for child, size in zip(bootstrap_seed.spawn(len(sizes)), sizes)]
+
+    extreme = sum(task.result() for task in tasks)
+    if p_method == 'exact':
+        p_value = extreme / resamples
+    else:
+        p_value = (extreme + 1) / (resamples + 1) # the observed labelling counts as one of the relabellings
+
+    statistics = np.concatenate([task.result() for task in bootstraps]) if bootstraps else np.full((1,) + observed.shape, np.nan)
+    with warnings.catch_warnings(): # pairs with a constant metric have no correlation in any resample
+        warnings.simplefilter('ignore', RuntimeWarning)
+        alpha = (1 - confidence) / 2 * 100
+        low, high = np.nanpercentile(statistics, [alpha, 100 - alpha], axis=0)
+    return observed, p_value, p_method, resamples, low, high
+
+# one result row per (metric, refactoring) pair, systems with a missing value are left out of a pair
+def resample(metrics, metric_names, churn, refactorings, method='spearman', permutation_count=10000, bootstrap_count=10000,
+             confidence=0.95, max_exact=10 ** 6, seed=0, workers=1):
+    results = {}
+    x_missing, x_pattern = np.unique(np.isnan(metrics), axis=0, return_inverse=True)
+    y_missing, y_pattern = np.unique(np.isnan(churn), axis=0, return_inverse=True)
+    groups = [(i, j) for i in range(len(x_missing)) for j in range(len(y_missing))]
+    seeds = np.random.SeedSequence(seed).spawn(len(groups)) # one seed per group of pairs, whatever the number of workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (i, j), group_seed in zip(groups, seeds):
+            rows, columns = np.flatnonzero(x_pattern.ravel() == i), np.flatnonzero(y_pattern.ravel() == j)
+            present = ~x_missing[i] & ~y_missing[j]
+            observed, p_value, p_method, resamples, low, high = resample_group(
+                                        executor, metrics[np.ix_(rows, present)], churn[np.ix_(columns, present)],
+                                        method, permutation_count, bootstrap_count, confidence, max_exact, group_seed)
+            for a, row in enumerate(rows):
+                for b, column in enumerate(columns):
+                    results[row, column] = [metric_names[row], refactorings[column], int(present.sum()), observed[a, b],
+                                            p_value[a, b], p_method, resamples, low[a, b], high[a, b]]
+    return [results[row, column] for row in range(len(metric_names)) for column in range(len(refactorings))]
+
+################################
+# Writing results
+################################
+
+def write_results(results, csv_file, confidence=0.95):
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        level = f'{confidence * 100:g}'
+        writer.writerow(['Metric', 'Refactoring', 'systems', 'cor_value', 'p_value', 'p_method', 'resamples',
+                         f'ci{level}_low', f'ci{level}_high'])
+        writer.writerows(results)
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bootstrap confidence intervals and permutation p-values of churn correlations.')
+    parser.add_argument('--scores', default='~/Desktop/uploads/Sahin/correlation/greenability_scores.csv')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/correlation/churn.csv')
+    parser.add_argument('--churn-column', default=CHURN_COLUMN)
+    parser.add_argument('--metrics', help='also test the metrics of combined_systems.csv (or its store)')
+    parser.add_argument('--method', choices=['spearman', 'pearson'], default='spearman')
+    parser.add_argument('--permutations', type=int, default=10000, help='random relabellings when an exact test is too large')
+    parser.add_argument('--bootstrap', type=int, default=10000)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--max-exact', type=int, default=10 ** 6, help='largest number of relabellings tested exactly')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='~/Desktop/uploads/Sahin/correlation/resampling_results.csv')
+    args = parser.parse_args()
+
+    metrics, metric_names, churn, refactorings, systems = read_data(
+        os.path.expanduser(args.scores), os.path.expanduser(args.churn),
+        args.metrics and os.path.expanduser(args.metrics), args.churn_column)
+    results = resample(metrics, metric_names, churn, refactorings, args.method, args.permutations, args.bootstrap,
+                       args.confidence, args.max_exact, args.seed, args.workers)
+    write_results(results, os.path.expanduser(args.output), args.confidence)
+    print(f'Resampled {len(results)} pairs of metrics and refactorings over {len(systems)} systems')
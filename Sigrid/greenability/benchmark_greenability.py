@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import write_greenability as wg
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+from synthetic_sigrid import make_greenability_tree
+
+'''
+This file performs the following tasks:
+1. creates a synthetic greenability tree with thousands of systems with synthetic_sigrid.py, using
+    the json files of the real systems in this folder as templates (metric values are randomised)
+2. reads and scores the tree with write_greenability.py using 1, 2, 4, ... worker processes
+3. checks that greenability_scores.csv is byte for byte the same for every number of workers
+4. prints the time and speedup for every number of workers
+
+To Run file:
+    python3 benchmark_greenability.py --systems 5000 --workers 8
+
+'''
+
+################################
+# Benchmark
+################################
+
+def run(directory, workers):
+    csv_file = os.path.join(directory, f'greenability_scores_{workers}.csv')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): # one line per system is too much output
+        records = wg.read_all_systems(directory, workers)
+        wg.write_headings(csv_file)
+        wg.calculate_greenability(records, csv_file)
+    elapsed = time.perf_counter() - start
+    with open(csv_file, 'rb') as f:
+        return elapsed, f.read()
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark parallel scoring in write_greenability.py.')
+    parser.add_argument('--systems', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='greenability_benchmark_')
+    try:
+        print(f'Creating {args.systems} synthetic systems in {directory}')
+        make_greenability_tree(directory, args.systems)
+
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= args.workers:
+            worker_counts.append(worker_counts[-1] * 2)
+        if worker_counts[-1] != args.workers:
+            worker_counts.append(args.workers)
+
+        serial_time, serial_output = run(directory, 1)
+        print(f'workers  seconds  speedup')
+        print(f'{1:>7}  {serial_time:7.2f}  {1:7.2f}')
+        for workers in worker_counts[1:]:
+            elapsed, output = run(directory, workers)
+            if output != serial_output:
+                raise SystemExit(f'Output with {workers} workers differs from serial output')
+            print(f'{workers:>7}  {elapsed:7.2f}  {serial_time / elapsed:7.2f}')
+        print('Output is identical for every number of workers')
+    finally:
+        shutil.rmtree(directory)
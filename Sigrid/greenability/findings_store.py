@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+import os
+import gzip
+import json
+import argparse
+import numpy as np
+from stream_findings import iter_json_array, write_findings_summary, FINDINGS_TYPES, SEVERITIES
+
+'''
+This file performs the following tasks:
+1. keeps the findings of the security and reliability findings exports of all systems, and of
+    all their snapshots, in one compact store instead of one json file per export:
+    - every text field (filePath, type, cweId, toolName, ruleId, dates, ...) is interned: each
+        distinct value is stored once, and every finding holds a number into that list
+    - href is stored as a pattern with the id of the finding left out, so one pattern per system
+    - numbers are typed columns (scores as float64, lines as int64, flags as int8)
+    - fields that do not fit their column, and fields that are new, are kept as json per finding,
+        so a finding comes back exactly as it was exported
+    - every export that was added is kept in the 'exports' list, also an export without findings,
+        so its snapshot summarises to zero findings instead of to the findings of an older snapshot
+2. stores the columns as findings_store.npz (compressed numpy arrays) and the interned values
+    as findings_store.strings.json.gz
+3. adding an export replaces the findings of that system, findings type and snapshot, and keeps
+    the findings of the other snapshots
+4. summarises the findings of all systems straight from the columns with numpy group-bys, in the
+    same format and with the same numbers as stream_findings.py (count, per severity, per CWE, mean
+    severityScore), without building a dict per finding
+
+To Run file:
+    python3 findings_store.py build ~/Desktop/uploads/Sahin/greenability
+    python3 findings_store.py summary ~/Desktop/uploads/Sahin/greenability     (findings_summary.csv, findings_cwe.csv)
+    python3 findings_store.py export ~/Desktop/uploads/Sahin/greenability churn2-cio-original --type security
+
+This file is structured as follows:
+1. Columns
+2. Building a store:
+    FindingsBuilder
+    export_snapshot()
+    add_system_findings()
+    build_findings_store()
+3. Reading a store:
+    read_findings_store()
+    write_findings_store()
+    iter_findings()
+4. Aggregates:
+    recorded_exports()
+    latest_rows()
+    summarise_store()
+    store_records()
+5. Main
+
+'''
+
+STORE_NAME = 'findings_store'
+
+# fields of a finding, in the order of the exports, with the column type they are stored in
+FIELDS = [
+        ('id', 'string'),
+        ('href', 'href'),
+        ('firstSeenAnalysisDate', 'string'),
+        ('lastSeenAnalysisDate', 'string'),
+        ('firstSeenSnapshotDate', 'string'),
+        ('lastSeenSnapshotDate', 'string'),
+        ('filePath', 'string'),
+        ('startLine', 'int'),
+        ('endLine', 'int'),
+        ('component', 'string'),
+        ('type', 'string'),
+        ('cweId', 'string'),
+        ('severity', 'string'),
+        ('impact', 'string'),
+        ('exploitability', 'string'),
+        ('severityScore', 'float'),
+        ('impactScore', 'float'),
+        ('exploitabilityScore', 'float'),
+        ('status', 'string'),
+        ('remark', 'string'),
+        ('toolName', 'string'),
+        ('weaknessIds', 'list'),
+        ('ruleId', 'string'),
+        ('isManualFinding', 'bool'),
+        ('isSeverityOverridden', 'bool')
+        ]
+
+# interned columns that are not fields: which export a finding is from, and how to rebuild it
+KEY_COLUMNS = ['system', 'findings_type', 'snapshot', 'keys', 'extra']
+
+NONE_CODE = -1 # None in an interned column
+NONE_INT = np.iinfo(np.int64).min # None in an int column
+ID_MARK = '\x00' # where the id goes in an href pattern
+
+################################
+# Columns
+################################
+
+def column_type(kind):
+    return {'string': np.int32, 'href': np.int32, 'list': np.int32, 'int': np.int64, 'float': np.float64, 'bool': np.int8}[kind]
+
+# the stored value of a field, or None if it does not fit the column (then it is kept in 'extra')
+def fits(kind, value):
+    if value is None:
+        return True
+    if kind in ('string', 'href'):
+        return isinstance(value, str)
+    if kind == 'int':
+        return isinstance(value, int) and not isinstance(value, bool) and NONE_INT < value < 2 ** 63
+    if kind == 'float':
+        return isinstance(value, float)
+    if kind == 'bool':
+        return isinstance(value, bool)
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+################################
+# Building a store
+################################
+
+# interned values and growing columns of a store
+class FindingsBuilder:
+    def __init__(self, strings=None, columns=None):
+        # strings[column] is the list of distinct values, codes[column] maps a value to its number
+        self.strings = {column: list(values) for column, values in (strings or {}).items()}
+        self.codes = {column: {value: code for code, value in enumerate(values)} for column, values in self.strings.items()}
+        self.columns = {column: list(values) for column, values in (columns or {}).items()}
+
+    def intern(self, column, value):
+        if value is None:
+            return NONE_CODE
+        codes = self.codes.setdefault(column, {})
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.strings.setdefault(column, []).append(value)
+        return code
+
+    def append(self, column, value):
+        self.columns.setdefault(column, []).append(value)
+
+    def add(self, system, findings_type, snapshot, finding):
+        self.append('system', self.intern('system', system))
+        self.append('findings_type', self.intern('findings_type', findings_type))
+        self.append('snapshot', self.intern('snapshot', snapshot))
+        self.append('keys', self.intern('keys', json.dumps(list(finding))))
+        extra = {}
+        for field, kind in FIELDS:
+            value = finding.get(field)
+            if not fits(kind, value):
+                extra[field] = value
+                value = None
+            if kind == 'href':
+                if value is not None and finding.get('id') and isinstance(finding['id'], str):
+                    value = value.replace(finding['id'], ID_MARK)
+                self.append(field, self.intern(field, value))
+            elif kind == 'string':
+                self.append(field, self.intern(field, value))
+            elif kind == 'list':
+                self.append(field, self.intern(field, None if value is None else json.dumps(value)))
+            elif kind == 'int':
+                self.append(field, NONE_INT if value is None else value)
+            elif kind == 'float':
+                self.append(field, np.nan if value is None else value)
+            else:
+                self.append(field, -1 if value is None else int(value))
+        extra.update({field: value for field, value in finding.items() if field not in FIELD_KINDS})
+        self.append('extra', self.intern('extra', json.dumps(extra)) if extra else NONE_CODE)
+
+    def arrays(self):
+        arrays = {column: np.array(self.columns.get(column, []), dtype=np.int32) for column in KEY_COLUMNS}
+        for field, kind in FIELDS:
+            arrays[field] = np.array(self.columns.get(field, []), dtype=column_type(kind))
+        return arrays
+
+FIELD_KINDS = dict(FIELDS)
+
+# newest lastSeenSnapshotDate of the findings of an export, the snapshot the export belongs to
+def export_snapshot(findings):
+    dates = [finding.get('lastSeenSnapshotDate') for finding in findings if isinstance(finding.get('lastSeenSnapshotDate'), str)]
+    return max(dates) if dates else None
+
+# add the findings exports of one system, replacing the findings of the same snapshot; returns the number of findings added
+def add_system_findings(builder, keep, system_path, system, snapshot=None):
+    added = 0
+    for findings_type in FINDINGS_TYPES:
+        json_file = os.path.join(system_path, f'{system}_{findings_type}-findings.json')
+        if not os.path.isfile(json_file):
+            continue
+        findings = list(iter_json_array(json_file))
+        export_date = snapshot or export_snapshot(findings) or 'unknown'
+        # findings of this export that are in the store already are replaced, and the export is kept
+        # in the 'exports' list also when it has no findings
+        codes = [builder.intern(column, value) for column, value in
+                 [('system', system), ('findings_type', findings_type), ('snapshot', export_date)]]
+        builder.intern('exports', json.dumps([system, findings_type, export_date]))
+        keep &= ~((np.array(builder.columns.get('system', [])[:len(keep)]) == codes[0]) &
+                  (np.array(builder.columns.get('findings_type', [])[:len(keep)]) == codes[1]) &
+                  (np.array(builder.columns.get('snapshot', [])[:len(keep)]) == codes[2]))
+        for finding in findings:
+            builder.add(system, findings_type, export_date, finding)
+        added += len(findings)
+    return added
+
+# add the findings exports of every system folder to the store (snapshot: date for all exports,
+# by default the newest lastSeenSnapshotDate of each export)
+def build_findings_store(input_directory, store=None, snapshot=None):
+    store = store or os.path.join(input_directory, STORE_NAME)
+    strings, arrays = read_findings_store(store) if os.path.isfile(store + '.npz') else ({}, {})
+    builder = FindingsBuilder(strings, {column: values.tolist() for column, values in arrays.items()})
+    keep = np.ones(len(arrays.get('system', [])), dtype=bool) # findings already in the store that are kept
+    added = 0
+    for system in sorted(os.listdir(input_directory)):
+        system_path = os.path.join(input_directory, system)
+        if '-' in system and os.path.isfile(os.path.join(system_path, system + '_maintainability.json')): # only system folders (see write_greenability.is_system)
+            added += add_system_findings(builder, keep, system_path, system, snapshot)
+    arrays = builder.arrays()
+    rows = np.concatenate([keep, np.ones(len(arrays['system']) - len(keep), dtype=bool)])
+    write_findings_store(store, builder.strings, {column: values[rows] for column, values in arrays.items()})
+    return added, int(rows.sum())
+
+################################
+# Reading a store
+################################
+
+# (interned values, columns) of a store
+def read_findings_store(store):
+    with gzip.open(store + '.strings.json.gz', 'rt') as f:
+        strings = json.load(f)
+    with np.load(store + '.npz') as data:
+        arrays = {column: data[column] for column in data.files}
+    return strings, arrays
+
+# write to temporary files first, so a reader never sees columns with the wrong strings
+def write_findings_store(store, strings, arrays):
+    with open(store + '.npz.part', 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    with gzip.open(store + '.strings.json.gz.part', 'wt') as f:
+        json.dump(strings, f, separators=(',', ':'))
+    os.replace(store + '.npz.part', store + '.npz')
+    os.replace(store + '.strings.json.gz.part', store + '.strings.json.gz')
+
+def string_value(strings, column, code):
+    return None if code == NONE_CODE else strings[column][code]
+
+# the findings of one export rebuilt as they were exported (snapshot None: the newest snapshot)
+def iter_findings(strings, arrays, system, findings_type, snapshot=None):
+    if system not in strings.get('system', []) or findings_type not in strings.get('findings_type', []):
+        return
+    rows = (arrays['system'] == strings['system'].index(system)) & (arrays['findings_type'] == strings['findings_type'].index(findings_type))
+    snapshots = [strings['snapshot'][code] for code in np.unique(arrays['snapshot'][rows])]
+    snapshots += [json.loads(export)[2] for export in strings.get('exports', []) if json.loads(export)[:2] == [system, findings_type]]
+    if not snapshots:
+        return
+    snapshot = snapshot or max(snapshots)
+    if snapshot not in snapshots:
+        return
+    rows &= arrays['snapshot'] == strings['snapshot'].index(snapshot)
+    for row in np.flatnonzero(rows):
+        extra = {} if arrays['extra'][row] == NONE_CODE else json.loads(strings['extra'][arrays['extra'][row]])
+        values = {}
+        for field, kind in FIELDS:
+            value = arrays[field][row]
+            if kind in ('string', 'href', 'list'):
+                value = string_value(strings, field, value)
+                if value is not None and kind == 'list':
+                    value = json.loads(value)
+            elif kind == 'int':
+                value = None if value == NONE_INT else int(value)
+            elif kind == 'float':
+                value = None if np.isnan(value) else float(value)
+            else:
+                value = None if value < 0 else bool(value)
+            values[field] = value
+        if values['href'] is not None and isinstance(values['id'], str):
+            values['href'] = values['href'].replace(ID_MARK, values['id'])
+        values.update(extra)
+        yield {field: values.get(field) for field in json.loads(strings['keys'][arrays['keys'][row]])}
+
+################################
+# Aggregates
+################################
+
+# (system, findings type, snapshot) codes of the exports that were added, also the ones without findings
+# (a store written before the 'exports' list only knows the exports of its findings)
+def recorded_exports(strings):
+    codes = {column: {value: code for code, value in enumerate(strings.get(column, []))} for column in ('system', 'findings_type', 'snapshot')}
+    exports = [json.loads(export) for export in strings.get('exports', [])]
+    return np.array([[codes['system'][system], codes['findings_type'][findings_type], codes['snapshot'][snapshot]]
+                     for system, findings_type, snapshot in exports], dtype=np.int64).reshape(-1, 3)
+
+# rows of the newest snapshot of every (system, findings type), and the rank of that snapshot per
+# (system, findings type) (-1: nothing added)
+def latest_rows(strings, arrays):
+    findings_types = max(len(strings.get('findings_type', [])), 1)
+    snapshot_rank = np.argsort(np.argsort(np.array(strings.get('snapshot', []), dtype=str))) # codes in date order
+    export = arrays['system'].astype(np.int64) * findings_types + arrays['findings_type']
+    rank = snapshot_rank[arrays['snapshot']] if len(export) else np.zeros(0, dtype=np.int64)
+    recorded = recorded_exports(strings)
+    newest = np.full(len(strings.get('system', [])) * findings_types, -1)
+    np.maximum.at(newest, export, rank)
+    np.maximum.at(newest, recorded[:, 0] * findings_types + recorded[:, 1], snapshot_rank[recorded[:, 2]] if len(recorded) else recorded[:, 2])
+    return rank == newest[export], export, newest
+
+# {(system, findings type): summary} of the newest snapshots, in the format of stream_findings.summarise_findings()
+def summarise_store(strings, arrays):
+    rows, export, newest = latest_rows(strings, arrays)
+    exports = len(strings.get('system', [])) * max(len(strings.get('findings_type', [])), 1)
+    export = export[rows]
+
+    count = np.bincount(export, minlength=exports)
+    scores = arrays['severityScore'][rows]
+    scored = ~np.isnan(scores)
+    score_total = np.bincount(export[scored], weights=scores[scored], minlength=exports)
+    score_count = np.bincount(export[scored], minlength=exports)
+
+    # like in stream_findings.py, None and '' count as UNKNOWN, other severities outside SEVERITIES keep their own name
+    severity_labels = list(SEVERITIES)
+    severity_index = []
+    for name in strings.get('severity', []) + [None]: # the last one is for NONE_CODE
+        name = name or 'UNKNOWN'
+        if name not in severity_labels:
+            severity_labels.append(name)
+        severity_index.append(severity_labels.index(name))
+    severity = np.array(severity_index, dtype=np.int64)[arrays['severity'][rows]]
+    by_severity = np.bincount(export * len(severity_labels) + severity,
+                              minlength=exports * len(severity_labels)).reshape(exports, len(severity_labels))
+
+    cwe = arrays['cweId'][rows]
+    cwe_names = strings.get('cweId', [])
+    pairs, pair_count = np.unique(export[cwe >= 0].astype(np.int64) * max(len(cwe_names), 1) + cwe[cwe >= 0], return_counts=True)
+    by_cwe = {}
+    for pair, pair_total in zip(pairs.tolist(), pair_count.tolist()):
+        if cwe_names[pair % len(cwe_names)]: # empty CWEs are left out, like in stream_findings.py
+            by_cwe.setdefault(pair // len(cwe_names), {})[cwe_names[pair % len(cwe_names)]] = pair_total
+
+    summaries = {}
+    findings_types = strings.get('findings_type', [])
+    for key in np.flatnonzero(newest >= 0).tolist(): # an export without findings gets a summary with count 0
+        system, findings_type = strings['system'][key // len(findings_types)], findings_types[key % len(findings_types)]
+        severity_counts = dict(zip(severity_labels, by_severity[key].tolist()))
+        summaries[system, findings_type] = {
+                                            'count': int(count[key]),
+                                            'mean_severity_score': score_total[key] / score_count[key] if score_count[key] else None,
+                                            'by_severity': {name: total for name, total in severity_counts.items() if name in SEVERITIES or total},
+                                            'by_cwe': dict(sorted(by_cwe.get(key, {}).items()))
+                                            }
+    return summaries
+
+# system records for stream_findings.write_findings_summary(), eg. [{'name': 'cio', 'findings': {'security': {...}}}]
+def store_records(strings, arrays):
+    records = {}
+    for (system, findings_type), summary in summarise_store(strings, arrays).items():
+        records.setdefault(system, {'name': system.split('-')[1], 'findings': {}})['findings'][findings_type] = summary
+    return [records[system] for system in sorted(records)]
+
+################################
+# Main
+################################
+
+def directory_size(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compact store of Sigrid security and reliability findings.')
+    parser.add_argument('command', choices=['build', 'summary', 'export'])
+    parser.add_argument('input_directory', nargs='?', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('system', nargs='?', help='system to export')
+    parser.add_argument('--store', help=f'store without extension (default: {STORE_NAME} in the input directory)')
+    parser.add_argument('--snapshot', help='snapshot date of the exports that are added, or that is exported')
+    parser.add_argument('--type', choices=FINDINGS_TYPES, default='security', help='findings type to export')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory)
+    store = os.path.expanduser(args.store or os.path.join(input_directory, STORE_NAME))
+    if args.command == 'build':
+        added, total = build_findings_store(input_directory, store, args.snapshot)
+        exports = [os.path.join(input_directory, system, f'{system}_{findings_type}-findings.json')
+                   for system in os.listdir(input_directory) for findings_type in FINDINGS_TYPES]
+        print(f'Added {added} findings, the store holds {total} findings')
+        print(f'json exports: {directory_size(exports) / 1024:.1f} KB, '
+              f'store: {directory_size([store + ".npz", store + ".strings.json.gz"]) / 1024:.1f} KB')
+    elif args.command == 'summary':
+        write_findings_summary(input_directory, store_records(*read_findings_store(store)))
+        print(f'Findings summarised in {input_directory}')
+    else:
+        if not args.system:
+            parser.error('export needs a system')
+        strings, arrays = read_findings_store(store)
+        print(json.dumps(list(iter_findings(strings, arrays, args.system, args.type, args.snapshot)), indent=2))
@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+import os
+import sys
+import csv
+import json
+import argparse
+import datetime
+import numpy as np
+
+'''
+This file performs the following tasks:
+1. keeps the metrics and Greenability scores of every system on every snapshot date in one
+    append-only time series store, instead of only the values of the last run:
+        metric_history.bin          one 16 byte point per (system, metric, date): a key and a value
+        metric_history.labels.json  the system and metric names the keys refer to, and the last
+                                    snapshot date added for every system
+    the key of a point is (system << 40) | (metric << 20) | day, days counted from 1970-01-01
+2. adds the points of the system records of write_greenability.py (run it with --history):
+    - the maintainability metrics of every rating in allRatings, on its maintainabilityDate
+    - all current metrics (maintainability, architecture, reliability, osh), Volume (PM), the
+        scores of the model and the number of findings (with --findings) on the snapshot date
+    only dates after the last snapshot date of a system are added, and values of that date that
+    changed (eg. scores under another model), so running it again adds nothing
+3. points are appended to the end of the file and never changed; a later point for the same
+    system, metric and date replaces the earlier one when reading. compact rewrites the store
+    sorted by key without replaced points, after which range queries are binary searches
+4. range queries by system, metric and dates, read memory-mapped, and downsampling by week or
+    month (last, mean, min or max of each period)
+5. exports a metric of all systems as a csv with one row per date and one column per system
+
+To Run file:
+    python3 write_greenability.py --history
+    python3 metric_history.py query ~/Desktop/uploads/Sahin/greenability --metric 'Greenability Score' --period month
+    python3 metric_history.py export ~/Desktop/uploads/Sahin/greenability --metric maintainability --output maintainability.csv
+    python3 metric_history.py compact ~/Desktop/uploads/Sahin/greenability
+
+This file is structured as follows:
+1. Keys:
+    day_number()
+    day_date()
+    encode_keys()
+    decode_keys()
+2. Storing points:
+    read_labels()
+    write_labels()
+    read_points()
+    append_points()
+    compact()
+3. Range queries:
+    select_rows()
+    query()
+    downsample()
+4. Adding system records:
+    record_points()
+    ingest_records()
+5. Exporting to csv:
+    write_series_csv()
+6. Main
+
+'''
+
+HISTORY_NAME = 'metric_history'
+
+POINT = np.dtype([('key', '<i8'), ('value', '<f8')])
+
+DAY_BITS = 20 # days after 1970-01-01, up to the year 4840
+METRIC_BITS = 20
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+PERIODS = ['day', 'week', 'month']
+AGGREGATES = ['last', 'mean', 'min', 'max']
+
+################################
+# Keys
+################################
+
+def day_number(date):
+    return datetime.date.fromisoformat(date[:10]).toordinal() - EPOCH
+
+def day_date(day):
+    return datetime.date.fromordinal(int(day) + EPOCH).isoformat()
+
+def encode_keys(systems, metrics, days):
+    return (np.asarray(systems, dtype=np.int64) << (METRIC_BITS + DAY_BITS)) | (np.asarray(metrics, dtype=np.int64) << DAY_BITS) | np.asarray(days, dtype=np.int64)
+
+# (system codes, metric codes, days) of an array of keys
+def decode_keys(keys):
+    return keys >> (METRIC_BITS + DAY_BITS), (keys >> DAY_BITS) & ((1 << METRIC_BITS) - 1), keys & ((1 << DAY_BITS) - 1)
+
+################################
+# Storing points
+################################
+
+# path is the name of the store without extension, eg. .../metric_history
+def read_labels(path):
+    if not os.path.isfile(path + '.labels.json'):
+        return {'systems': [], 'metrics': [], 'sorted_points': 0, 'ingested': {}}
+    with open(path + '.labels.json', 'r') as f:
+        return json.load(f)
+
+def write_labels(path, labels):
+    with open(path + '.labels.json.part', 'w') as f:
+        json.dump(labels, f)
+    os.replace(path + '.labels.json.part', path + '.labels.json')
+
+# all points memory-mapped, in the order they were added (a point cut off by a crash is left out)
+def read_points(path):
+    size = os.path.getsize(path + '.bin') if os.path.isfile(path + '.bin') else 0
+    if size < POINT.itemsize:
+        return np.zeros(0, dtype=POINT)
+    return np.memmap(path + '.bin', dtype=POINT, mode='r', shape=(size // POINT.itemsize,))
+
+# append [(system, metric, date, value)] to the store, returns the labels
+def append_points(path, points, labels=None):
+    labels = labels or read_labels(path)
+    if not points:
+        return labels
+    # new names are in the labels before any point refers to them
+    codes = {}
+    for name in ('systems', 'metrics'):
+        codes[name] = {value: code for code, value in enumerate(labels[name])}
+    for system, metric, _, _ in points:
+        for name, value in (('systems', system), ('metrics', metric)):
+            if value not in codes[name]:
+                codes[name][value] = len(labels[name])
+                labels[name].append(value)
+    write_labels(path, labels)
+
+    data = np.empty(len(points), dtype=POINT)
+    data['key'] = encode_keys([codes['systems'][point[0]] for point in points],
+                              [codes['metrics'][point[1]] for point in points],
+                              [day_number(point[2]) for point in points])
+    data['value'] = [point[3] for point in points]
+    with open(path + '.bin', 'ab') as f:
+        f.truncate(f.tell() - f.tell() % POINT.itemsize) # drop a point cut off by a crash
+        f.write(data.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    return labels
+
+# rewrite the store sorted by key, keeping only the last point of every key
+def compact(path):
+    labels = read_labels(path)
+    points = np.array(read_points(path))
+    order = np.argsort(points['key'], kind='stable')
+    points = points[order]
+    last = np.append(points['key'][1:] != points['key'][:-1], True) if len(points) else np.zeros(0, dtype=bool)
+    points = points[last]
+    with open(path + '.bin.part', 'wb') as f:
+        f.write(points.tobytes())
+    os.replace(path + '.bin.part', path + '.bin')
+    labels['sorted_points'] = len(points)
+    write_labels(path, labels)
+    return len(order), len(points)
+
+################################
+# Range queries
+################################
+
+# positions of the points of the given systems and metrics between two days: binary searches in
+# the sorted part of the store, a scan of the points added after the last compact
+def select_rows(points, sorted_points, system_codes, metric_codes, first_day, last_day):
+    keys = points['key'][:sorted_points]
+    systems, metrics = np.meshgrid(np.asarray(system_codes, dtype=np.int64), np.asarray(metric_codes, dtype=np.int64), indexing='ij')
+    starts = np.searchsorted(keys, encode_keys(systems.ravel(), metrics.ravel(), first_day), side='left')
+    lengths = np.searchsorted(keys, encode_keys(systems.ravel(), metrics.ravel(), last_day), side='right') - starts
+    # the positions from start to end of every (system, metric), without a loop
+    rows = [np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)]
+    tail = np.asarray(points['key'][sorted_points:])
+    if len(tail):
+        systems, metrics, days = decode_keys(tail)
+        selected = np.isin(systems, system_codes) & np.isin(metrics, metric_codes) & (days >= first_day) & (days <= last_day)
+        rows.append(np.flatnonzero(selected) + sorted_points)
+    return np.concatenate(rows)
+
+# points of the given systems and metrics (None: all) from start to end (dates, None: open),
+# the last value of every (system, metric, day) sorted by system, metric and date:
+# (system names, metric names, days, values)
+def query(path, systems=None, metrics=None, start=None, end=None):
+    labels = read_labels(path)
+    points = read_points(path)
+    system_codes = [code for code, system in enumerate(labels['systems']) if systems is None or system in systems]
+    metric_codes = [code for code, metric in enumerate(labels['metrics']) if metrics is None or metric in metrics]
+    first_day = day_number(start) if start else 0
+    last_day = day_number(end) if end else (1 << DAY_BITS) - 1
+    rows = np.sort(select_rows(points, min(labels['sorted_points'], len(points)), system_codes, metric_codes, first_day, last_day))
+    selected = np.array(points[rows]) # in the order they were added
+    order = np.argsort(selected['key'], kind='stable')
+    selected = selected[order]
+    last = np.append(selected['key'][1:] != selected['key'][:-1], True) if len(selected) else np.zeros(0, dtype=bool)
+    selected = selected[last] # a later point for the same key replaces the earlier one
+    system_index, metric_index, days = decode_keys(selected['key'])
+    return (np.array(labels['systems'], dtype=object)[system_index], np.array(labels['metrics'], dtype=object)[metric_index],
+            days, selected['value'])
+
+# first day of the week (monday) or month of every day
+def period_start(days, period):
+    if period == 'day':
+        return days
+    if period == 'week':
+        return days - (days + 3) % 7 # 1970-01-01 was a thursday
+    dates = np.array(days, dtype='datetime64[D]')
+    return dates.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+# one value per system, metric and period: (system names, metric names, first days of the periods, values)
+def downsample(systems, metrics, days, values, period='week', how='last'):
+    if not len(days):
+        return systems, metrics, days, values
+    starts = period_start(np.asarray(days, dtype=np.int64), period)
+    # the points are sorted by system, metric and day, so each period is a run of points
+    group = np.concatenate([[True], (systems[1:] != systems[:-1]) | (metrics[1:] != metrics[:-1]) | (starts[1:] != starts[:-1])])
+    first = np.flatnonzero(group)
+    last = np.append(first[1:], len(days)) - 1
+    if how == 'last':
+        sampled = values[last]
+    elif how == 'mean':
+        sampled = np.add.reduceat(values, first) / (last - first + 1)
+    elif how == 'min':
+        sampled = np.minimum.reduceat(values, first)
+    else:
+        sampled = np.maximum.reduceat(values, first)
+    return systems[first], metrics[first], starts[first], sampled
+
+################################
+# Adding system records
+################################
+
+def is_value(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not np.isnan(value)
+
+# [(date, metric, value)] of a record of write_greenability.py read with history=True
+def record_points(record):
+    points = [tuple(row) for row in record.get('history', [])]
+    snapshot = record.get('snapshot')
+    if snapshot:
+        points += [(snapshot, metric, value) for metric, value in record['metrics'].items()]
+        points.append((snapshot, 'Volume (PM)', record['volume_pm']))
+        points += [(snapshot, score, value) for score, value in record.get('scores', {}).items()]
+        for findings_type, summary in (record.get('findings') or {}).items():
+            if summary is not None:
+                points.append((snapshot, f'{findings_type} findings', summary['count']))
+    # the rating of the snapshot is in allRatings too, one point per (day, metric) is kept: the last one,
+    # so the value of the snapshot replaces the one of allRatings
+    unique = {}
+    for date, metric, value in points:
+        if date and is_value(value):
+            unique[date[:10], metric] = (date, metric, value)
+    return list(unique.values())
+
+# add the points of the records that are not in the store yet, returns the number of points added
+def ingest_records(path, records):
+    labels = read_labels(path)
+    new_points = []
+    for record in records:
+        name = record['name']
+        points = record_points(record)
+        last_date = labels['ingested'].get(name)
+        stored = {}
+        if last_date and any(date[:10] == last_date for date, _, _ in points):
+            # values of the last date that was added are only added again when they changed
+            _, metrics, _, values = query(path, [name], None, last_date, last_date)
+            stored = dict(zip(metrics, values.tolist()))
+        for date, metric, value in points:
+            if last_date is None or date[:10] > last_date or (date[:10] == last_date and stored.get(metric) != float(value)):
+                new_points.append((name, metric, date[:10], float(value)))
+        if points:
+            labels['ingested'][name] = max([last_date or ''] + [date[:10] for date, _, _ in points])
+    labels = append_points(path, new_points, labels)
+    write_labels(path, labels) # the dates are written after the points, so a crash adds them again
+    return len(new_points)
+
+################################
+# Exporting to csv
+################################
+
+# one row per date (or period), one column per system, for one metric
+def write_series_csv(path, csv_file, metric, start=None, end=None, period='day', how='last'):
+    systems, _, days, values = downsample(*query(path, None, [metric], start, end), period, how)
+    columns = sorted(set(systems.tolist()))
+    rows = sorted(set(days.tolist()))
+    table = {(system, day): value for system, day, value in zip(systems.tolist(), days.tolist(), values.tolist())}
+    with open(csv_file, 'w', newline='') as cf:
+        writer = csv.writer(cf, lineterminator='\n')
+        writer.writerow(['Date'] + columns)
+        for day in rows:
+            writer.writerow([day_date(day)] + [table.get((system, day), '') for system in columns])
+    return len(rows), len(columns)
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time series of the metrics and Greenability scores of all systems.')
+    parser.add_argument('command', choices=['query', 'export', 'compact'])
+    parser.add_argument('input_directory', nargs='?', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--store', help=f'store without extension (default: {HISTORY_NAME} in the input directory)')
+    parser.add_argument('--system', nargs='+', help='systems (short names, eg. cio), default all')
+    parser.add_argument('--metric', nargs='+', help='metrics, eg. maintainability or "Greenability Score", default all')
+    parser.add_argument('--start', help='first date, eg. 2024-01-01')
+    parser.add_argument('--end', help='last date')
+    parser.add_argument('--period', choices=PERIODS, default='day')
+    parser.add_argument('--how', choices=AGGREGATES, default='last', help='value of a period')
+    parser.add_argument('--output', help='csv file of export (default: <metric>_history.csv in the input directory)')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory)
+    store = os.path.expanduser(args.store or os.path.join(input_directory, HISTORY_NAME))
+    if args.command == 'compact':
+        before, after = compact(store)
+        print(f'Compacted {before} points into {after}')
+    elif args.command == 'export':
+        if not args.metric or len(args.metric) != 1:
+            parser.error('export needs one --metric')
+        csv_file = os.path.expanduser(args.output or os.path.join(input_directory, args.metric[0].replace(' ', '_') + '_history.csv'))
+        dates, systems = write_series_csv(store, csv_file, args.metric[0], args.start, args.end, args.period, args.how)
+        print(f'{dates} dates of {systems} systems written to {csv_file}')
+    else:
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['System Name', 'Metric', 'Date', 'Value'])
+        systems, metrics, days, values = downsample(*query(store, args.system, args.metric, args.start, args.end), args.period, args.how)
+        for system, metric, day, value in zip(systems.tolist(), metrics.tolist(), days.tolist(), values.tolist()):
+            writer.writerow([system, metric, day_date(day), value])
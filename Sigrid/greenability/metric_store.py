@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+import os
+import csv
+import json
+import argparse
+import numpy as np
+
+'''
+This file performs the following tasks:
+1. builds the combined metric matrix (one row per metric, one column per system) from the
+    system records of write_greenability.py in one pass, instead of one merge per system
+2. stores a matrix as a typed float64 .npy file with its row and column labels in a .labels.json
+    file next to it, eg. combined_systems.npy + combined_systems.labels.json
+3. reads a stored matrix memory-mapped, so loading it takes milliseconds whatever its size and
+    only the rows or columns that are used are read from disk
+4. exports a stored matrix to csv, in the same format as combined_systems.csv and
+    greenability_scores.csv, for the R scripts (Sigrid/correlation/churn.R, R/heatmaps/correlation.R)
+
+To export a store to csv by hand:
+    python3 metric_store.py ~/Desktop/uploads/Sahin/greenability/combined_systems
+
+This file is structured as follows:
+1. Building matrices:
+    metric_matrix()
+    score_matrix()
+2. Storing and loading:
+    write_store()
+    read_store()
+3. Exporting to csv:
+    write_csv()
+4. Main
+
+'''
+
+################################
+# Building matrices
+################################
+
+def to_float(value):
+    # placeholders ('N/A', missing osh ratings) become NaN, like empty cells in the csv files
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+# rows are all metrics of any system in sorted order (like an outer merge), columns are systems
+def metric_matrix(records):
+    metrics = sorted({metric for record in records for metric in record['metrics']})
+    positions = {metric: i for i, metric in enumerate(metrics)}
+    matrix = np.full((len(metrics), len(records)), np.nan)
+    for column, record in enumerate(records):
+        rows = [positions[metric] for metric in record['metrics']]
+        matrix[rows, column] = [to_float(value) for value in record['metrics'].values()]
+    return matrix, metrics, [record['name'] for record in records]
+
+# rows are systems, columns are the numbers in greenability_scores.csv (volume and the scores of the model)
+def score_matrix(records):
+    columns = ['Volume (PM)'] + (list(records[0]['scores']) if records else [])
+    matrix = np.array([
+                    [to_float(record['volume_pm'])] + [to_float(score) for score in record['scores'].values()]
+                    for record in records
+                    ], dtype=np.float64).reshape(len(records), len(columns))
+    return matrix, [record['name'] for record in records], columns
+
+################################
+# Storing and loading
+################################
+
+# path is the name of the store without extension, eg. .../combined_systems
+def write_store(path, matrix, rows, columns, row_label, temporary_suffix='.part'):
+    # write to temporary files first, so a reader never sees a matrix with the wrong labels
+    with open(path + '.npy' + temporary_suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float64))
+    with open(path + '.labels.json' + temporary_suffix, 'w') as f:
+        json.dump({'row_label': row_label, 'rows': rows, 'columns': columns}, f)
+    os.replace(path + '.npy' + temporary_suffix, path + '.npy')
+    os.replace(path + '.labels.json' + temporary_suffix, path + '.labels.json')
+
+# returns the memory-mapped matrix and its labels: (matrix, rows, columns, row_label)
+def read_store(path):
+    matrix = np.load(path + '.npy', mmap_mode='r')
+    with open(path + '.labels.json', 'r') as f:
+        labels = json.load(f)
+    return matrix, labels['rows'], labels['columns'], labels['row_label']
+
+################################
+# Exporting to csv
+################################
+
+def csv_value(value):
+    return '' if np.isnan(value) else value
+
+def write_csv(path, csv_file=None):
+    matrix, rows, columns, row_label = read_store(path)
+    csv_file = csv_file or path + '.csv'
+    with open(csv_file + '.part', 'w', newline='') as cf: # a reader never sees half a csv file
+        writer = csv.writer(cf, lineterminator='\n') # same line endings as pandas to_csv
+        writer.writerow([row_label] + columns)
+        for row, values in zip(rows, matrix.tolist()):
+            writer.writerow([row] + [csv_value(value) for value in values])
+    os.replace(csv_file + '.part', csv_file)
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a stored metric matrix to csv.')
+    parser.add_argument('store', help='store without extension, eg. ~/Desktop/uploads/Sahin/greenability/combined_systems')
+    parser.add_argument('--output', help='csv file (default: store name with .csv)')
+    args = parser.parse_args()
+
+    write_csv(os.path.expanduser(args.store), args.output and os.path.expanduser(args.output))
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+import os
+import json
+import datetime
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from osh_library_index import LIBRARY_FIELDS, library_key, build_library_index, load_library_index
+
+'''
+This file performs the following tasks:
+1. calculates the Freshness, Activity and Management Risk of every system without Sigrid's internal
+    libraryDependencies API (which needs the browser tokens in .env), from files that are local:
+    - the CycloneDX SBOM of every system, <system>_osh-findings.json (external API, sigrid_fetch.py)
+    - library_releases.json, the release dates of every library version that is used
+2. keeps library_releases.json up to date from the SBOMs themselves: every SBOM component carries
+    the release date of its version, of the next version and of the latest version; the releases
+    of all systems are merged per package, so a library used by many systems is stored once
+    (other release data in the same format can be added to the file by hand)
+3. reads the SBOMs of all systems on a pool of --workers processes, and rates every distinct
+    (library, version, snapshot date) once, however many systems use it:
+    - outdatedRisk: days since the next version of the library came out
+    - unmaintainedRisk: days since the latest version of the library came out
+    - unmanagedRisk: Sigrid's management risk in the SBOM; if it is missing, a library found as a
+        file (eg. a jar) is MEDIUM and a library declared in a build file (eg. pom.xml) is NONE
+    the days of each risk level are in RISK_DAYS
+4. rates each risk of a system (0.5 to 5.5 stars) from the share of its libraries at each risk level
+    or worse, with the thresholds in osh_rating_thresholds.json (or the file given with --thresholds)
+5. writes <system>_offline_osh-findings.json in the format of the internal API (librariesAtStart,
+    ratings, snapshotDate), next to the downloaded <system>_internal_osh-findings.json, which is left
+    as it is; write_greenability.py --offline-osh reads the offline file instead of the downloaded one
+
+The ratings are an approximation of Sigrid's, not a reproduction: Sigrid does not publish how it
+rates open source health, and the thresholds in osh_rating_thresholds.json are breakpoints fitted by
+hand to the Sigrid ratings of the systems listed in its "fitted_on" (the 9 sample systems, which use
+only 8 distinct libraries). That those systems match Sigrid (eg. Activity Risk 1.90206 offline vs 1.90191)
+says nothing about other systems: compare only reports how well the ratings agree for the systems the
+thresholds were not fitted to, and it is a comparison, not a validation of the thresholds.
+
+To Run file:
+    python3 offline_osh.py build ~/Desktop/uploads/Sahin/greenability --workers 8
+    python3 offline_osh.py compare ~/Desktop/uploads/Sahin/greenability     (offline against downloaded ratings)
+    python3 offline_osh.py build ~/Desktop/uploads/Sahin/greenability --thresholds my_thresholds.json
+    python3 write_greenability.py --offline-osh
+
+This file is structured as follows:
+1. Risk levels and ratings:
+    load_thresholds()
+2. Reading SBOMs:
+    component_library()
+    read_sbom()
+    read_sboms()
+3. Library releases:
+    load_releases()
+    save_releases()
+    update_releases()
+4. Rating libraries and systems:
+    days_between()
+    risk_level()
+    library_risks()
+    risk_rating()
+    system_osh()
+    offline_osh()
+5. Main
+
+'''
+
+################################
+# Risk levels and ratings
+################################
+
+RELEASES_FILE = 'library_releases.json'
+OFFLINE_SUFFIX = '_offline_osh-findings.json' # <system>_offline_osh-findings.json
+
+LEVELS = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW'] # worst first, NONE is below LOW
+
+# days after which a library is at a risk level
+RISK_DAYS = {
+            'outdatedRisk': [('CRITICAL', 5 * 365), ('HIGH', 3 * 365), ('MEDIUM', 365), ('LOW', 1)],
+            'unmaintainedRisk': [('CRITICAL', 4 * 365), ('HIGH', 3 * 365), ('MEDIUM', 2 * 365), ('LOW', 365)]
+            }
+
+# osh_rating_thresholds.json: per risk and level, the share of libraries at that level or worse at which
+# a rating drops to 4.5, 3.5, 2.5, 1.5 and 0.5 stars (the rating of a risk is the lowest rating of its
+# levels, linear between the thresholds), and in "fitted_on" the systems the thresholds were fitted to
+DEFAULT_THRESHOLDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'osh_rating_thresholds.json')
+
+def load_thresholds(thresholds_file=None):
+    with open(thresholds_file or DEFAULT_THRESHOLDS_FILE, 'r') as f:
+        return json.load(f)
+
+# risk in the internal API: the rating it is summarised in, and the SBOM property Sigrid puts it in
+RISKS = {
+        'outdatedRisk': ('outdatedRating', 'sigrid:risk:freshness'),
+        'unmaintainedRisk': ('unmaintainedRating', 'sigrid:risk:activity'),
+        'unmanagedRisk': ('unmanagedRating', 'sigrid:risk:management')
+        }
+
+# build files that declare libraries, a library that is found anywhere else is not managed
+MANAGED_FILES = {'pom.xml', 'build.gradle', 'build.gradle.kts', 'ivy.xml', 'package.json', 'package-lock.json',
+                'yarn.lock', 'requirements.txt', 'setup.py', 'pyproject.toml', 'pipfile.lock', 'go.mod',
+                'packages.config', 'gemfile.lock', 'composer.json', 'cargo.toml'}
+
+PACKAGE_TYPES = {'maven': 'Maven', 'npm': 'NPM', 'pypi': 'PyPI', 'nuget': 'NuGet', 'gem': 'RubyGems', 'golang': 'Go'}
+
+################################
+# Reading SBOMs
+################################
+
+# what is needed of one SBOM component: its package (purl without version), version and release data
+def component_library(component):
+    purl = component.get('purl') or component.get('bom-ref') or ''
+    package = purl.split('?')[0].rsplit('@', 1)[0] if '@' in purl else purl
+    properties = {item.get('name'): item.get('value') for item in component.get('properties', [])}
+    group = component.get('group')
+    locations = [occurrence.get('location') for occurrence in (component.get('evidence') or {}).get('occurrences', [])]
+    return {
+            'package': package,
+            'type': PACKAGE_TYPES.get(package[4:].split('/')[0], package[4:].split('/')[0].capitalize()) if package.startswith('pkg:') else None,
+            'name': f'{group}:{component.get("name")}' if group else component.get('name'),
+            'version': component.get('version'),
+            'transitive': properties.get('sigrid:transitive'),
+            'paths': [location for location in locations if location],
+            'releaseDate': properties.get('sigrid:releaseDate'),
+            'nextVersion': properties.get('sigrid:next:version'),
+            'nextReleaseDate': properties.get('sigrid:next:releaseDate'),
+            'latestVersion': properties.get('sigrid:latest:version'),
+            'latestReleaseDate': properties.get('sigrid:latest:releaseDate'),
+            'sigridRisks': {risk: properties.get(sbom_property) for risk, (_, sbom_property) in RISKS.items()}
+            }
+
+# (snapshot date, libraries) of the SBOM of one system, None if the system has no SBOM
+def read_sbom(input_directory, system):
+    sbom_file = os.path.join(input_directory, system, f'{system}_osh-findings.json')
+    if not os.path.isfile(sbom_file):
+        return None
+    try:
+        with open(sbom_file, 'r') as f:
+            sbom = json.load(f) # SBOMs are small, the work is in the libraries
+    except json.JSONDecodeError:
+        return None
+    snapshot = ((sbom.get('metadata') or {}).get('timestamp') or datetime.date.today().isoformat())[:10]
+    return snapshot, [component_library(component) for component in sbom.get('components', [])]
+
+# {system: (snapshot date, libraries)} of all systems with an SBOM, read on a pool of workers
+def read_sboms(input_directory, systems, workers=1):
+    if workers <= 1 or len(systems) <= 1:
+        sboms = [read_sbom(input_directory, system) for system in systems]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sboms = list(executor.map(read_sbom, [input_directory] * len(systems), systems,
+                                      chunksize=max(1, len(systems) // (workers * 4))))
+    return {system: sbom for system, sbom in zip(systems, sboms) if sbom is not None}
+
+################################
+# Library releases
+################################
+
+# library_releases.json:
+#   {"packages": {"pkg:maven/commons-io/commons-io": {"releases": {"2.4": "2012-06-12", ...},
+#                                                     "next": {"2.4": "2.5"}, "latest": "2.16.1"}}}
+def load_releases(input_directory):
+    releases_file = os.path.join(input_directory, RELEASES_FILE)
+    if not os.path.isfile(releases_file):
+        return {'packages': {}}
+    with open(releases_file, 'r') as f:
+        return json.load(f)
+
+def save_releases(input_directory, releases):
+    temporary_file = os.path.join(input_directory, RELEASES_FILE + '.part')
+    with open(temporary_file, 'w') as f:
+        json.dump(releases, f, indent=2, sort_keys=True)
+    os.replace(temporary_file, os.path.join(input_directory, RELEASES_FILE))
+
+# add what the SBOM components know about releases, returns the number of packages that changed
+def update_releases(releases, libraries):
+    changed = set()
+    for library in libraries:
+        if not library['package']:
+            continue
+        package = releases['packages'].setdefault(library['package'], {'releases': {}, 'next': {}, 'latest': None})
+        before = json.dumps(package, sort_keys=True)
+        for version, date in [(library['version'], library['releaseDate']),
+                              (library['nextVersion'], library['nextReleaseDate']),
+                              (library['latestVersion'], library['latestReleaseDate'])]:
+            if version and version != 'N/A' and date:
+                package['releases'][version] = date
+        if library['version'] and library['nextVersion']:
+            package['next'][library['version']] = library['nextVersion']
+        latest = library['latestVersion']
+        if latest and latest != 'N/A' and (package['latest'] is None or
+                                           (library['latestReleaseDate'] or '') >= package['releases'].get(package['latest'], '')):
+            package['latest'] = latest
+        if json.dumps(package, sort_keys=True) != before:
+            changed.add(library['package'])
+    return len(changed)
+
+################################
+# Rating libraries and systems
+################################
+
+def days_between(start, end):
+    return (datetime.date.fromisoformat(end[:10]) - datetime.date.fromisoformat(start[:10])).days
+
+def risk_level(risk, days):
+    if days is None:
+        return None
+    for level, level_days in RISK_DAYS[risk]:
+        if days >= level_days:
+            return level
+    return 'NONE'
+
+# the risks of one library version on a snapshot date, from the releases of its package
+# (a risk that cannot be told from the releases is taken from the SBOM, or is UNKNOWN)
+def library_risks(library, snapshot, releases):
+    package = releases['packages'].get(library['package'], {'releases': {}, 'next': {}, 'latest': None})
+    version = library['version']
+    known = {version: date for version, date in package['releases'].items() if date <= snapshot} # not yet released on the snapshot date
+    latest = package['latest'] if package['latest'] in known else (max(known, key=known.get) if known else None)
+    next_version = package['next'].get(version)
+    if next_version == 'N/A' or version == latest:
+        next_version = None # the newest version
+    elif next_version is None and version in known:
+        later = [other for other, date in known.items() if date > known[version]]
+        next_version = min(later, key=known.get) if later else None
+    next_date = known.get(next_version)
+
+    if version == latest or (next_version is None and version in known):
+        outdated_days = 0
+    else:
+        outdated_days = days_between(next_date, snapshot) if next_date else None
+    unmaintained_days = days_between(known[latest], snapshot) if latest else None
+
+    risks = {
+            'outdatedRisk': risk_level('outdatedRisk', outdated_days),
+            'unmaintainedRisk': risk_level('unmaintainedRisk', unmaintained_days),
+            'unmanagedRisk': library['sigridRisks']['unmanagedRisk'] or
+                            ('NONE' if any(os.path.basename(path).lower() in MANAGED_FILES for path in library['paths']) else 'MEDIUM')
+            }
+    for risk, level in risks.items():
+        if level is None:
+            risks[risk] = library['sigridRisks'][risk] or 'UNKNOWN'
+    return {
+            **risks,
+            'versionDate': package['releases'].get(version),
+            'latestVersion': latest,
+            'latestVersionDate': known.get(latest),
+            'outdatedSinceVersion': next_version,
+            'outdatedSinceVersionDate': next_date
+            }
+
+# 0.5 to 5.5 stars from the risk levels of the libraries of a system, 5.5 without libraries
+def risk_rating(risk, levels, thresholds):
+    levels = [level for level in levels if level != 'UNKNOWN']
+    rating = 5.5
+    for position, level in enumerate(LEVELS):
+        share = sum(1 for other in levels if other in LEVELS[:position + 1]) / len(levels) if levels else 0.0
+        if share == 0:
+            continue
+        points = [(0.0, 5.5)] + list(zip(thresholds['thresholds'][risk][level], [4.5, 3.5, 2.5, 1.5, 0.5]))
+        level_rating = 0.5
+        for (low_share, high_rating), (high_share, low_rating) in zip(points, points[1:]):
+            if share <= high_share:
+                level_rating = high_rating - (high_rating - low_rating) * (share - low_share) / (high_share - low_share) if high_share > low_share else low_rating
+                break
+        rating = min(rating, level_rating)
+    return rating
+
+# the internal API response of one system from its libraries and their risks
+def system_osh(snapshot, libraries, risks, thresholds):
+    libraries_at_start = []
+    for library in libraries:
+        rated = risks[library_key(library['package'], library['version']), snapshot]
+        entry = {field: None for field in LIBRARY_FIELDS}
+        entry.update({
+                    'type': library['type'],
+                    'name': library['name'],
+                    'version': library['version'],
+                    'transitive': library['transitive'],
+                    'paths': library['paths'],
+                    'snapshotDate': snapshot,
+                    **rated
+                    })
+        libraries_at_start.append(entry)
+    ratings = {}
+    for risk, (rating, _) in RISKS.items():
+        value = risk_rating(risk, [library[risk] for library in libraries_at_start], thresholds)
+        ratings[rating] = {'value': value, 'baselineValue': value}
+    return {
+            'librariesAtStart': libraries_at_start,
+            'librariesAtEnd': libraries_at_start,
+            'metadata': {'source': 'offline_osh.py', 'thresholds': thresholds.get('name')},
+            'ratings': ratings,
+            'snapshotDate': snapshot,
+            'analysisDate': snapshot
+            }
+
+# the osh results of all systems from their SBOMs: {system: internal API response}
+# (write=True writes them to <system>_offline_osh-findings.json, and saves the new releases to library_releases.json
+# and the libraries to osh_libraries.json; write=False leaves every file as it is)
+def offline_osh(input_directory, systems, workers=1, write=True, thresholds=None):
+    thresholds = thresholds or load_thresholds()
+    sboms = read_sboms(input_directory, systems, workers)
+    releases = load_releases(input_directory)
+    changed = update_releases(releases, [library for _, libraries in sboms.values() for library in libraries])
+    if changed and write:
+        save_releases(input_directory, releases)
+
+    # every library version is rated once per snapshot date, whichever systems use it
+    unique = {}
+    for snapshot, libraries in sboms.values():
+        for library in libraries:
+            unique.setdefault((library_key(library['package'], library['version']), snapshot), library)
+    risks = {(key, snapshot): library_risks(library, snapshot, releases) for (key, snapshot), library in unique.items()}
+    print(f'Rated {len(risks)} distinct libraries for {len(sboms)} systems ({changed} packages with new releases)')
+
+    results = {system: system_osh(snapshot, libraries, risks, thresholds) for system, (snapshot, libraries) in sboms.items()}
+    if write:
+        for system, result in results.items():
+            osh_file = os.path.join(input_directory, system, system + OFFLINE_SUFFIX)
+            with open(osh_file + '.part', 'w') as f:
+                json.dump(result, f)
+            os.replace(osh_file + '.part', osh_file)
+        build_library_index(input_directory, list(results), load_library_index(input_directory), OFFLINE_SUFFIX)
+    return results
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    from write_greenability import list_systems # imported here, write_greenability imports this file
+    parser = argparse.ArgumentParser(description='Open source health ratings from the SBOMs, without the internal Sigrid API.')
+    parser.add_argument('command', choices=['build', 'compare'])
+    parser.add_argument('input_directory', nargs='?', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--workers', type=int, default=1, help='processes reading the SBOMs')
+    parser.add_argument('--thresholds', help='json file with the rating thresholds (default: osh_rating_thresholds.json)')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory)
+    systems = list_systems(input_directory)
+    thresholds = load_thresholds(args.thresholds and os.path.expanduser(args.thresholds))
+    if args.command == 'build':
+        results = offline_osh(input_directory, systems, args.workers, thresholds=thresholds)
+        print(f'OSH results written for {len(results)} systems')
+    else:
+        # offline ratings next to the ratings of the internal API that were downloaded before; the systems the
+        # thresholds were fitted to are listed, but only the other systems count for the agreement
+        results = offline_osh(input_directory, systems, args.workers, write=False, thresholds=thresholds)
+        fitted = set(thresholds.get('fitted_on', []))
+        differences = []
+        print(f'{"System":40} {"Rating":20} {"Offline":>8} {"Sigrid":>8}')
+        for system, result in results.items():
+            osh_file = os.path.join(input_directory, system, f'{system}_internal_osh-findings.json')
+            downloaded = {}
+            if os.path.isfile(osh_file):
+                with open(osh_file, 'r') as f:
+                    downloaded = json.load(f).get('ratings', {})
+            for rating, _ in RISKS.values():
+                offline = result['ratings'][rating]['value']
+                sigrid = downloaded.get(rating, {}).get('value')
+                if sigrid is not None and system not in fitted:
+                    differences.append(abs(offline - sigrid))
+                print(f'{system:40} {rating:20} {offline:8.2f} {"" if sigrid is None else f"{sigrid:8.2f}":>8}'
+                      f'{"  (fitted on)" if system in fitted else ""}')
+        if differences:
+            print(f'{len(differences)} ratings of systems the thresholds were not fitted on: mean difference '
+                  f'{sum(differences) / len(differences):.2f} stars, {sum(1 for difference in differences if difference <= 0.5)} within 0.5 stars')
+        else:
+            print('Every system with downloaded ratings was used to fit the thresholds, so their agreement says nothing')
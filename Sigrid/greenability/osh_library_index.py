@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+import os
+import json
+import argparse
+
+'''
+This file performs the following tasks:
+1. reads the libraries of every <system>_internal_osh-findings.json (written by get_osh_results()
+    in write_greenability.py) once
+2. keeps every library once, keyed by (name, version), with its risks and the systems that
+    depend on it, instead of once per system that uses it
+3. saves the index as osh_libraries.json in the greenability input directory, so questions like
+    "which systems depend on commons-io 2.4" are answered from the index without reading
+    the osh files of every system again
+
+osh_libraries.json:
+    {
+        "libraries": {
+            "<name>@<version>": {"name": ..., "version": ..., "type": ..., "<risk>": ..., "systems": [...]}
+        },
+        "systems": {"<system>": ["<name>@<version>", ...]}
+    }
+
+To Run file:
+    python3 osh_library_index.py build
+    python3 osh_library_index.py systems commons-io --version 2.4
+    python3 osh_library_index.py libraries churn2-cio-original
+
+This file is structured as follows:
+1. Library fields
+2. Building the index:
+    add_system()
+    remove_system()
+    build_library_index()
+3. Reading the index:
+    load_library_index()
+    systems_using()
+    libraries_of()
+4. Main
+
+'''
+
+################################
+# Library fields
+################################
+
+INDEX_FILE = 'osh_libraries.json'
+
+# fields kept per library, the same for every system that uses the same version
+LIBRARY_FIELDS = [
+                'type',
+                'name',
+                'version',
+                'severity',
+                'vulnerabilityRisk',
+                'outdatedRisk',
+                'unmaintainedRisk',
+                'unstableRisk',
+                'unmanagedRisk',
+                'licenseRisk',
+                'licenseShort',
+                'versionDate',
+                'latestVersion',
+                'latestVersionDate',
+                'outdatedSinceVersion',
+                'outdatedSinceVersionDate',
+                'maxCvss',
+                'snapshotDate'
+                ]
+
+def library_key(name, version):
+    return f'{name}@{version}'
+
+################################
+# Building the index
+################################
+
+def empty_index():
+    return {'libraries': {}, 'systems': {}}
+
+# add the libraries of one system (the response of the libraryDependencies API)
+def add_system(index, system, data):
+    remove_system(index, system) # a system that is added again replaces its old libraries
+    keys = []
+    for library in (data or {}).get('librariesAtStart', []):
+        key = library_key(library.get('name'), library.get('version'))
+        entry = index['libraries'].get(key)
+        # the newest analysis of a library is kept
+        if entry is None or (library.get('snapshotDate') or '') > (entry.get('snapshotDate') or ''):
+            systems = entry['systems'] if entry else []
+            entry = index['libraries'][key] = {field: library.get(field) for field in LIBRARY_FIELDS}
+            entry['systems'] = systems
+        if system not in entry['systems']:
+            entry['systems'].append(system)
+            keys.append(key)
+    index['systems'][system] = keys
+    return index
+
+def remove_system(index, system):
+    for key in index['systems'].pop(system, []):
+        entry = index['libraries'][key]
+        entry['systems'].remove(system)
+        if not entry['systems']: # no system depends on the library anymore
+            del index['libraries'][key]
+    return index
+
+# index the osh files of the given systems (all systems in input_directory if none are given),
+# <system>_internal_osh-findings.json or the files of offline_osh.py with suffix='_offline_osh-findings.json'
+def build_library_index(input_directory, systems=None, index=None, suffix='_internal_osh-findings.json'):
+    index = index or empty_index()
+    if systems is None:
+        from write_greenability import list_systems # imported here, write_greenability imports this file
+        systems = list_systems(input_directory)
+    for system in systems:
+        osh_file = os.path.join(input_directory, system, system + suffix)
+        if not os.path.isfile(osh_file):
+            remove_system(index, system)
+            continue
+        try:
+            with open(osh_file, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            data = None
+        add_system(index, system, data)
+
+    temporary_file = os.path.join(input_directory, INDEX_FILE + '.part')
+    with open(temporary_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary_file, os.path.join(input_directory, INDEX_FILE))
+    print(f'Indexed {len(index["libraries"])} libraries used by {len(index["systems"])} systems')
+    return index
+
+################################
+# Reading the index
+################################
+
+def load_library_index(input_directory):
+    index_file = os.path.join(input_directory, INDEX_FILE)
+    if not os.path.isfile(index_file):
+        return empty_index()
+    with open(index_file, 'r') as f:
+        return json.load(f)
+
+# the systems that depend on a library, name is the full name (eg. commons-io:commons-io)
+# or only the part after the last ':' (eg. commons-io), any version if none is given
+def systems_using(index, name, version=None):
+    if version is not None and library_key(name, version) in index['libraries']:
+        return list(index['libraries'][library_key(name, version)]['systems'])
+    systems = []
+    for library in index['libraries'].values():
+        if name in (library['name'], (library['name'] or '').rsplit(':', 1)[-1]) and version in (None, library['version']):
+            systems += [system for system in library['systems'] if system not in systems]
+    return systems
+
+def libraries_of(index, system):
+    return [index['libraries'][key] for key in index['systems'].get(system, [])]
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or query the index of open source libraries used by the systems.')
+    parser.add_argument('command', choices=['build', 'systems', 'libraries'])
+    parser.add_argument('name', nargs='?', help='library name (systems) or system (libraries)')
+    parser.add_argument('--version', help='only this version of the library')
+    parser.add_argument('--input', default='~/Desktop/uploads/Sahin/greenability')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input)
+    if args.command == 'build':
+        build_library_index(input_directory)
+    elif args.command == 'systems':
+        for system in systems_using(load_library_index(input_directory), args.name, args.version):
+            print(system)
+    else:
+        for library in libraries_of(load_library_index(input_directory), args.name):
+            print(f'{library["name"]} {library["version"]}  outdated: {library["outdatedRisk"]}  '
+                  f'unmaintained: {library["unmaintainedRisk"]}  unmanaged: {library["unmanagedRisk"]}')
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+import os
+import json
+import argparse
+import numpy as np
+from metric_store import to_float
+
+'''
+This file performs the following tasks:
+1. reads a Greenability model from a json (or yaml) file: which metrics make up each property, with
+    their weights, and the weight of each property in the Greenability score
+    (greenability_model.json is the model write_greenability.py uses by default)
+2. compiles the model once into a metric x property weight matrix for the metrics of the systems
+3. scores all systems at once: the metrics of all systems are one system x metric matrix, and the
+    property scores are the weighted average of the metrics that have a value, calculated with
+    array operations in which missing values ('N/A', missing osh ratings) are masked out; a system
+    gets exactly the same scores whether it is scored alone or with all other systems
+4. a property without any metric value scores 0, and Greenability is the weighted average of
+    all property scores, like the lists and averages write_greenability.py used before
+
+A model file looks like this, a property lists its metrics (weight 1 each) or gives their weights:
+    {
+        "name": "greenability",
+        "properties": {
+            "Maintainability Score": ["volume", "duplication", ...],
+            "Reliability Score": {"reliability": 1}
+        },
+        "greenability": {"Maintainability Score": 1, "Reliability Score": 1}
+    }
+
+To score the systems of a greenability directory under another model:
+    python3 scoring_model.py my_model.json --input ~/Desktop/uploads/Sahin/greenability
+
+This file is structured as follows:
+1. Reading models:
+    load_model()
+2. Compiling models:
+    model_metrics()
+    compile_model()
+3. Scoring:
+    metric_values()
+    score_values()
+    score_records()
+4. Main
+
+'''
+
+DEFAULT_MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'greenability_model.json')
+
+GREENABILITY = 'Greenability Score'
+
+################################
+# Reading models
+################################
+
+def load_model(model_file=None):
+    model_file = model_file or DEFAULT_MODEL_FILE
+    with open(model_file, 'r') as f:
+        if model_file.endswith(('.yaml', '.yml')):
+            import yaml # only needed for yaml models
+            return yaml.safe_load(f)
+        return json.load(f)
+
+################################
+# Compiling models
+################################
+
+# {metric: weight} of a property, which the model gives as a list or as a dict
+def model_metrics(metrics):
+    if isinstance(metrics, dict):
+        return {metric: float(weight) for metric, weight in metrics.items()}
+    return {metric: 1.0 for metric in metrics}
+
+# Compiled model for the given metric columns:
+#   'metrics'     the metric of each row of 'weights'
+#   'properties'  the property of each column of 'weights', in the order of the model
+#   'weights'     metric x property matrix, 0 where a property does not use a metric
+#   'greenability' weight of each property in the Greenability score
+#   'unused'      metrics named by the model that are not in any system
+def compile_model(model, metrics):
+    properties = list(model['properties'])
+    positions = {metric: i for i, metric in enumerate(metrics)}
+    weights = np.zeros((len(metrics), len(properties)))
+    unused = []
+    for column, prop in enumerate(properties):
+        for metric, weight in model_metrics(model['properties'][prop]).items():
+            if metric in positions:
+                weights[positions[metric], column] = weight
+            elif metric not in unused:
+                unused.append(metric)
+    greenability = model.get('greenability') or {prop: 1 for prop in properties} # unweighted average by default
+    return {
+            'metrics': list(metrics),
+            'properties': properties,
+            'weights': weights,
+            'greenability': np.array([float(greenability.get(prop, 0)) for prop in properties]),
+            'unused': unused
+            }
+
+################################
+# Scoring
+################################
+
+# system x metric matrix of the records, metrics sorted by name so the columns do not depend on which
+# systems are scored together (placeholders like 'N/A' become NaN and are left out of the averages)
+def metric_values(records):
+    metrics = sorted(set(metric for record in records for metric in record['metrics']))
+    positions = {metric: i for i, metric in enumerate(metrics)}
+    values = np.full((len(records), len(metrics)), np.nan)
+    for row, record in enumerate(records):
+        values[row, [positions[metric] for metric in record['metrics']]] = [to_float(value) for value in record['metrics'].values()]
+    return values, metrics
+
+# property scores (system x property) and Greenability scores (per system) of a system x metric matrix;
+# the sums are taken per system in the same order however many systems there are (a matrix product
+# rounds differently for another number of rows), so scoring one system gives the same floats as
+# scoring it together with all others, like watch_sigrid.py and write_greenability.py do
+def score_values(values, compiled):
+    present = ~np.isnan(values)
+    totals = (np.where(present, values, 0)[:, :, None] * compiled['weights']).sum(axis=1)
+    counts = (present[:, :, None] * compiled['weights']).sum(axis=1) # sum of the weights of the metrics with a value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(counts > 0, totals / counts, 0)
+    greenability = (scores * compiled['greenability']).sum(axis=1) / compiled['greenability'].sum()
+    return scores, greenability, counts > 0
+
+# score all records in one go, record['scores'] is {property: score, ..., 'Greenability Score': score}
+def score_records(records, model=None):
+    model = model or load_model()
+    values, metrics = metric_values(records)
+    compiled = compile_model(model, metrics)
+    scores, greenability, scored = score_values(values, compiled)
+    for record, system_scores, system_greenability, system_scored in zip(records, scores.tolist(), greenability.tolist(), scored.tolist()):
+        record['scores'] = {
+                            # a property without values scores 0, written as 0 like before
+                            prop: score if has_values else 0
+                            for prop, score, has_values in zip(compiled['properties'], system_scores, system_scored)
+                            }
+        record['scores'][GREENABILITY] = system_greenability
+    return records
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    import sys
+    import csv
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+    from write_greenability import read_all_systems
+
+    parser = argparse.ArgumentParser(description='Score all systems under a Greenability model.')
+    parser.add_argument('model', nargs='?', default=DEFAULT_MODEL_FILE, help='json or yaml model file')
+    parser.add_argument('--input', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--output', help='csv file (default: print to the terminal)')
+    args = parser.parse_args()
+
+    model = load_model(os.path.expanduser(args.model))
+    records = score_records(read_all_systems(os.path.expanduser(args.input)), model)
+    with open(os.path.expanduser(args.output), 'w', newline='') if args.output else sys.stdout as f:
+        writer = csv.writer(f)
+        writer.writerow(['System Name'] + list(records[0]['scores']) if records else ['System Name'])
+        for record in records:
+            writer.writerow([record['name']] + list(record['scores'].values()))
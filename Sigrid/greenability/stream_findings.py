@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+import os
+import csv
+import json
+import argparse
+
+'''
+This file performs the following tasks:
+1. reads a findings export (<system>_security-findings.json or <system>_reliability-findings.json)
+    one finding at a time, so memory use stays flat however many findings the file holds
+2. calculates per-system aggregates while reading:
+    - number of findings
+    - number of findings per severity
+    - number of findings per CWE
+    - mean severityScore
+3. writes the aggregates of all systems to findings_summary.csv and findings_cwe.csv
+
+write_greenability.py uses summarise_system_findings() when run with --findings.
+findings_store.py keeps the findings of many snapshots in one compact store, and writes the same
+aggregates from it.
+
+To Run file on its own:
+    python3 stream_findings.py ~/Desktop/uploads/Sahin/greenability
+
+This file is structured as follows:
+1. Streaming reader:
+    iter_json_array()
+2. Aggregates:
+    summarise_findings()
+    summarise_system_findings()
+3. Writing aggregates:
+    write_findings_summary()
+4. Main
+
+'''
+
+FINDINGS_TYPES = ['security', 'reliability']
+
+SEVERITIES = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW', 'INFORMATION', 'UNKNOWN']
+
+CHUNK_SIZE = 64 * 1024
+
+################################
+# Streaming reader
+################################
+
+# yields the items of a top level json array one by one, only ever holding one chunk
+# of the file and the item being decoded in memory
+def iter_json_array(json_file, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    with open(json_file, 'r') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer:
+            return # empty file, eg. a failed export
+        if buffer[0] != '[':
+            raise ValueError(f'{json_file} does not hold a json array')
+        position = 1
+        end_of_file = False
+        while True:
+            # skip whitespace and the commas between items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # an item is only complete once a delimiter follows it, otherwise it may continue
+                # in the next chunk (eg. the 2 of 2.5)
+                if (end == len(buffer) or buffer[end] not in ' \t\r\n,]') and not end_of_file:
+                    raise json.JSONDecodeError('item may continue in next chunk', buffer, end)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                chunk = f.read(chunk_size)
+                end_of_file = not chunk
+                # drop what has been decoded already before growing the buffer
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            position = end
+
+################################
+# Aggregates
+################################
+
+def summarise_findings(json_file):
+    count = 0
+    severity_total = 0
+    severity_count = 0 # findings that have a severityScore
+    by_severity = dict.fromkeys(SEVERITIES, 0)
+    by_cwe = {}
+    for finding in iter_json_array(json_file):
+        count += 1
+        severity = finding.get('severity') or 'UNKNOWN'
+        by_severity[severity] = by_severity.get(severity, 0) + 1
+        cwe = finding.get('cweId')
+        if cwe:
+            by_cwe[cwe] = by_cwe.get(cwe, 0) + 1
+        if finding.get('severityScore') is not None:
+            severity_total += finding['severityScore']
+            severity_count += 1
+    return {
+            'count': count,
+            'mean_severity_score': severity_total / severity_count if severity_count else None,
+            'by_severity': by_severity,
+            'by_cwe': by_cwe
+            }
+
+# aggregates of the security and reliability findings of one system, eg. {'security': {...}, 'reliability': {...}}
+def summarise_system_findings(system_path, system):
+    summaries = {}
+    for findings_type in FINDINGS_TYPES:
+        json_file = os.path.join(system_path, f'{system}_{findings_type}-findings.json')
+        if os.path.isfile(json_file):
+            summaries[findings_type] = summarise_findings(json_file)
+    return summaries
+
+################################
+# Writing aggregates
+################################
+
+# records are the system records of write_greenability.py, with a 'findings' entry
+def write_findings_summary(input_directory, records):
+    with open(os.path.join(input_directory, 'findings_summary.csv'), 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['System Name', 'Findings', 'Count', 'Mean Severity Score'] + SEVERITIES)
+        for record in records:
+            for findings_type, summary in record.get('findings', {}).items():
+                writer.writerow(
+                                [record['name'], findings_type, summary['count'], summary['mean_severity_score']]
+                                + [summary['by_severity'].get(severity, 0) for severity in SEVERITIES]
+                                )
+
+    with open(os.path.join(input_directory, 'findings_cwe.csv'), 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['System Name', 'Findings', 'CWE', 'Count'])
+        for record in records:
+            for findings_type, summary in record.get('findings', {}).items():
+                for cwe, count in sorted(summary['by_cwe'].items()):
+                    writer.writerow([record['name'], findings_type, cwe, count])
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarise Sigrid findings exports without loading them whole.')
+    parser.add_argument('input_directory', nargs='?', default='~/Desktop/uploads/Sahin/greenability')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory)
+    records = []
+    for system in sorted(os.listdir(input_directory)):
+        system_path = os.path.join(input_directory, system)
+        if '-' in system and os.path.isfile(os.path.join(system_path, system + '_maintainability.json')): # only system folders (see write_greenability.is_system)
+            records.append({'name': system.split('-')[1], 'findings': summarise_system_findings(system_path, system)})
+            print(f'Findings summarised for {system}')
+    write_findings_summary(input_directory, records)
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+import os
+import math
+import argparse
+from itertools import combinations, islice
+import numpy as np
+from metric_store import read_store
+from scoring_model import load_model, GREENABILITY
+from write_correlation import read_churn, rank_rows
+
+'''
+This file performs the following tasks:
+1. reads the property scores of all systems from the greenability_scores store (written by
+    write_greenability.py), so no json file is read again
+2. generates property weight vectors, either a grid over all weights that add up to 1 in steps
+    of 1/--grid, or --random vectors drawn uniformly from all weights that add up to 1
+3. calculates Greenability of every system under a chunk of weight vectors at a time with one
+    matrix product, and ranks the systems under every weight vector at once
+4. streams one line per weight vector to greenability_sweep.csv:
+    - rank_spearman: Spearman correlation of the ranking with the ranking under the model weights
+    - top_overlap: share of the --top greenest systems under the model weights that stay in the top
+    - spearman <refactoring>: Spearman correlation of Greenability with the churn of each refactoring
+5. keeps, for every system, its best, worst and mean rank over all weight vectors, and writes them to
+    greenability_sweep_ranks.csv at the end (rank 1 is the greenest system)
+
+Only one chunk of weight vectors is in memory at a time, so millions of weight vectors can be swept.
+
+To Run file:
+    python3 sweep_greenability.py --grid 20
+    python3 sweep_greenability.py --random 1000000 --seed 1
+
+This file is structured as follows:
+1. Reading property scores
+2. Weight vectors:
+    grid_weights()
+    random_weights()
+3. Sweeping:
+    normalised_ranks()
+    sweep_chunk()
+    sweep()
+4. Main
+
+'''
+
+CHUNK_SIZE = 4096 # weight vectors per matrix product
+
+################################
+# Reading property scores
+################################
+
+# system x property matrix of the scores in the greenability_scores store
+def read_property_scores(store):
+    matrix, systems, columns, _ = read_store(store)
+    properties = [column for column in columns if column not in ('Volume (PM)', GREENABILITY)]
+    scores = np.array(matrix[:, [columns.index(prop) for prop in properties]], dtype=np.float64)
+    return scores, systems, properties
+
+################################
+# Weight vectors
+################################
+
+# all weight vectors with weights k/steps that add up to 1, chunk by chunk
+def grid_weights(properties, steps, chunk_size=CHUNK_SIZE):
+    p = len(properties)
+    bars = combinations(range(steps + p - 1), p - 1) # stars and bars: positions of the p - 1 bars between steps stars
+    while True:
+        chunk = np.array(list(islice(bars, chunk_size)), dtype=np.int64).reshape(-1, p - 1)
+        if not len(chunk):
+            return
+        edges = np.hstack([np.full((len(chunk), 1), -1), chunk, np.full((len(chunk), 1), steps + p - 1)])
+        yield (np.diff(edges, axis=1) - 1) / steps
+
+def grid_size(properties, steps):
+    return math.comb(steps + len(properties) - 1, len(properties) - 1)
+
+# count weight vectors drawn uniformly from all weights that add up to 1, chunk by chunk
+def random_weights(properties, count, seed=0, chunk_size=CHUNK_SIZE):
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, chunk_size):
+        yield rng.dirichlet(np.ones(len(properties)), size=min(chunk_size, count - start))
+
+################################
+# Sweeping
+################################
+
+# ranks of each row, centred and scaled so the dot product of two rows is their Spearman correlation
+def normalised_ranks(values):
+    ranks, _ = rank_rows(values)
+    ranks -= ranks.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ranks / np.sqrt((ranks ** 2).sum(axis=1, keepdims=True))
+
+# summary of one chunk of weight vectors: a matrix with one row per weight vector, and the ranks of the systems
+def sweep_chunk(scores, weights, baseline, top, churn):
+    greenability = weights @ scores.T # weight vector x system
+    ascending, _ = rank_rows(greenability)
+    ranks = greenability.shape[1] + 1 - ascending # 1 is the greenest system
+
+    rank_spearman = normalised_ranks(greenability) @ baseline['ranks']
+    top_overlap = (ranks[:, baseline['top']] <= top).mean(axis=1)
+
+    columns = [weights, rank_spearman[:, None], top_overlap[:, None]]
+    for systems, churn_ranks in churn:
+        columns.append(normalised_ranks(greenability[:, systems]) @ churn_ranks.T)
+    return np.hstack(columns), ranks
+
+def sweep(scores, systems, properties, weight_chunks, output_directory, model_weights, top=10, churn=None, total=None):
+    n = len(systems)
+    top = min(top, n)
+
+    # the ranking under the model weights that every weight vector is compared with
+    model_greenability = scores @ model_weights / model_weights.sum()
+    baseline = {
+                'ranks': normalised_ranks(model_greenability[None, :])[0],
+                'top': np.argsort(-model_greenability, kind='stable')[:top]
+                }
+    model_ranks = n + 1 - rank_rows(model_greenability[None, :])[0][0]
+
+    # churn ranks per group of refactorings with churn for the same systems
+    refactorings = []
+    churn_groups = []
+    if churn is not None:
+        churn_matrix, churn_refactorings, churn_systems = churn
+        columns = [churn_systems.index(system) if system in churn_systems else -1 for system in systems]
+        values = np.where(np.array(columns) >= 0, churn_matrix[:, columns], np.nan)
+        masks, group = np.unique(np.isnan(values), axis=0, return_inverse=True)
+        for i, mask in enumerate(masks):
+            rows = np.flatnonzero(group.ravel() == i)
+            if (~mask).sum() >= 3:
+                churn_groups.append((np.flatnonzero(~mask), normalised_ranks(values[np.ix_(rows, ~mask)])))
+                refactorings += [churn_refactorings[row] for row in rows]
+
+    best = np.full(n, n + 1)
+    worst = np.zeros(n, dtype=np.int64)
+    rank_sum = np.zeros(n)
+    swept = 0
+    sweep_file = os.path.join(output_directory, 'greenability_sweep.csv')
+    with open(sweep_file + '.part', 'w') as f:
+        f.write(','.join(properties + ['rank_spearman', 'top_overlap'] + [f'spearman {r}' for r in refactorings]) + '\n')
+        for weights in weight_chunks:
+            summary, ranks = sweep_chunk(scores, weights, baseline, top, churn_groups)
+            np.savetxt(f, summary, delimiter=',', fmt='%.6g')
+            best = np.minimum(best, ranks.min(axis=0))
+            worst = np.maximum(worst, ranks.max(axis=0))
+            rank_sum += ranks.sum(axis=0)
+            swept += len(weights)
+            if total:
+                print(f'\r{swept}/{total} weight vectors', end='', flush=True)
+    os.replace(sweep_file + '.part', sweep_file)
+    if total:
+        print()
+
+    with open(os.path.join(output_directory, 'greenability_sweep_ranks.csv'), 'w') as f:
+        f.write('System Name,Model Rank,Best Rank,Worst Rank,Mean Rank\n')
+        for i, system in enumerate(systems):
+            f.write(f'{system},{model_ranks[i]:g},{best[i]:g},{worst[i]:g},{rank_sum[i] / max(swept, 1):.6g}\n')
+    print(f'Swept {swept} weight vectors over {n} systems')
+    return swept
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Greenability under many property weights.')
+    parser.add_argument('--grid', type=int, help='all weights in steps of 1/GRID that add up to 1')
+    parser.add_argument('--random', type=int, help='number of random weight vectors')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10, help='size of the top for top_overlap')
+    parser.add_argument('--scores', default='~/Desktop/uploads/Sahin/greenability/greenability_scores',
+                        help='greenability_scores store, without extension')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/churn/churn.csv', help='churn.csv, leave out with --no-churn')
+    parser.add_argument('--no-churn', action='store_true')
+    parser.add_argument('--model', help='model with the weights to compare with (default: greenability_model.json)')
+    parser.add_argument('--output', default='~/Desktop/uploads/Sahin/greenability')
+    args = parser.parse_args()
+    if (args.grid is None) == (args.random is None):
+        parser.error('give either --grid or --random')
+
+    scores, systems, properties = read_property_scores(os.path.expanduser(args.scores))
+    model_greenability = load_model(args.model and os.path.expanduser(args.model)).get('greenability') or {}
+    model_weights = np.array([float(model_greenability.get(prop, 1 if not model_greenability else 0)) for prop in properties])
+
+    if args.grid is not None:
+        weight_chunks, total = grid_weights(properties, args.grid), grid_size(properties, args.grid)
+    else:
+        weight_chunks, total = random_weights(properties, args.random, args.seed), args.random
+    churn = None if args.no_churn else read_churn(os.path.expanduser(args.churn))
+
+    sweep(scores, systems, properties, weight_chunks, os.path.expanduser(args.output), model_weights, args.top, churn, total)
@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+import os
+import csv
+import math
+import argparse
+from functools import lru_cache
+from itertools import permutations
+import numpy as np
+from metric_store import read_store
+
+'''
+This file performs the following tasks:
+1. reads the metrics of all systems (combined_systems, as written by write_greenability.py) and
+    the average churn in person-months per system and refactoring (churn.csv, from write_churn.py)
+2. ranks every metric and every refactoring once, and calculates the Spearman correlation of all
+    (metric, refactoring) pairs in one matrix product instead of one test per pair
+3. calculates the p-values for all pairs at once, the same way R's cor.test(method = "spearman") does:
+    - without ties and at most 9 systems: exact, from the distribution of all rankings
+    - without ties and more systems: Edgeworth series approximation (AS 89)
+    - with ties: t-approximation with n - 2 degrees of freedom
+4. writes the same csv files as R/heatmaps/correlation.R:
+    all_correlation_results.csv, metric_correlation_results.csv, property_correlation_results.csv
+
+To Run file:
+    python3 write_correlation.py
+    python3 write_correlation.py --metrics metrics.csv --churn churn.csv --output results
+    (--metrics takes the combined_systems store or any csv in the format of combined_systems.csv)
+
+This file is structured as follows:
+1. Properties and labels
+2. Reading metrics and churn:
+    read_metrics()
+    read_churn()
+3. Spearman correlation:
+    rank_rows()
+    spearman_matrix()
+4. P-values:
+    exact_p_values()
+    edgeworth_p_values()
+    t_p_values()
+    spearman_p_values()
+5. Correlation results:
+    correlate()
+    property_results()
+    metric_results()
+6. Writing results:
+    write_results()
+7. Main
+
+'''
+
+################################
+# Properties and labels
+################################
+
+PROPERTIES = ['maintainability', 'architecture', 'reliability']
+
+OSH_METRICS = ['Activity Risk', 'Freshness Risk', 'Management Risk'] # averaged into the osh property
+
+CHURN_COLUMN = 'average totalNewVolumeInMonths'
+
+REFACTORING_LABELS = {
+                    'extractmethod': 'Extract Method',
+                    'extractvariable': 'Extract Local Variable',
+                    'variabletofield': 'Convert Local Variable to Field',
+                    'introduceindirection': 'Introduce Indirection',
+                    'inline': 'Inline Method',
+                    'introducepo': 'Introduce Parameter Object'
+                    }
+
+PROPERTY_LABELS = {
+                    'maintainability': 'Maintainability',
+                    'architecture': 'Architecture Quality',
+                    'osh': 'Open Source Health',
+                    'reliability': 'Reliability'
+                    }
+
+METRIC_LABELS = {
+                    'volume': 'Volume',
+                    'unitSize': 'Unit Size',
+                    'unitInterfacing': 'Unit Interfacing',
+                    'unitComplexity': 'Unit Complexity',
+                    'testCodeRatio': 'Test Code Ratio',
+                    'technologyPrevalence': 'Technology Prevalence',
+                    'moduleCoupling': 'Module Coupling',
+                    'duplication': 'Duplication',
+                    'componentCoupling': 'Component Coupling',
+                    'componentCohesion': 'Component Cohesion',
+                    'communicationCentralization': 'Communication Centralization',
+                    'codeReuse': 'Code Reuse',
+                    'codeBreakdown': 'Code Breakdown'
+                    }
+
+EXACT_SYSTEMS = 9 # R counts all rankings up to 9 observations
+
+EXACT_LIMIT = 1290 # above this R always uses the t-approximation
+
+################################
+# Reading metrics and churn
+################################
+
+def to_float(value):
+    try:
+        return float(value)
+    except ValueError: # empty cell or NA
+        return np.nan
+
+# metric x system matrix, from the combined_systems store or from a csv file in the same format
+def read_metrics(path):
+    if not path.endswith('.csv'):
+        matrix, metrics, systems, _ = read_store(path)
+        return np.asarray(matrix, dtype=np.float64), metrics, systems
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        systems = next(reader)[1:]
+        rows = list(reader)
+    matrix = np.array([[to_float(value) for value in row[1:]] for row in rows], dtype=np.float64).reshape(len(rows), len(systems))
+    return matrix, [row[0] for row in rows], systems
+
+# refactoring x system matrix of the average churn (in person-months by default), NaN where a system has no runs
+def read_churn(churn_file, column=CHURN_COLUMN):
+    with open(churn_file, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    refactorings = sorted({row['Refactoring'] for row in rows})
+    systems = list(dict.fromkeys(row['System'] for row in rows))
+    matrix = np.full((len(refactorings), len(systems)), np.nan)
+    for row in rows:
+        matrix[refactorings.index(row['Refactoring']), systems.index(row['System'])] = float(row[column])
+    return matrix, refactorings, systems
+
+################################
+# Spearman correlation
+################################
+
+# ranks of the values in each row (ties get their average rank), and whether a row has ties
+def rank_rows(matrix):
+    rows, n = matrix.shape
+    order = np.argsort(matrix, axis=1, kind='stable')
+    ordered = np.take_along_axis(matrix, order, axis=1)
+
+    # number the runs of equal values, over all rows at once
+    new_run = np.ones((rows, n), dtype=bool)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run = np.cumsum(new_run.ravel()) - 1
+    position = np.tile(np.arange(n, dtype=np.float64), rows)
+    start = np.bincount(run, weights=position) / np.bincount(run) # average position of each run
+
+    ranks = np.empty((rows, n))
+    np.put_along_axis(ranks, order, start[run].reshape(rows, n) + 1, axis=1)
+    return ranks, ~new_run[:, 1:].all(axis=1)
+
+# Spearman correlation of every row of x with every row of y (Pearson correlation of the ranks)
+def spearman_matrix(x, y):
+    x_ranks, x_ties = rank_rows(x)
+    y_ranks, y_ties = rank_rows(y)
+    x_ranks -= x_ranks.mean(axis=1, keepdims=True)
+    y_ranks -= y_ranks.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'): # constant rows have no correlation
+        x_ranks /= np.sqrt((x_ranks ** 2).sum(axis=1, keepdims=True))
+        y_ranks /= np.sqrt((y_ranks ** 2).sum(axis=1, keepdims=True))
+    rho = np.clip(x_ranks @ y_ranks.T, -1, 1)
+    return rho, x_ties[:, None] | y_ties[None, :]
+
+################################
+# P-values
+################################
+
+# number of rankings of n values for each S = sum of squared rank differences
+@lru_cache(maxsize=None)
+def rank_distribution(n):
+    ranks = np.array(list(permutations(range(n))), dtype=np.int64)
+    s = ((ranks - np.arange(n)) ** 2).sum(axis=1)
+    return np.bincount(s, minlength=(n ** 3 - n) // 3 + 1)
+
+# two-sided p-values from the exact distribution of S, for n <= 9 without ties
+def exact_p_values(s, n):
+    counts = rank_distribution(n)
+    at_least = np.cumsum(counts[::-1])[::-1] / counts.sum()       # P(S >= s)
+    at_most = np.cumsum(counts) / counts.sum()                    # P(S <= s)
+    upper = s > (n ** 3 - n) / 6
+    s = np.clip(np.round(s).astype(np.int64), 0, len(counts) - 1)
+    return np.where(upper, at_least[s], at_most[np.minimum(s + 1, len(counts) - 1)])
+
+# upper tail of the standard normal distribution
+def normal_upper(x):
+    return 0.5 * np.vectorize(math.erfc)(x / math.sqrt(2))
+
+# one-sided p-values from the Edgeworth series of AS 89, for n > 9 without ties
+def edgeworth_p_values(s, n):
+    upper = s > (n ** 3 - n) / 6
+    js = np.where(upper, np.round(s), np.round(s) + 2) # R asks for P(S < s + 2) on the lower side
+    b = 1 / n
+    x = (6 * (js - 1) * b / (n * n - 1) - 1) * math.sqrt(1 / b - 1)
+    y = x * x
+    u = x * b * (0.2274 + b * (0.2531 + 0.1745 * b) + y * (-0.0758 + b * (0.1033 + 0.3932 * b)
+            - y * b * (0.0879 + 0.0151 * b - y * (0.0072 - 0.0831 * b + y * b * (0.0131 - 4.6e-4 * y)))))
+    y = u / np.exp(y / 2)
+    p = np.where(upper, y + normal_upper(x), -y + normal_upper(-x))
+    return np.clip(p, 0, 1)
+
+# continued fraction of the regularized incomplete beta function, evaluated for an array of x
+def beta_fraction(a, b, x, iterations=300, epsilon=1e-16):
+    tiny = 1e-300
+    c = np.ones_like(x)
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d.copy()
+    converged = np.zeros(x.shape, dtype=bool)
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1 + numerator / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            h *= np.where(converged, 1, d * c) # converged values stop changing, or rounding errors add up
+        converged |= np.abs(d * c - 1) < epsilon
+        if converged.all():
+            break
+    return h
+
+# regularized incomplete beta function I_x(a, b)
+def incomplete_beta(a, b, x):
+    x = np.asarray(x, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        front = np.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * np.log(x) + b * np.log1p(-x))
+        direct = front * beta_fraction(a, b, x) / a
+        mirrored = 1 - front * beta_fraction(b, a, 1 - x) / b
+    result = np.where(x < (a + 1) / (a + b + 2), direct, mirrored)
+    return np.where(x <= 0, 0.0, np.where(x >= 1, 1.0, result))
+
+# one-sided p-values of rho from the t distribution with n - 2 degrees of freedom, used when there are ties
+def t_p_values(rho, n):
+    df = n - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = rho / np.sqrt((1 - rho ** 2) / df)
+    p = 0.5 * incomplete_beta(df / 2, 0.5, df / (df + t ** 2)) # P(T >= |t|)
+    return np.where(rho == 0, 0.5, p)
+
+# two-sided p-values of a matrix of correlations over n systems
+def spearman_p_values(rho, ties, n):
+    if n < 3:
+        return np.full(rho.shape, np.nan)
+    s = (n ** 3 - n) * (1 - rho) / 6
+    p = t_p_values(rho, n)
+    exact = ~ties & (n < EXACT_LIMIT)
+    if exact.any():
+        p[exact] = exact_p_values(s[exact], n) if n <= EXACT_SYSTEMS else edgeworth_p_values(s[exact], n)
+    return np.where(np.isnan(rho), np.nan, np.minimum(2 * p, 1))
+
+################################
+# Correlation results
+################################
+
+# rows of (Metric, Refactoring, cor_value, p_value) for every metric and refactoring, sorted like R's group_by
+def correlate(metrics, metric_names, metric_systems, churn, refactorings, churn_systems):
+    systems = [system for system in metric_systems if system in churn_systems] # inner join on System
+    x = metrics[:, [metric_systems.index(system) for system in systems]]
+    y = churn[:, [churn_systems.index(system) for system in systems]]
+
+    rho = np.full((len(x), len(y)), np.nan)
+    p_value = np.full((len(x), len(y)), np.nan)
+    complete = np.ones((len(x), len(y)), dtype=bool)
+
+    # systems with a missing value are left out of the test (cor.test), which needs its own ranking
+    # for every combination of missing systems; without missing values this is a single matrix product
+    x_missing, x_pattern = np.unique(np.isnan(x), axis=0, return_inverse=True)
+    y_missing, y_pattern = np.unique(np.isnan(y), axis=0, return_inverse=True)
+    for i, x_mask in enumerate(x_missing):
+        for j, y_mask in enumerate(y_missing):
+            rows, columns = np.flatnonzero(x_pattern == i), np.flatnonzero(y_pattern == j)
+            present = ~x_mask & ~y_mask
+            pair_rho, ties = spearman_matrix(x[np.ix_(rows, present)], y[np.ix_(columns, present)])
+            rho[np.ix_(rows, columns)] = pair_rho
+            p_value[np.ix_(rows, columns)] = spearman_p_values(pair_rho, ties, int(present.sum()))
+            complete[np.ix_(rows, columns)] = present.all()
+
+    cor_value = np.where(complete, rho, np.nan) # like cor(), a correlation with missing values is NA
+    results = []
+    for i in sorted(range(len(metric_names)), key=lambda i: metric_names[i]):
+        for j in sorted(range(len(refactorings)), key=lambda j: refactorings[j]):
+            results.append([metric_names[i], refactorings[j], cor_value[i, j], p_value[i, j]])
+    return results
+
+def nan_mean(values):
+    values = [value for value in values if not np.isnan(value)]
+    return sum(values) / len(values) if values else np.nan
+
+# maintainability, architecture and reliability, plus osh as the average of its three risks
+def property_results(results):
+    properties = [row for row in results if row[0] in PROPERTIES]
+    osh = {}
+    for metric, refactoring, cor_value, p_value in results:
+        if metric in OSH_METRICS:
+            osh.setdefault(refactoring, []).append((cor_value, p_value))
+    for refactoring in sorted(osh):
+        properties.append(['osh', refactoring, nan_mean([c for c, _ in osh[refactoring]]), nan_mean([p for _, p in osh[refactoring]])])
+    return [[PROPERTY_LABELS.get(metric, metric), REFACTORING_LABELS.get(refactoring, refactoring), cor_value, p_value]
+            for metric, refactoring, cor_value, p_value in properties]
+
+def metric_results(results):
+    return [[METRIC_LABELS.get(metric, metric), REFACTORING_LABELS.get(refactoring, refactoring), cor_value, p_value]
+            for metric, refactoring, cor_value, p_value in results if metric not in PROPERTIES]
+
+################################
+# Writing results
+################################
+
+# a number the way R's write.csv prints it: 15 significant digits, scientific only if that is shorter
+def r_number(value):
+    if np.isnan(value):
+        return 'NA'
+    value = float(f'{value:.15g}')
+    fixed = np.format_float_positional(value, trim='-')
+    mantissa, exponent = f'{value:.15e}'.split('e')
+    mantissa = mantissa.rstrip('0').rstrip('.')
+    scientific = f'{mantissa}e{exponent[0]}{abs(int(exponent)):02d}'
+    return fixed if len(fixed) <= len(scientific) else scientific
+
+def write_results(results, csv_file):
+    with open(csv_file, 'w', newline='') as f:
+        f.write('"","Metric","Refactoring","cor_value","p_value"\n')
+        for number, (metric, refactoring, cor_value, p_value) in enumerate(results, start=1):
+            f.write(f'"{number}","{metric}","{refactoring}",{r_number(cor_value)},{r_number(p_value)}\n')
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Spearman correlation of Greenability metrics with refactoring churn.')
+    parser.add_argument('--metrics', default='~/Desktop/uploads/Sahin/greenability/combined_systems',
+                        help='combined_systems store (without extension) or csv file')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/churn/churn.csv')
+    parser.add_argument('--output', default='~/Desktop/uploads/Sahin/correlation')
+    args = parser.parse_args()
+
+    metrics, metric_names, metric_systems = read_metrics(os.path.expanduser(args.metrics))
+    churn, refactorings, churn_systems = read_churn(os.path.expanduser(args.churn))
+    results = correlate(metrics, metric_names, metric_systems, churn, refactorings, churn_systems)
+
+    output_directory = os.path.expanduser(args.output)
+    os.makedirs(output_directory, exist_ok=True)
+    write_results(results, os.path.join(output_directory, 'all_correlation_results.csv'))
+    write_results(metric_results(results), os.path.join(output_directory, 'metric_correlation_results.csv'))
+    write_results(property_results(results), os.path.join(output_directory, 'property_correlation_results.csv'))
+    print(f'Correlated {len(metric_names)} metrics with churn of {len(refactorings)} refactorings over {len(metric_systems)} systems')
@@ -1,24 +1,58 @@
 #!/usr/bin/python3
 import os
-import pandas as pd
+import sys
 import json
 import csv
-import requests
-import datetime
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared Sigrid modules
+from sigrid_cache import ResponseCache
+from stream_findings import summarise_system_findings, write_findings_summary
+from manifest import empty_manifest, load_manifest, save_manifest, changed_systems, update_system
+from metric_store import metric_matrix, score_matrix, write_store, write_csv
+from sigrid_fetch import osh_jobs, run_jobs
+from osh_library_index import build_library_index, load_library_index
+from offline_osh import offline_osh, OFFLINE_SUFFIX
+from scoring_model import load_model, score_records
+from metric_history import HISTORY_NAME, ingest_records
+import instrumentation
+from instrumentation import timer, count, count_bytes
+
 # Author: Kirsten Gericke
 # Software Improvement Group
 # June 2024
 
 '''
 This file performs the following tasks: 
-1. sends a GET request for osh metrics from Sigirid 
-2. reads Sigrid metrics from json files already collected earlier
-3. writes only the Greenability metrics to a csv file for each system 
-4. calculates the scores for Greenability properties
+1. sends GET requests for osh metrics from Sigirid for all systems at the same time (or takes
+    them from the response cache when the system has not been re-analysed since they were
+    downloaded), and indexes the libraries of all systems in osh_libraries.json
+    (see osh_library_index.py); with --offline-osh the osh metrics are calculated from the SBOMs
+    (<system>_osh-findings.json) instead, without tokens, into <system>_offline_osh-findings.json
+    (see offline_osh.py); the downloaded <system>_internal_osh-findings.json is left as it is
+2. reads Sigrid metrics from json files already collected earlier (each file once) and keeps
+    the metrics of every system in memory
+3. writes only the Greenability metrics to a csv file for each system (optional, --system-csv)
+4. calculates the scores for Greenability properties, for all systems at once, under the model
+    in greenability_model.json (use --model to score under another model, see scoring_model.py)
 5. calcualtes the overall greenability score for each system
 6. writes all scores for all systems into one csv file
+7. writes all metrics of all systems into combined_systems.csv; both csv files also get a
+    typed binary copy (combined_systems.npy, greenability_scores.npy, see metric_store.py)
+    that loads memory-mapped in milliseconds
+
+Reading and scoring can be spread over several processes with --workers N,
+the output is the same as with one process.
+With --findings, the security and reliability findings are streamed as well and
+summarised per system in findings_summary.csv and findings_cwe.csv.
+Only systems whose json files changed since the last run are read again (see
+.greenability_manifest.json), use --full to read every system again.
+With --metrics run.json (or run.prom), the time, bytes and calls of every stage and every system
+are written at the end (see instrumentation.py), --profile cprofile,tracemalloc profiles every stage.
+With --history, the metrics of every rating in allRatings and the metrics and scores of this run
+are added to the time series in metric_history.bin, so earlier snapshots are kept (see metric_history.py).
 
 To Run file:
 1. This file is executed by get_results.sh, which means all the json files will be in 
@@ -48,57 +82,47 @@ NB!!
 
 
 This file is structured as follows:
-1. Lists of metrics needed from json files for main Greenability properties:
-    measurability_metrics
-    maintainability_metrics
-    freshness_metrics
-    reliability_metrics
+1. Lists of metrics read from json files (the metrics of each Greenability property
+    are in greenability_model.json, see scoring_model.py):
+    architecture_metrics
+    osh_metrics
 2. Functions for calculating Greenability:
-    calculate_score()
-    get_volume_pm()
+    get_snapshot_date()
     write_headings()
+    calculate_system_scores()
+    score_row()
     write_system_scores()
     calculate_greenability()
-3. Functions for writing metrics:
-    write_maintainability_metrics_to_csv()
-    write_osh_metrics_to_csv()
-    write_reliability_metrics_to_csv()
-    write_architecture_metrics_to_csv()
-    json_to_csv()
-4. Main
+    write_greenability_scores()
+3. Functions for reading metrics (every json file is read once per system):
+    read_maintainability_metrics()
+    read_maintainability_history()
+    read_osh_metrics()
+    read_reliability_metrics()
+    read_architecture_metrics()
+    read_system_metrics()
+    read_system_files()
+    read_system()
+    read_system_measured()
+    is_system()
+    list_systems()
+    read_systems()
+    read_all_systems()
+    read_changed_systems()
+4. Functions for writing metrics:
+    json_to_csv() (optional, use --system-csv)
+    combine_all_metrics()
+    store_greenability_scores()
+    store_history()
+5. Main
 
 '''
 
 ################################
-# Metrics needed from json files for main Greenability properties
+# Metrics read from json files, the metrics of each Greenability property are
+# in the model (greenability_model.json, see scoring_model.py)
 ################################
 
-measurability_metrics=[
-                        'unitInterfacing',
-                        'moduleCoupling',
-                        'componentIndependence',
-                        'componentEntanglement',
-                        'codeBreakdown',
-                        'componentCoupling', 
-                        'testCodeRatio',
-                        'freshness',
-                        'technologyPrevalence'
-                        ]
-
-maintainability_metrics=[
-                        'volume',
-                        'duplication',
-                        'unitSize',
-                        'unitComplexity',
-                        'unitInterfacing',
-                        'moduleCoupling',
-                        'componentIndependence',
-                        'componentEntanglement',
-                        'codeBreakdown',
-                        'componentCoupling',
-                        'testCodeRatio'
-                        ]   
-
 architecture_metrics=[
                         "codeBreakdown",
                         "componentCoupling",
@@ -123,161 +147,102 @@ osh_metrics=[
         # unmaintainedRating = activity risk
         # unmanagedRating = management risk
 
-freshness_metrics=[
-                        'freshness', 
-                        'technologyPrevalence'
-                        ]       
-
-reliability_metrics=['reliability']             
-
 ################################
 # Get OSH results: please read instructions for setting tokens 
 ################################
 
-def get_osh_results(input_directory):
+def get_osh_results(input_directory, cache=None, workers=8):
     load_dotenv()
     sigrid_XSRF_token = os.getenv("XSRF_TOKEN")
     sigrid_SSO_token = os.getenv("SSO_TOKEN")
 
-    customer = "sigdelivery"
-    current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-    cookies = {
-        'XSRF-TOKEN': sigrid_XSRF_token,
-        'ssoToken': sigrid_SSO_token,
-    }
-
-    headers = {
-        'Content-Type': 'application/json',
-    }
-
-    for system_name in os.listdir(input_directory):
-        system_path = os.path.join(input_directory, system_name) #eg. ../json_ouputs/bayes
-        if system_name!='virtualenv' and os.path.isdir(system_path): # only look at folders not files
-            print(system_name)
-            response = requests.get(
-                f'https://sigrid-says.com/rest/analysis-results/libraryDependencies/{customer}/{system_name}?startDate={current_date}&endDate={current_date}',
-                cookies=cookies,
-                headers=headers
-            )
-            response_dict = response.json()
-            file_path = os.path.join(system_path, f"{system_name}_internal_osh-findings.json")
-            with open(file_path, "w") as json_file:
-                # Convert dictionary to JSON string and write it to the file
-                json.dump(response_dict, json_file)
-                print(f'OSH results successfully written for {system_name}.')
+    systems = list_systems(input_directory)
+    # reuse the cached results if the system has the same snapshot as when they were downloaded
+    snapshots = {system: get_snapshot_date(os.path.join(input_directory, system)) for system in systems}
+
+    # all systems are fetched at the same time over one pooled session
+    jobs = osh_jobs(input_directory, systems, sigrid_XSRF_token, sigrid_SSO_token)
+    failed = run_jobs(jobs, workers, cache=cache, snapshots=snapshots)
+    for job in failed:
+        print(f'OSH results could not be fetched for {job["system"]}.')
+
+    # every library once, with the systems that use it (osh_libraries.json)
+    with timer('osh_index'):
+        build_library_index(input_directory, systems, load_library_index(input_directory))
 
 ################################
 # Functions for calculating Greenability
 ################################
 
-# get list of metric values needed for a property, and return the average
-def calculate_score(csv_file, metrics):
-    total_sum = 0
-    count = 0
-    with open(csv_file, mode='r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if len(row) >= 2 and row[0] in metrics and row[1]!='NA':
-                total_sum += float(row[1])
-                count +=1
-    if count==0:
-        return 0
-    else:
-        return total_sum/count
+# placeholders ('N/A', missing osh ratings) are skipped when calculating scores
+def is_value(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
-# Volume in Person Months is not needed for calculation, but is interesting to see in csv
-def get_volume_pm(system_path):
+# snapshot date of the last analysis, used to tell whether cached Sigrid results are still current
+def get_snapshot_date(system_path):
     for quality_file in os.listdir(system_path):
         if quality_file.endswith('maintainability.json'):
             json_file = os.path.join(system_path, quality_file)
             with open(json_file, 'r') as jf:
-                data = json.load(jf) 
-            return data.get('volumeInPersonMonths', 0)
-
-def write_headings(csv_file):
-    # write headings of columns for csv file:
+                data = json.load(jf)
+            return data.get('maintainabilityDate')
+
+def write_headings(csv_file, properties=None):
+    # write headings of columns for csv file (the properties of the model, by default the four Greenability properties):
+    properties = properties or [
+                                'Maintainability Score', 
+                                'Measurability Score', 
+                                'Freshness Score', 
+                                'Reliability Score'
+                                ]
     with open(csv_file, 'w', newline='') as cf: # 'w' cause first time writing
         writer = csv.writer(cf) 
-        writer.writerow([
-                        'System Name', 
-                        'Volume (PM)',
-                        'Maintainability Score', 
-                        'Measurability Score', 
-                        'Freshness Score', 
-                        'Reliability Score', 
-                        'Greenability Score'
-                        ]) 
-
-def write_system_scores(system, csv_file, csv_location, system_path):
-    # values in put in csv:
-    maintainability_score = calculate_score(csv_location, maintainability_metrics)
-    measurability_score = calculate_score(csv_location, measurability_metrics)
-    freshness_score = calculate_score(csv_location, freshness_metrics)
-    reliability_score = calculate_score(csv_location, reliability_metrics)
-    volume_PM = get_volume_pm(system_path)
-
-    # calcuate greenability:
-    scores = [
-            maintainability_score, 
-            measurability_score, 
-            freshness_score,
-            reliability_score
-            ]
-    greenability_score = sum(scores)/len(scores) # for some reason I cant install numpy
+        writer.writerow(['System Name', 'Volume (PM)'] + properties + ['Greenability Score']) 
 
-    # write one row in csv file per system:
-    with open(csv_file, 'a', newline='') as cf: # 'a' cause appending
-        writer = csv.writer(cf)
-        writer.writerow([
-                        system.split('-')[1],
-                        volume_PM,
-                        maintainability_score,
-                        measurability_score,
-                        freshness_score,
-                        reliability_score,
-                        greenability_score,
-                    ]) 
-        print(f'Greenability metrics successfully written for {system}')
-
-def calculate_greenability(input_directory, csv_file):
-    for system in os.listdir(input_directory):
-        system_path = os.path.join(input_directory, system) #eg. ../json_ouputs/bayes
-        if system!='virtualenv' and os.path.isdir(system_path): # only look at folders not files
-            for quality_file in os.listdir(system_path): # go through files in system folder
-                # get quality metric results
-                if quality_file.endswith('.csv'): # skip json files
-                    csv_location = os.path.join(system_path, quality_file) #eg. ../json_ouputs/bayes/bayes.csv
-                    write_system_scores(system, csv_file, csv_location, system_path) # write scores for single system
-
-def write_all_scores(input_directory, csv_destination):
-    for system in os.listdir(input_directory):
-        system_path = os.path.join(input_directory, system) #eg. ../json_ouputs/bayes
-        if system!='virtualenv' and os.path.isdir(system_path): # only look at folders not files
-            for quality_file in os.listdir(system_path): # go through files in system folder
-                # get quality metric results
-                if quality_file.endswith('.csv'): # skip json files
-                    csv_source = os.path.join(system_path, quality_file) #eg. ../json_ouputs/bayes/bayes.csv
-                    with open(csv_destination, 'a', newline='') as cf: # 'a' cause appending
-                        writer = csv.writer(cf)
-                        
-                        writer.writerow([
-                                        system.split('-')[1],
-                                        volume_PM,
-                                        maintainability_score,
-                                        measurability_score,
-                                        freshness_score,
-                                        reliability_score,
-                                        greenability_score,
-                                    ]) 
+# calculate property scores and greenability from the metrics of one system
+# (score_records() scores many systems at once, which is much faster)
+def calculate_system_scores(record, model=None):
+    return score_records([record], model)[0]
 
+# one row of greenability_scores.csv
+def score_row(record):
+    return [record['name'], record['volume_pm']] + list(record['scores'].values())
+
+def write_system_scores(record, writer, quiet=False):
+    # write one row in csv file per system:
+    writer.writerow(score_row(record)) 
+    if not quiet:
+        print(f'Greenability metrics successfully written for {record["system"]}')
+
+def calculate_greenability(records, csv_file, model=None, quiet=False):
+    # score the systems that were not scored yet all at once
+    unscored = [record for record in records if 'scores' not in record]
+    if unscored:
+        with timer('score'):
+            score_records(unscored, model)
+    with timer('write_scores'):
+        with open(csv_file, 'a', newline='') as cf: # 'a' cause appending after the headings
+            writer = csv.writer(cf)
+            for record in records:
+                write_system_scores(record, writer, quiet) # write scores for single system
+        count('write_scores', 'rows', len(records))
+        count_bytes('write_scores', os.path.getsize(csv_file))
+
+# headings and scores of all systems are written to a temporary file that replaces greenability_scores.csv,
+# so a reader never sees half a csv file
+def write_greenability_scores(records, csv_file, model=None, quiet=False):
+    model = model or load_model()
+    write_headings(csv_file + '.part', list(model['properties']))
+    calculate_greenability(records, csv_file + '.part', model, quiet)
+    os.replace(csv_file + '.part', csv_file)
 
 ################################
-# Functions for writing metrics
+# Functions for reading metrics
 ################################
 
-def write_maintainability_metrics_to_csv(json_file, csv_file):
-    maintainability_metrics = [
+# each function returns the [metric, value] rows of one json file, in the order they appear in the system csv
+
+maintainability_metrics = [
         'maintainability',
         'componentIndependence',
         'componentEntanglement',
@@ -290,68 +255,41 @@ def write_maintainability_metrics_to_csv(json_file, csv_file):
         'volume',
         ]
 
-    with open(json_file, 'r') as jf:
-        data = json.load(jf) # Read the JSON file
-
-    # Open the CSV file for writing
-    # can use w cause its the first time writing to the file
-    with open(csv_file, 'w', newline='') as cf:
-        writer = csv.writer(cf)
-        
-        # Write a header for the maintainability metrics section
-        #writer.writerow(['Maintainability Metrics'])
-        #writer.writerow(['metric', 'value'])  # Sub-header for this section
-
-        # Write the maintainability metrics and their values to the CSV file
-        for metric in maintainability_metrics:
-            if metric in data:
-                writer.writerow([metric, data[metric]])
-            else:
-                writer.writerow([metric, 'N/A'])  # or an appropriate placeholder
-
-        # Add a blank line to separate sections
-        #writer.writerow([])
-
-def write_osh_metrics_to_csv(json_file, csv_file):
-    osh_metrics=[
-                        'outdatedRating',
-                        'unmanagedRating',
-                        'unmaintainedRating'
-                        ]
+def read_maintainability_metrics(data):
+    rows = []
+    for metric in maintainability_metrics:
+        if metric in data:
+            rows.append([metric, data[metric]])
+        else:
+            rows.append([metric, 'N/A'])  # or an appropriate placeholder
+    return rows
+
+# [date, metric, value] rows of every earlier rating in allRatings, for metric_history.py
+# (Sigrid lists the newest rating first, the rows are oldest first so a later rating of the same date replaces an earlier one)
+def read_maintainability_history(data):
+    rows = []
+    for rating in reversed(data.get('allRatings', [])):
+        date = rating.get('maintainabilityDate')
+        if date:
+            rows += [[date, metric, rating[metric]] for metric in maintainability_metrics + ['volumeInPersonMonths'] if metric in rating]
+    return rows
+
+def read_osh_metrics(data):
     # osh metrics:
         # outdatedRating = freshness risk
         # unmaintainedRating = activity risk
         # unmanagedRating = management risk
-    with open(json_file, 'r') as jf:
-        data = json.load(jf) # Read the JSON file
-    with open(csv_file, 'a', newline='') as cf:
-        writer = csv.writer(cf)
-        #writer.writerow(['Open Source Health Metrics'])
-        #writer.writerow(['metric', 'value'])  # Sub-header for this section
-        
-        freshness_rating = data.get('ratings', {}).get('outdatedRating', {}).get('value')
-        writer.writerow(['Freshness Risk', freshness_rating])  
-        
-        activity_rating = data.get('ratings', {}).get('unmaintainedRating', {}).get('value')
-        writer.writerow(['Activity Risk', activity_rating])
-
-        management_rating = data.get('ratings', {}).get('unmanagedRating', {}).get('value')
-        writer.writerow(['Management Risk', management_rating])
-        
-        #writer.writerow([])
-
-def write_reliability_metrics_to_csv(json_file, csv_file):
-    with open(json_file, 'r') as jf:
-        data = json.load(jf) # Read the JSON file
-
-    with open(csv_file, 'a', newline='') as cf:
-        writer = csv.writer(cf)
-        #writer.writerow(['Reliability Metrics'])
-        #writer.writerow(['metric', 'value'])  # Sub-header for this section
-        writer.writerow(['reliability', data.get('rating', 0)]) 
-        #writer.writerow([])
+    ratings = data.get('ratings', {})
+    return [
+            ['Freshness Risk', ratings.get('outdatedRating', {}).get('value')],
+            ['Activity Risk', ratings.get('unmaintainedRating', {}).get('value')],
+            ['Management Risk', ratings.get('unmanagedRating', {}).get('value')]
+            ]
+
+def read_reliability_metrics(data):
+    return [['reliability', data.get('rating', 0)]]
 
-def write_architecture_metrics_to_csv(json_file, csv_file):
+def read_architecture_metrics(data):
     architecture_metrics=[
                         'architecture',
                         'codeBreakdown',
@@ -365,105 +303,183 @@ def write_architecture_metrics_to_csv(json_file, csv_file):
                         'knowledgeDistribution',
                         'componentFreshness'
                         ] 
-    with open(json_file, 'r') as jf:
-        data = json.load(jf) # Read the JSON file
-
-    # use 'a' this time to not overwrite previous written metrics
-    with open(csv_file, 'a', newline='') as cf:
-        writer = csv.writer(cf)
-
-        # Write a header for the architecture metrics section
-        #writer.writerow(['Architecture Metrics'])
-        #writer.writerow(['metric', 'value'])  # Sub-header for this section
-
-        # Write the architecture metrics and their values to the CSV file
-        for metric in architecture_metrics:
-            if metric == 'architecture': 
-                if metric in data['ratings']:
-                    writer.writerow([metric, data['ratings'][metric]])
-                else:
-                    writer.writerow([metric, 'N/A'])  # or an appropriate placeholder
-            elif metric in data['ratings']['systemProperties']:
-                writer.writerow([metric, data['ratings']['systemProperties'][metric]])
+    rows = []
+    for metric in architecture_metrics:
+        if metric == 'architecture': 
+            if metric in data['ratings']:
+                rows.append([metric, data['ratings'][metric]])
             else:
-                writer.writerow([metric, 'N/A'])  # or an appropriate placeholder
-
-        # Add a blank line to separate sections
-        #writer.writerow([])
-
-# Write one csv file for each system with all metrics for that system
-def json_to_csv(input_directory):
+                rows.append([metric, 'N/A'])  # or an appropriate placeholder
+        elif metric in data['ratings']['systemProperties']:
+            rows.append([metric, data['ratings']['systemProperties'][metric]])
+        else:
+            rows.append([metric, 'N/A'])  # or an appropriate placeholder
+    return rows
+
+def read_json(json_file, system=None):
+    with timer('json_read', system):
+        with open(json_file, 'rb') as jf:
+            content = jf.read()
+    count_bytes('json_read', len(content), system)
+    with timer('json_decode', system):
+        return json.loads(content) # Read the JSON file
+
+# Read every json file of a system once and keep all its metrics in memory:
+#   {'system': 'churn2-bayes-original', 'name': 'bayes', 'volume_pm': 17.3, 'metrics': {metric: value}}
+# with findings=True the record also gets the aggregates of its findings exports under 'findings'
+# with history=True the record also gets its snapshot date and the rows of allRatings under 'snapshot' and 'history'
+# with offline=True the osh metrics come from <system>_offline_osh-findings.json (offline_osh.py)
+def read_system_metrics(input_directory, system, findings=False, history=False, offline=False):
+    with timer('extract', system):
+        return read_system_files(input_directory, system, findings, history, offline)
+
+def read_system_files(input_directory, system, findings=False, history=False, offline=False):
+    system_path = os.path.join(input_directory, system) # eg. json_ouputs/bayes
+
+    maintainability_file = os.path.join(system_path, system+'_maintainability.json') # eg. json_ouputs/bayes/bayes_maintainability.json
+    architecture_file = os.path.join(system_path, system+'_architecture-quality.json')
+    osh_file = os.path.join(system_path, system + (OFFLINE_SUFFIX if offline else '_internal_osh-findings.json'))
+    reliability_file = os.path.join(system_path, system+'_internal_reliability-findings.json')
+
+    rows = []
+    volume_pm = None
+    snapshot, history_rows = None, []
+    if os.path.isfile(maintainability_file):
+        data = read_json(maintainability_file, system)
+        rows += read_maintainability_metrics(data)
+        # Volume in Person Months is not needed for calculation, but is interesting to see in csv
+        volume_pm = data.get('volumeInPersonMonths', 0)
+        snapshot = data.get('maintainabilityDate')
+        if history:
+            history_rows = read_maintainability_history(data)
+
+    if os.path.isfile(reliability_file):
+        rows += read_reliability_metrics(read_json(reliability_file, system))
+
+    if os.path.isfile(architecture_file):
+        rows += read_architecture_metrics(read_json(architecture_file, system))
+
+    if os.path.isfile(osh_file):
+        rows += read_osh_metrics(read_json(osh_file, system))
+    else:
+        print('Failed to find ' + osh_file)
+
+    record = {
+            'system': system,
+            'name': system.split('-')[1],
+            'volume_pm': volume_pm,
+            'metrics': dict(rows)
+            }
+    if findings:
+        with timer('findings', system):
+            record['findings'] = summarise_system_findings(system_path, system)
+    if history:
+        record['snapshot'] = snapshot
+        record['history'] = history_rows
+    return record
+
+# all the reading for one system, run in a worker process when --workers > 1
+def read_system(input_directory, system, findings=False, history=False, offline=False):
+    return read_system_metrics(input_directory, system, findings, history, offline)
+
+# read_system() in a worker process, with the timers and counters it recorded for the parent
+def read_system_measured(input_directory, system, findings=False, history=False, offline=False):
+    instrumentation.reset()
+    return read_system(input_directory, system, findings, history, offline), instrumentation.snapshot()
+
+# a system folder holds the json files of one system, eg. churn2-cio-original/churn2-cio-original_maintainability.json;
+# other folders (virtualenv, __pycache__, ...) are skipped, their names do not split into a system name
+def is_system(input_directory, system):
+    return '-' in system and os.path.isfile(os.path.join(input_directory, system, system + '_maintainability.json'))
+
+def list_systems(input_directory):
+    systems = []
     for system in sorted(os.listdir(input_directory)): # Iterate over the systems and qualities directories
-
-        system_path = os.path.join(input_directory, system) # eg. json_ouputs/bayes
-        
-        if system!='virtualenv' and os.path.isdir(system_path): # only look at folders not files
-            csv_file = os.path.join(system_path, system + '.csv')  # save the CSV in the same directory
-
-            maintainability_file = os.path.join(system_path, system+'_maintainability.json') # eg. json_ouputs/bayes/bayes_maintainability.json
-            architecture_file = os.path.join(system_path, system+'_architecture-quality.json')
-            osh_file = os.path.join(system_path, system+'_internal_osh-findings.json')
-            reliability_file = os.path.join(system_path, system+'_internal_reliability-findings.json')
-
-            if os.path.isfile(maintainability_file):
-                write_maintainability_metrics_to_csv(maintainability_file, csv_file)
-
-            if os.path.isfile(reliability_file):
-                write_reliability_metrics_to_csv(reliability_file, csv_file)
-
-            if os.path.isfile(architecture_file):
-                write_architecture_metrics_to_csv(architecture_file, csv_file)
-
-            if os.path.isfile(osh_file):
-                write_osh_metrics_to_csv(osh_file, csv_file)
-            else:
-                print('Failed to find ' + osh_file)
-
-def combine_all_metrics(input_directory):
-    base_dir = input_directory
-    # List of system names based on folder names
-    systems = [
-        "cbeanutils",
-        "ccli",
-        "ccollections",
-        "cio",
-        "clang",
-        "cmath",
-        "jodaconvert",
-        "jodatime",
-        "sudoku"
-    ]
-
-    # Initialize an empty DataFrame for the combined data
-    combined_df = pd.DataFrame()
-
-    # Iterate over each system to read its CSV and merge into the combined DataFrame
+        if is_system(input_directory, system): # only look at system folders
+            systems.append(system)
+    return systems
+
+# One record per system, in the order given whatever the number of workers
+def read_systems(input_directory, systems, workers=1, findings=False, history=False, offline=False):
+    with timer('extract'):
+        if workers <= 1 or len(systems) <= 1:
+            return [read_system(input_directory, system, findings, history, offline) for system in systems]
+        # map() returns results in the order of systems, so the output does not depend on which worker finishes first
+        chunksize = max(1, len(systems) // (workers * 4))
+        records = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for record, recorded in executor.map(read_system_measured, [input_directory] * len(systems), systems,
+                                                 [findings] * len(systems), [history] * len(systems), [offline] * len(systems),
+                                                 chunksize=chunksize):
+                instrumentation.merge(recorded)
+                records.append(record)
+        return records
+
+# One scored record per system folder, in alphabetical order, all scored at once under the model
+def read_all_systems(input_directory, workers=1, findings=False, model=None, history=False, offline=False):
+    records = read_systems(input_directory, list_systems(input_directory), workers, findings, history, offline)
+    with timer('score'):
+        return score_records(records, model)
+
+# Like read_all_systems(), but only the systems whose json files changed since the last run are
+# read again, the records of the other systems come from the manifest (all are scored again, which is cheap)
+def read_changed_systems(input_directory, manifest, workers=1, findings=False, model=None, history=False, offline=False):
+    systems = list_systems(input_directory)
+    with timer('manifest'):
+        changed, states, removed = changed_systems(input_directory, systems, manifest)
+    new_records = dict(zip(changed, read_systems(input_directory, changed, workers, findings, history, offline)))
+    records = []
     for system in systems:
-        # Construct the CSV file path
-        csv_path = os.path.join(base_dir, f"churn2-{system}-original", f"churn2-{system}-original.csv")
-        
-        # Read the CSV file
-        if os.path.exists(csv_path):
-            df = pd.read_csv(csv_path, header=None, names=['metric', 'value'])
-            
-            # Assuming the first column is the metric and the second column is the value
-            metric_col = df.columns[0]
-            value_col = df.columns[1]
-            
-            # Rename the value column to the system name
-            df.rename(columns={value_col: system}, inplace=True)
-            
-            # Merge with the combined DataFrame
-            if combined_df.empty:
-                combined_df = df
-            else:
-                combined_df = pd.merge(combined_df, df[[metric_col, system]], on=metric_col, how='outer')
+        record = new_records[system] if system in new_records else manifest['systems'][system]['result']
+        update_system(manifest, system, states[system], record)
+        records.append(record)
+    for system in removed:
+        del manifest['systems'][system]
+    count('extract', 'reused', len(records) - len(changed))
+    with timer('score'):
+        return score_records(records, model), changed, removed
 
-        else:
-            print("Can't find system: ", csv_path)
+################################
+# Functions for writing metrics
+################################
 
-    # Save the combined DataFrame to a CSV file
-    combined_df.to_csv(os.path.join(base_dir, "combined_systems.csv"), index=False)
+def write_system_csv(record, csv_file):
+    with open(csv_file, 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerows(record['metrics'].items())
+
+# Optional export: one csv file for each system with all metrics for that system
+def json_to_csv(input_directory, records, systems=None):
+    for record in records:
+        if systems is not None and record['system'] not in systems:
+            continue # unchanged, its csv file is still up to date
+        system = record['system']
+        csv_file = os.path.join(input_directory, system, system + '.csv')  # save the CSV in the same directory
+        write_system_csv(record, csv_file)
+
+def combine_all_metrics(input_directory, records):
+    with timer('combine'):
+        # one row per metric (sorted, like the outer merge of all systems), one column per system
+        matrix, metrics, systems = metric_matrix(records)
+
+        # typed binary copy for fast loading (metric_store.read_store), and the csv for the R scripts
+        write_store(os.path.join(input_directory, 'combined_systems'), matrix, metrics, systems, 'metric')
+        write_csv(os.path.join(input_directory, 'combined_systems'))
+    count_bytes('combine', matrix.nbytes + os.path.getsize(os.path.join(input_directory, 'combined_systems.csv')))
+
+# typed binary copy of greenability_scores.csv, one row per system
+def store_greenability_scores(input_directory, records):
+    with timer('store_scores'):
+        matrix, systems, columns = score_matrix(records)
+        write_store(os.path.join(input_directory, 'greenability_scores'), matrix, systems, columns, 'System Name')
+    count_bytes('store_scores', matrix.nbytes)
+
+# add the snapshots that are not in the time series yet (metric_history.bin)
+def store_history(input_directory, records):
+    with timer('history'):
+        added = ingest_records(os.path.join(input_directory, HISTORY_NAME), records)
+    count('history', 'points', added)
+    print(f'{added} new points added to the metric history')
 
 
 ################################
@@ -471,10 +487,45 @@ def combine_all_metrics(input_directory):
 ################################
 
 if __name__ == "__main__":
-    input_directory = os.path.expanduser('~/Desktop/uploads/Sahin/greenability')
-    get_osh_results(input_directory) # please read .env token instructions!
-    json_to_csv(input_directory)
+    parser = argparse.ArgumentParser(description='Calculate Greenability scores from Sigrid results.')
+    parser.add_argument('--system-csv', action='store_true', help='also write <system>.csv with the metrics of each system')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes reading and scoring systems')
+    parser.add_argument('--findings', action='store_true', help='also summarise the security and reliability findings')
+    parser.add_argument('--full', action='store_true', help='read every system again, not only the ones that changed')
+    parser.add_argument('--model', help='json or yaml Greenability model (default: greenability_model.json)')
+    parser.add_argument('--offline-osh', action='store_true', help='calculate the osh metrics from the SBOMs instead of the internal API')
+    parser.add_argument('--history', action='store_true', help='also add all snapshots to the metric history (see metric_history.py)')
+    parser.add_argument('--input', default='~/Desktop/uploads/Sahin/greenability', help='directory with one folder of json files per system')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    model = load_model(args.model and os.path.expanduser(args.model))
+
+    input_directory = os.path.expanduser(args.input)
+    if args.offline_osh:
+        with timer('osh_offline'):
+            offline_osh(input_directory, list_systems(input_directory), max(args.workers, 1))
+    else:
+        get_osh_results(input_directory, ResponseCache()) # please read .env token instructions!
+
+    # the manifest remembers the json files and records of the last run
+    manifest_file = os.path.join(input_directory, '.greenability_manifest.json')
+    options = {'findings': args.findings, 'system_csv': args.system_csv, 'history': args.history, 'offline_osh': args.offline_osh}
+    manifest = empty_manifest(options) if args.full else load_manifest(manifest_file, options)
+    records, changed, removed = read_changed_systems(input_directory, manifest, args.workers, args.findings, model, args.history, args.offline_osh) # one pass over the json files of each changed system
+    print(f'{len(changed)} of {len(records)} systems changed since the last run')
+
     csv_file = os.path.join(input_directory, 'greenability_scores.csv') # create one file with all main property values  
-    write_headings(csv_file)
-    calculate_greenability(input_directory, csv_file)
-    combine_all_metrics(input_directory)
+    model_changed = manifest.get('model') != model
+    manifest['model'] = model
+    if changed or removed or model_changed or not os.path.isfile(csv_file):
+        if args.findings:
+            write_findings_summary(input_directory, records)
+        if args.system_csv:
+            json_to_csv(input_directory, records, changed)
+        write_greenability_scores(records, csv_file, model)
+        store_greenability_scores(input_directory, records)
+        combine_all_metrics(input_directory, records)
+    if args.history:
+        store_history(input_directory, records) # only adds what is new, also when nothing changed
+    save_manifest(manifest_file, manifest)
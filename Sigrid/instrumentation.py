@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+
+'''
+This file performs the following tasks:
+1. keeps timers and counters for every stage of the pipeline (fetch, json_read, json_decode, extract,
+    score, combine, churn_read, ...) and for every system within a stage: seconds, calls, bytes and
+    any other count
+2. writes them as json (one total per stage, one entry per system per stage, and the slowest
+    systems) or as Prometheus text (a file ending in .prom), for the node exporter textfile collector
+3. optionally profiles every stage with cProfile (<stage>.prof and the 30 slowest functions in
+    <stage>.txt) and/or tracemalloc (peak bytes per stage, and the top allocation sites in
+    <stage>.tracemalloc.txt)
+
+The scripts do not need to be changed to use it, everything can be switched on from the environment:
+    SIGRID_METRICS=~/run.json python3 write_greenability.py
+    SIGRID_METRICS=~/run.prom SIGRID_PROFILE=cprofile,tracemalloc SIGRID_PROFILE_DIR=~/profiles python3 write_churn.py
+or with the --metrics and --profile flags of write_greenability.py, write_churn.py and sigrid_fetch.py.
+
+Timers are cheap (two clock readings and a lock), so they are always on; metrics are only written
+when asked for. Timers in worker processes are collected with snapshot() and added to the parent
+with merge(). Profiles are only taken of whole stages in the main process.
+
+This file is structured as follows:
+1. Recording:
+    timer()
+    count()
+    count_bytes()
+2. Collecting from workers:
+    snapshot()
+    merge()
+    reset()
+3. Profiling:
+    configure()
+    profile_stage()
+    write_allocations()
+    write_profiles()
+4. Writing metrics:
+    metrics_json()
+    metrics_prometheus()
+    write_metrics()
+    add_arguments()
+    configure_from_args()
+
+'''
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+# counters whose value is a high-water mark, merged with max() instead of added up
+PEAK_SUFFIX = '_peak'
+
+_lock = threading.Lock()
+_metrics = {} # (stage, system or None) -> {counter: value}
+_settings = {'metrics_file': None, 'profile': (), 'profile_directory': '.', 'write_profiles': False}
+_profiling = threading.local() # a thread only runs one profile at a time
+_profiles = {} # stage -> cProfile.Profile, added up over all calls of the stage
+
+################################
+# Recording
+################################
+
+def _add(key, counter, value):
+    counters = _metrics.setdefault(key, {})
+    if counter.endswith(PEAK_SUFFIX):
+        counters[counter] = max(counters.get(counter, value), value)
+    else:
+        counters[counter] = counters.get(counter, 0) + value
+
+# add value to a counter of a stage, and of a system within the stage if a system is given
+def count(stage, counter, value=1, system=None):
+    with _lock:
+        _add((stage, None), counter, value)
+        if system is not None:
+            _add((stage, system), counter, value)
+
+def count_bytes(stage, value, system=None):
+    count(stage, 'bytes', value, system)
+
+# time a block as one call of a stage, or of one system within a stage: the stage gets
+# 'seconds' (wall time) from its own timer, and 'system_seconds' (the time of all its systems
+# added up, more than the wall time when systems run in parallel) from the timers of its systems
+@contextlib.contextmanager
+def timer(stage, system=None):
+    profile = profile_stage(stage) if system is None else contextlib.nullcontext()
+    start = time.perf_counter()
+    try:
+        with profile:
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            if system is None:
+                _add((stage, None), 'seconds', seconds)
+                _add((stage, None), 'calls', 1)
+            else:
+                _add((stage, None), 'system_seconds', seconds)
+                _add((stage, None), 'system_calls', 1)
+                _add((stage, system), 'seconds', seconds)
+                _add((stage, system), 'calls', 1)
+
+################################
+# Collecting from workers
+################################
+
+# everything recorded so far, to send from a worker process to its parent
+# (a worker calls reset() before every task, it starts with a copy of its parent's metrics)
+def snapshot():
+    with _lock:
+        return [[stage, system, dict(counters)] for (stage, system), counters in _metrics.items()]
+
+def merge(recorded):
+    with _lock:
+        for stage, system, counters in recorded:
+            for counter, value in counters.items():
+                _add((stage, system), counter, value)
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+################################
+# Profiling
+################################
+
+# metrics_file is written when the program exits, profile is a list like ['cprofile', 'tracemalloc']
+def configure(metrics_file=None, profile=None, profile_directory=None):
+    if metrics_file:
+        if _settings['metrics_file'] is None:
+            atexit.register(lambda: write_metrics(_settings['metrics_file']))
+        _settings['metrics_file'] = os.path.expanduser(metrics_file)
+    if profile is not None:
+        if isinstance(profile, str):
+            profile = [name.strip() for name in profile.split(',') if name.strip()]
+        unknown = [name for name in profile if name not in PROFILERS]
+        if unknown:
+            raise ValueError(f'Unknown profiler {", ".join(unknown)}, use {" or ".join(PROFILERS)}')
+        _settings['profile'] = tuple(profile)
+    if profile_directory:
+        _settings['profile_directory'] = os.path.expanduser(profile_directory)
+    if _settings['profile'] and not _settings['write_profiles']:
+        atexit.register(write_profiles)
+        _settings['write_profiles'] = True
+
+# cProfile and tracemalloc around one call of a stage, when switched on and no other profile runs in this thread
+@contextlib.contextmanager
+def profile_stage(stage):
+    if not _settings['profile'] or getattr(_profiling, 'stage', None):
+        yield
+        return
+    _profiling.stage = stage
+    profiler = None
+    started_tracing = False
+    try:
+        if 'tracemalloc' in _settings['profile']:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if 'cprofile' in _settings['profile']:
+            with _lock:
+                profiler = _profiles.setdefault(stage, cProfile.Profile())
+            profiler.enable()
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        if 'tracemalloc' in _settings['profile']:
+            count(stage, 'tracemalloc_bytes' + PEAK_SUFFIX, tracemalloc.get_traced_memory()[1])
+            write_allocations(stage, tracemalloc.take_snapshot())
+            if started_tracing:
+                tracemalloc.stop()
+        _profiling.stage = None
+
+def write_allocations(stage, allocations, top=30):
+    os.makedirs(_settings['profile_directory'], exist_ok=True)
+    with open(os.path.join(_settings['profile_directory'], f'{stage}.tracemalloc.txt'), 'w') as f:
+        for statistic in allocations.statistics('lineno')[:top]:
+            f.write(f'{statistic}\n')
+
+# write the cProfile of every stage when the program exits
+def write_profiles():
+    with _lock:
+        profiles = dict(_profiles)
+    if profiles:
+        os.makedirs(_settings['profile_directory'], exist_ok=True)
+    for stage, profiler in profiles.items():
+        profiler.dump_stats(os.path.join(_settings['profile_directory'], f'{stage}.prof'))
+        with open(os.path.join(_settings['profile_directory'], f'{stage}.txt'), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(30)
+
+################################
+# Writing metrics
+################################
+
+# {'stages': {stage: counters}, 'systems': {system: {stage: counters}}, 'slowest': {stage: [[system, seconds], ...]}}
+def metrics_json(slowest=10):
+    with _lock:
+        metrics = {key: dict(counters) for key, counters in _metrics.items()}
+    stages = {}
+    systems = {}
+    for (stage, system), counters in sorted(metrics.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        if system is None:
+            stages[stage] = counters
+        else:
+            systems.setdefault(system, {})[stage] = counters
+    hot = {}
+    for stage in stages:
+        timed = [(system, per_stage[stage]['seconds']) for system, per_stage in systems.items() if 'seconds' in per_stage.get(stage, {})]
+        if timed:
+            hot[stage] = [[system, round(seconds, 6)] for system, seconds in sorted(timed, key=lambda item: -item[1])[:slowest]]
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'program': os.path.basename(sys.argv[0]),
+            'stages': stages, 'systems': systems, 'slowest': hot}
+
+def prometheus_name(counter):
+    name = ''.join(c if c.isalnum() else '_' for c in counter)
+    if counter.endswith(PEAK_SUFFIX):
+        return f'sigrid_{name}'
+    return f'sigrid_{name}_total'
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Prometheus text format: one metric per counter, with stage (and system) labels
+def metrics_prometheus():
+    with _lock:
+        metrics = {key: dict(counters) for key, counters in _metrics.items()}
+    lines = {}
+    for (stage, system), counters in sorted(metrics.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        labels = f'stage="{prometheus_label(stage)}"'
+        if system is not None:
+            labels += f',system="{prometheus_label(system)}"'
+        for counter, value in sorted(counters.items()):
+            lines.setdefault(counter, []).append(f'{prometheus_name(counter)}{{{labels}}} {value:.9g}')
+    text = []
+    for counter in sorted(lines):
+        text.append(f'# TYPE {prometheus_name(counter)} {"gauge" if counter.endswith(PEAK_SUFFIX) else "counter"}')
+        text += lines[counter]
+    return '\n'.join(text) + '\n'
+
+# .prom files get Prometheus text, anything else json; written to a temporary file first
+def write_metrics(metrics_file):
+    directory = os.path.dirname(os.path.abspath(metrics_file))
+    os.makedirs(directory, exist_ok=True)
+    with open(metrics_file + '.part', 'w') as f:
+        if metrics_file.endswith('.prom'):
+            f.write(metrics_prometheus())
+        else:
+            json.dump(metrics_json(), f, indent=2)
+            f.write('\n')
+    os.replace(metrics_file + '.part', metrics_file)
+
+# --metrics, --profile and --profile-dir for the argparse parser of a script
+def add_arguments(parser):
+    parser.add_argument('--metrics', default=os.getenv('SIGRID_METRICS'),
+                        help='write timers and counters per stage and system to this file (.json, or .prom for Prometheus)')
+    parser.add_argument('--profile', default=os.getenv('SIGRID_PROFILE'), help='cprofile, tracemalloc or cprofile,tracemalloc')
+    parser.add_argument('--profile-dir', default=os.getenv('SIGRID_PROFILE_DIR'), help='directory for the profiles')
+
+def configure_from_args(args):
+    configure(args.metrics, args.profile, args.profile_dir)
+
+# switched on from the environment, so scripts without the flags can be measured too
+configure(os.getenv('SIGRID_METRICS'), os.getenv('SIGRID_PROFILE'), os.getenv('SIGRID_PROFILE_DIR'))
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+import os
+import json
+import hashlib
+
+'''
+This file performs the following tasks:
+1. records, for every system folder, the size, modification time and sha256 hash of each input file,
+    a hash of the whole system, and the result the script calculated from those files
+2. tells write_greenability.py and write_churn.py which systems changed since their last run,
+    so only those systems are read again and the results of the others are reused
+3. a file whose modification time and size did not change is not hashed again; a file that was
+    touched but has the same content (eg. a re-fetch of an unchanged system) does not count as a change
+
+The manifest is a json file in the input directory:
+    {
+        "version": 1,
+        "options": {...},          settings of the run, a different setting means a full rebuild
+        "systems": {
+            "<system>": {
+                "hash": "...",     hash of all input files of the system
+                "files": {"<file>": {"size": ..., "mtime": ..., "sha256": "..."}},
+                "result": ...      whatever the script stores for the system
+            }
+        }
+    }
+
+This file is structured as follows:
+1. Hashing files:
+    file_state()
+    system_state()
+2. Reading and writing the manifest:
+    empty_manifest()
+    load_manifest()
+    save_manifest()
+3. Finding changed systems:
+    changed_systems()
+    update_system()
+
+'''
+
+MANIFEST_VERSION = 1
+
+################################
+# Hashing files
+################################
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# size, mtime and hash of a file, reusing the previous hash if size and mtime are the same
+def file_state(path, previous=None):
+    stat = os.stat(path)
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': file_hash(path)}
+
+# state of every input file in a system folder (files ending in suffix), and one hash over all of them
+def system_state(system_path, suffix='.json', previous=None):
+    previous_files = (previous or {}).get('files', {})
+    files = {}
+    for file in sorted(os.listdir(system_path)):
+        if file.endswith(suffix):
+            files[file] = file_state(os.path.join(system_path, file), previous_files.get(file))
+    digest = hashlib.sha256()
+    for file, state in files.items():
+        digest.update(f'{file}\0{state["sha256"]}\n'.encode())
+    return {'hash': digest.hexdigest(), 'files': files}
+
+################################
+# Reading and writing the manifest
+################################
+
+# a manifest in which every system counts as changed, used for full rebuilds
+def empty_manifest(options=None):
+    return {'version': MANIFEST_VERSION, 'options': options or {}, 'systems': {}}
+
+# an empty manifest if there is none yet, it is from another version, or it was made with other options
+def load_manifest(manifest_file, options=None):
+    empty = empty_manifest(options)
+    if not os.path.isfile(manifest_file):
+        return empty
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except json.JSONDecodeError:
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('options') != (options or {}):
+        return empty
+    return manifest
+
+def save_manifest(manifest_file, manifest):
+    temporary_file = manifest_file + '.part'
+    with open(temporary_file, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temporary_file, manifest_file)
+
+################################
+# Finding changed systems
+################################
+
+# returns the systems whose input files changed (or are new), the new state of every system,
+# and the systems that are in the manifest but no longer on disk
+def changed_systems(input_directory, systems, manifest, suffix='.json'):
+    changed = []
+    states = {}
+    for system in systems:
+        previous = manifest['systems'].get(system)
+        state = system_state(os.path.join(input_directory, system), suffix, previous)
+        states[system] = state
+        if previous is None or previous['hash'] != state['hash'] or 'result' not in previous:
+            changed.append(system)
+    removed = [system for system in manifest['systems'] if system not in states]
+    return changed, states, removed
+
+def update_system(manifest, system, state, result):
+    manifest['systems'][system] = {**state, 'result': result}
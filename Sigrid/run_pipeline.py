@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+import os
+import sys
+import glob
+import json
+import time
+import fnmatch
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SIGRID_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+'''
+This file performs the following tasks:
+1. runs the whole pipeline as one graph of stages instead of one shell script per experiment:
+    greenability_fetch -> greenability_score --\\
+                                                 correlate
+    churn_fetch ------> churn_aggregate ------/
+    every stage declares the files it reads (inputs) and the files it writes (outputs), a stage
+    depends on the stages that write its inputs
+2. runs stages as soon as the stages they depend on are done, up to --jobs at the same time, so the
+    greenability branch and the churn branch run side by side
+3. skips a stage whose outputs are all newer than its newest input, unless a stage it depends on ran
+    (use --force to run every stage); fetch stages have no inputs and always run, unless --no-fetch
+4. runs every stage with the python that runs this file, so no virtualenv is created and nothing is
+    installed on every run; the output of each stage goes to .pipeline_logs/<stage>.log in the correlation directory
+5. reports the time of every stage, the wall time, and the critical path: the chain of stages that
+    took longest from start to end, which is the part worth making faster
+
+With --charts, a charts stage after correlate draws the charts and heatmaps whose data changed
+(correlation/render_charts.py). The R scripts (Sigrid/correlation/churn.R, R/heatmaps/correlation.R)
+still run on their own.
+
+To Run file:
+    python3 run_pipeline.py
+    python3 run_pipeline.py --no-fetch --offline-osh --workers 8
+    python3 run_pipeline.py --dry-run          (show which stages would run)
+
+This file is structured as follows:
+1. Stages:
+    pipeline_stages()
+    stage_dependencies()
+2. Deciding what to run:
+    expand()
+    newest_input()
+    up_to_date()
+3. Running stages:
+    run_stage()
+    run_graph()
+4. Reporting:
+    critical_path()
+    print_report()
+5. Main
+
+'''
+
+LOG_DIRECTORY = '.pipeline_logs'
+
+################################
+# Stages
+################################
+
+def script(*parts):
+    return [sys.executable, os.path.join(SIGRID_DIRECTORY, *parts)]
+
+# the stages of the pipeline: {'name', 'command', 'inputs', 'outputs'} (inputs and outputs are glob patterns)
+def pipeline_stages(greenability_directory, churn_directory, correlation_directory, workers=1, offline_osh=False, base_url=None, charts=False):
+    fetch_options = ['--base-url', base_url] if base_url else []
+    greenability_options = ['--input', greenability_directory, '--workers', str(workers)] + (['--offline-osh'] if offline_osh else [])
+    stages = [
+            {
+            'name': 'greenability_fetch',
+            'command': script('sigrid_fetch.py') + ['greenability', '--output', greenability_directory] + fetch_options,
+            'inputs': [],
+            'outputs': [os.path.join(greenability_directory, '*', '*_maintainability.json')]
+            },
+            {
+            'name': 'churn_fetch',
+            'command': script('sigrid_fetch.py') + ['churn', '--output', churn_directory] + fetch_options,
+            'inputs': [],
+            'outputs': [os.path.join(churn_directory, '*', 'churn-*.json')]
+            },
+            {
+            'name': 'greenability_score',
+            'command': script('greenability', 'write_greenability.py') + greenability_options,
+            'inputs': [os.path.join(greenability_directory, '*', '*.json')],
+            'outputs': [os.path.join(greenability_directory, 'greenability_scores.csv'),
+                        os.path.join(greenability_directory, 'combined_systems.csv'),
+                        os.path.join(greenability_directory, 'combined_systems.npy')]
+            },
+            {
+            'name': 'churn_aggregate',
+            'command': script('churn', 'write_churn.py') + ['--input', churn_directory],
+            'inputs': [os.path.join(churn_directory, '*', 'churn-*.json')],
+            'outputs': [os.path.join(churn_directory, 'churn.csv')]
+            },
+            {
+            'name': 'correlate',
+            'command': script('greenability', 'write_correlation.py') + ['--metrics', os.path.join(greenability_directory, 'combined_systems'),
+                                                                          '--churn', os.path.join(churn_directory, 'churn.csv'),
+                                                                          '--output', correlation_directory],
+            'inputs': [os.path.join(greenability_directory, 'combined_systems.npy'), os.path.join(churn_directory, 'churn.csv')],
+            'outputs': [os.path.join(correlation_directory, f'{name}_correlation_results.csv') for name in ('all', 'metric', 'property')]
+            }
+            ]
+    if charts:
+        # the cache file is written on every run, the pngs only when their data changed
+        stages.append({
+            'name': 'charts',
+            'command': script('correlation', 'render_charts.py') + ['--churn', os.path.join(churn_directory, 'churn.csv'),
+                                                                    '--scores', os.path.join(greenability_directory, 'greenability_scores.csv'),
+                                                                    '--results', correlation_directory,
+                                                                    '--output', os.path.join(correlation_directory, 'graphs'),
+                                                                    '--workers', str(workers)],
+            'inputs': [os.path.join(churn_directory, 'churn.csv'), os.path.join(greenability_directory, 'greenability_scores.csv'),
+                       os.path.join(correlation_directory, '*_correlation_results.csv')],
+            'outputs': [os.path.join(correlation_directory, 'graphs', '.chart_cache.json')]
+            })
+    return stages
+
+# {stage: [stages it depends on]}: a stage depends on every other stage with an output that matches one of its inputs
+def stage_dependencies(stages):
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage['name']] = [other['name'] for other in stages if other is not stage and
+                                       any(fnmatch.fnmatch(output, pattern) or fnmatch.fnmatch(pattern, output)
+                                           for output in other['outputs'] for pattern in stage['inputs'])]
+    # a cycle would never finish, so it is refused before anything runs
+    visiting, done = set(), set()
+    def visit(name):
+        if name in visiting:
+            raise ValueError(f'the stages depend on each other in a cycle through {name}')
+        if name not in done:
+            visiting.add(name)
+            for dependency in dependencies[name]:
+                visit(dependency)
+            visiting.remove(name)
+            done.add(name)
+    for name in dependencies:
+        visit(name)
+    return dependencies
+
+################################
+# Deciding what to run
+################################
+
+def expand(patterns):
+    return [path for pattern in patterns for path in glob.glob(pattern)]
+
+def newest_input(stage):
+    return max((os.path.getmtime(path) for path in expand(stage['inputs'])), default=None)
+
+# the reason a stage has to run, or None if its outputs are newer than all its inputs
+def up_to_date(stage):
+    if not stage['inputs']:
+        return 'no inputs' # eg. fetching from Sigrid, which cannot be checked locally
+    outputs = [expand([pattern]) for pattern in stage['outputs']]
+    if not all(outputs):
+        return 'missing outputs'
+    newest = newest_input(stage)
+    if newest is None:
+        return 'missing inputs'
+    if min(os.path.getmtime(path) for paths in outputs for path in paths) < newest:
+        return 'inputs changed'
+    return None
+
+################################
+# Running stages
+################################
+
+# run one stage, its output goes to its log file; returns (succeeded, seconds)
+def run_stage(stage, log_directory):
+    os.makedirs(log_directory, exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(log_directory, stage['name'] + '.log'), 'w') as log:
+        log.write(f'$ {" ".join(stage["command"])}\n')
+        log.flush()
+        result = subprocess.run(stage['command'], stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0, time.perf_counter() - start
+
+# run the stages in the order of their dependencies, independent stages at the same time
+# returns {stage: {'status', 'reason', 'start', 'seconds'}}, start in seconds after the first stage started
+def run_graph(stages, log_directory, jobs=4, force=False, no_fetch=False, dry_run=False):
+    dependencies = stage_dependencies(stages)
+    by_name = {stage['name']: stage for stage in stages}
+    results = {}
+    running = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(results) < len(stages):
+            for name, stage in by_name.items():
+                if name in results or name in running or any(dependency not in results for dependency in dependencies[name]):
+                    continue
+                # every stage it depends on is finished
+                upstream = [results[dependency]['status'] for dependency in dependencies[name]]
+                if any(status in ('failed', 'blocked') for status in upstream):
+                    results[name] = {'status': 'blocked', 'reason': 'a stage it depends on failed', 'start': None, 'seconds': 0.0}
+                    continue
+                if no_fetch and not stage['inputs']:
+                    results[name] = {'status': 'skipped', 'reason': '--no-fetch', 'start': None, 'seconds': 0.0}
+                    continue
+                reason = 'forced' if force else ('a stage it depends on ran' if 'ran' in upstream or 'would run' in upstream else up_to_date(stage))
+                if reason is None:
+                    results[name] = {'status': 'up to date', 'reason': None, 'start': None, 'seconds': 0.0}
+                    continue
+                if dry_run:
+                    results[name] = {'status': 'would run', 'reason': reason, 'start': None, 'seconds': 0.0}
+                    continue
+                print(f'Started: {name} ({reason})')
+                running[name] = (executor.submit(run_stage, stage, log_directory), time.perf_counter() - start, reason)
+            if not running:
+                continue # stages were decided without running, look again
+            done, _ = wait([future for future, _, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _, _) in running.items() if future in done]:
+                future, stage_start, reason = running.pop(name)
+                succeeded, seconds = future.result()
+                results[name] = {'status': 'ran' if succeeded else 'failed', 'reason': reason, 'start': stage_start, 'seconds': seconds}
+                print(f'{"Done" if succeeded else "Failed"}: {name} ({seconds:.1f}s)'
+                      + ('' if succeeded else f', see {os.path.join(log_directory, name + ".log")}'))
+    return results
+
+################################
+# Reporting
+################################
+
+# the chain of stages with the longest total time, and that time (stages that did not run take 0s)
+def critical_path(stages, results):
+    dependencies = stage_dependencies(stages)
+    finish, previous = {}, {}
+    def finish_time(name):
+        if name not in finish:
+            slowest = max(dependencies[name], key=finish_time, default=None)
+            previous[name] = slowest
+            finish[name] = (finish_time(slowest) if slowest else 0.0) + results[name]['seconds']
+        return finish[name]
+    last = max((stage['name'] for stage in stages), key=finish_time)
+    path = [last]
+    while previous[path[-1]]:
+        path.append(previous[path[-1]])
+    return [name for name in path[::-1] if results[name]['seconds'] > 0], finish[last] # stages that did not run are left out
+
+def print_report(stages, results, wall_seconds):
+    print(f'{"Stage":22} {"Status":12} {"Start":>8} {"Seconds":>9}  Reason')
+    for stage in stages:
+        result = results[stage['name']]
+        start = '' if result['start'] is None else f'{result["start"]:.1f}'
+        print(f'{stage["name"]:22} {result["status"]:12} {start:>8} {result["seconds"]:9.1f}  {result["reason"] or ""}')
+    path, path_seconds = critical_path(stages, results)
+    stage_seconds = sum(result['seconds'] for result in results.values())
+    if path_seconds > 0:
+        print(f'Critical path: {" -> ".join(path)} ({path_seconds:.1f}s)')
+    else:
+        print('No stage ran')
+    print(f'Wall time {wall_seconds:.1f}s, {stage_seconds:.1f}s of stages'
+          + (f' ({stage_seconds / wall_seconds:.1f}x in parallel)' if wall_seconds > 0 and stage_seconds > 0 else ''))
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the Greenability and churn pipeline as a graph of stages.')
+    parser.add_argument('--greenability', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/churn')
+    parser.add_argument('--correlation', default='~/Desktop/uploads/Sahin/correlation')
+    parser.add_argument('--jobs', type=int, default=4, help='stages running at the same time')
+    parser.add_argument('--workers', type=int, default=1, help='processes per stage, for the stages that can use them')
+    parser.add_argument('--offline-osh', action='store_true', help='calculate the osh metrics from the SBOMs (see offline_osh.py)')
+    parser.add_argument('--base-url', help='Sigrid url the fetch stages use')
+    parser.add_argument('--charts', action='store_true', help='also draw the charts whose data changed (render_charts.py, needs matplotlib)')
+    parser.add_argument('--no-fetch', action='store_true', help='use the json files that are there, do not fetch from Sigrid')
+    parser.add_argument('--force', action='store_true', help='run every stage, also the ones that are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only show which stages would run')
+    parser.add_argument('--report', help='also write the results of every stage to this json file')
+    args = parser.parse_args()
+
+    greenability_directory = os.path.expanduser(args.greenability)
+    churn_directory = os.path.expanduser(args.churn)
+    correlation_directory = os.path.expanduser(args.correlation)
+    stages = pipeline_stages(greenability_directory, churn_directory, correlation_directory, args.workers, args.offline_osh, args.base_url, args.charts)
+
+    start = time.perf_counter()
+    results = run_graph(stages, os.path.join(correlation_directory, LOG_DIRECTORY), args.jobs, args.force, args.no_fetch, args.dry_run)
+    wall_seconds = time.perf_counter() - start
+    print_report(stages, results, wall_seconds)
+    if args.report:
+        with open(os.path.expanduser(args.report), 'w') as f:
+            json.dump({'wall_seconds': wall_seconds, 'critical_path': critical_path(stages, results)[0], 'stages': results}, f, indent=2)
+    raise SystemExit(1 if any(result['status'] in ('failed', 'blocked') for result in results.values()) else 0)
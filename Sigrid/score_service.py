@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlparse, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SIGRID_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'greenability')) # write_greenability.py and friends
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'churn')) # write_churn.py
+import write_greenability as wg
+import write_churn as wc
+from manifest import empty_manifest, changed_systems, update_system
+from scoring_model import load_model, score_records
+
+'''
+This file performs the following tasks:
+1. reads the Greenability records of all systems (write_greenability.read_system) and the churn runs
+    of all systems (write_churn.read_system_files) once, scores them under the model and keeps
+    everything in memory, with indexes by system name, metric and refactoring
+2. answers lookups over http from memory, so a dashboard gets the score of one system without
+    starting python or reading any json files:
+        GET /systems                          names of all systems
+        GET /score/<system>                   volume and scores, eg. /score/cio
+        GET /metric/<system>/<metric>         one metric of one system
+        GET /metric/<metric>                  one metric of all systems
+        GET /churn/<system>                   average churn of every refactoring of a system
+        GET /churn/<system>/<refactoring>     average and runs of one refactoring
+        GET /refactoring/<refactoring>        average churn of one refactoring in all systems
+        GET /status                           number of systems, last reload and how long it took
+        POST /reload                          reload now instead of waiting for --interval
+3. checks the json files every --interval seconds (size and modification time, see manifest.py)
+    and reads and scores again only the systems whose files changed, removed systems are dropped
+4. lookups wait for a reload that is updating the indexes, so an answer never mixes two reloads
+
+To Run file:
+    python3 score_service.py --greenability ~/Desktop/uploads/Sahin/greenability --churn ~/Desktop/uploads/Sahin/churn
+    curl localhost:8765/score/cio
+
+This file is structured as follows:
+1. Index:
+    ScoreIndex
+2. Http service:
+    ServiceHandler
+    start_service()
+3. Main
+
+'''
+
+DEFAULT_PORT = 8765
+
+################################
+# Index
+################################
+
+# the scored records and churn averages of all systems, reloaded one changed system at a time
+class ScoreIndex:
+    def __init__(self, greenability_directory=None, churn_directory=None, model=None, workers=1):
+        self.greenability_directory = greenability_directory
+        self.churn_directory = churn_directory
+        self.model = model or load_model()
+        self.workers = workers
+        self.lock = threading.Lock() # held while the indexes are read or updated
+        self.reload_lock = threading.Lock() # one reload at a time
+        self.greenability_manifest = empty_manifest()
+        self.churn_manifest = empty_manifest()
+        self.records = {} # name: scored record
+        self.metrics = {} # metric: {name: value}
+        self.churn = {} # name: {refactoring: {'average': {...}, 'runs': [...]}}
+        self.refactorings = {} # refactoring: {name: average}
+        self.status = {'reloads': 0, 'last_reload': None, 'reload_seconds': None, 'changed': 0, 'removed': 0, 'failed': []}
+
+    # read and score the systems that changed since the last reload, returns (changed, removed)
+    def reload(self):
+        with self.reload_lock:
+            return self.reload_changed()
+
+    def reload_changed(self):
+        start = time.perf_counter()
+        changed, removed, system_failed = [], [], []
+        if self.greenability_directory and os.path.isdir(self.greenability_directory):
+            systems = wg.list_systems(self.greenability_directory)
+            system_changed, states, system_removed = changed_systems(self.greenability_directory, systems, self.greenability_manifest)
+            # the changed systems are read and scored outside the lock, lookups go on meanwhile
+            read = self.read_greenability(system_changed)
+            system_failed += [system for system in system_changed if system not in read]
+            system_changed = [system for system in system_changed if system in read]
+            records = score_records([read[system] for system in system_changed], self.model)
+            with self.lock:
+                for system in system_removed:
+                    self.remove_record(self.greenability_manifest['systems'].pop(system)['result'])
+                for system, record in zip(system_changed, records):
+                    previous = self.greenability_manifest['systems'].get(system, {}).get('result')
+                    if previous:
+                        self.remove_record(previous)
+                    self.add_record(record)
+                    update_system(self.greenability_manifest, system, states[system], record['name'])
+                for system in systems:
+                    if system not in system_changed and system not in system_failed: # unchanged, only the file states are updated
+                        self.greenability_manifest['systems'][system].update(states[system])
+            changed += system_changed
+            removed += system_removed
+
+        if self.churn_directory and os.path.isdir(self.churn_directory):
+            systems = wc.list_systems(self.churn_directory)
+            system_changed, states, system_removed = changed_systems(self.churn_directory, systems, self.churn_manifest)
+            runs = {}
+            for system in system_changed:
+                try:
+                    runs[system] = wc.read_system_files(self.churn_directory, system)
+                except Exception as error:
+                    print(f'Could not read the churn of {system}, it is read again at the next reload ({error!r})')
+                    system_failed.append(system)
+            system_changed = [system for system in system_changed if system in runs]
+            with self.lock:
+                for system in system_removed:
+                    del self.churn_manifest['systems'][system]
+                    self.set_churn(system, [])
+                for system in system_changed:
+                    self.set_churn(system, runs[system])
+                    update_system(self.churn_manifest, system, states[system], system)
+                for system in systems:
+                    if system not in system_changed and system not in system_failed:
+                        self.churn_manifest['systems'][system].update(states[system])
+            changed += system_changed
+            removed += system_removed
+
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.status = {
+                            'reloads': self.status['reloads'] + 1,
+                            'last_reload': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            'reload_seconds': round(seconds, 6),
+                            'changed': len(changed),
+                            'removed': len(removed),
+                            'failed': system_failed # their manifest state is kept, so they are read again next time
+                            }
+        return changed, removed
+
+    # {system: record} of the systems that could be read; a system with a json file that is still being
+    # written (or any other error) is left out and logged
+    def read_greenability(self, systems):
+        try:
+            return dict(zip(systems, wg.read_systems(self.greenability_directory, systems, self.workers)))
+        except Exception:
+            pass # read them one at a time to find out which ones fail
+        records = {}
+        for system in systems:
+            try:
+                records[system] = wg.read_system(self.greenability_directory, system)
+            except Exception as error:
+                print(f'Could not read {system}, it is read again at the next reload ({error!r})')
+        return records
+
+    # the next three keep the indexes up to date, they are called with the lock held
+    def add_record(self, record):
+        self.records[record['name']] = record
+        for metric, value in record['metrics'].items():
+            self.metrics.setdefault(metric, {})[record['name']] = value
+
+    def remove_record(self, name):
+        record = self.records.pop(name, None)
+        for metric in (record or {}).get('metrics', {}):
+            self.metrics[metric].pop(name, None)
+            if not self.metrics[metric]:
+                del self.metrics[metric]
+
+    def set_churn(self, name, rows):
+        for refactoring in self.churn.pop(name, {}):
+            self.refactorings[refactoring].pop(name, None)
+            if not self.refactorings[refactoring]:
+                del self.refactorings[refactoring]
+        if not rows:
+            return
+        # averages like churn.csv, extractvariable runs without new files are left out
+        churn = {}
+        for _, refactoring, files, months, loc in wc.average_runs(wc.runs_from_rows(rows)):
+            churn[refactoring] = {'average': {'totalNewFiles': files, 'totalNewVolumeInMonths': months, 'totalNewVolumeInLoc': loc}, 'runs': []}
+        for row in rows:
+            churn[row[1]]['runs'].append(dict(zip(wc.CHURN_HEADINGS[2:], row[2:])))
+        self.churn[name] = churn
+        for refactoring, entry in churn.items():
+            self.refactorings.setdefault(refactoring, {})[name] = entry['average']
+
+    # lookups: the answer, or None if the system, metric or refactoring is unknown
+    def lookup(self, parts):
+        with self.lock:
+            if parts == ['systems']:
+                return sorted(set(self.records) | set(self.churn))
+            if parts == ['status']:
+                return {**self.status, 'systems': len(self.records), 'churn_systems': len(self.churn),
+                        'metrics': len(self.metrics), 'refactorings': len(self.refactorings)}
+            if len(parts) == 2 and parts[0] == 'score' and parts[1] in self.records:
+                record = self.records[parts[1]]
+                return {'system': record['system'], 'Volume (PM)': record['volume_pm'], **record['scores']}
+            if len(parts) == 3 and parts[0] == 'metric' and parts[1] in self.metrics.get(parts[2], {}):
+                return {parts[2]: self.metrics[parts[2]][parts[1]]}
+            if len(parts) == 2 and parts[0] == 'metric' and parts[1] in self.metrics:
+                return dict(self.metrics[parts[1]])
+            if len(parts) == 2 and parts[0] == 'churn' and parts[1] in self.churn:
+                return {refactoring: entry['average'] for refactoring, entry in self.churn[parts[1]].items()}
+            if len(parts) == 3 and parts[0] == 'churn' and parts[2] in self.churn.get(parts[1], {}):
+                return self.churn[parts[1]][parts[2]]
+            if len(parts) == 2 and parts[0] == 'refactoring' and parts[1] in self.refactorings:
+                return dict(self.refactorings[parts[1]])
+            return None
+
+################################
+# Http service
+################################
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, a dashboard asks many questions over one connection
+    disable_nagle_algorithm = True # small answers are sent straight away
+    index = None
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        parts = [unquote(part) for part in urlparse(self.path).path.strip('/').split('/') if part]
+        body = self.index.lookup(parts)
+        if body is None:
+            self.send_json(404, {'error': f'nothing found for /{"/".join(parts)}'})
+        else:
+            self.send_json(200, body)
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip('/') != 'reload':
+            self.send_json(404, {'error': 'only /reload can be posted'})
+            return
+        try:
+            changed, removed = self.index.reload()
+        except Exception as error:
+            print(f'Reload failed: {error!r}')
+            self.send_json(500, {'error': f'reload failed: {error!r}'})
+            return
+        self.send_json(200, {'changed': changed, 'removed': removed, 'failed': self.index.status['failed']})
+
+    def log_message(self, format, *args):
+        pass # a line per lookup would slow the service down more than the lookup itself
+
+# serve the index on a thread, and reload it every interval seconds (0: only on POST /reload)
+def start_service(index, host='127.0.0.1', port=DEFAULT_PORT, interval=5.0):
+    handler = type('Handler', (ServiceHandler,), {'index': index})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if interval > 0:
+        def reload_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    changed, removed = index.reload()
+                except Exception as error: # the thread goes on, the next reload tries again
+                    print(f'Reload failed: {error!r}')
+                    continue
+                if changed or removed:
+                    print(f'Reloaded {len(changed)} changed and {len(removed)} removed systems in {index.status["reload_seconds"]:.3f}s')
+        threading.Thread(target=reload_forever, daemon=True).start()
+    return server
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local service answering Greenability, metric and churn lookups from memory.')
+    parser.add_argument('--greenability', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/churn')
+    parser.add_argument('--model', help='json or yaml Greenability model (default: greenability_model.json)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between checks for changed json files, 0 to only reload on POST /reload')
+    parser.add_argument('--workers', type=int, default=1, help='processes reading changed systems')
+    args = parser.parse_args()
+
+    index = ScoreIndex(os.path.expanduser(args.greenability), os.path.expanduser(args.churn),
+                       load_model(args.model and os.path.expanduser(args.model)), args.workers)
+    index.reload()
+    print(f'Loaded {len(index.records)} systems and the churn of {len(index.churn)} systems in {index.status["reload_seconds"]:.2f}s')
+    server = start_service(index, args.host, args.port, args.interval)
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
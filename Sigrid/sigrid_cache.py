@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+import os
+import gzip
+import json
+import time
+import fcntl
+import hashlib
+import argparse
+import datetime
+import threading
+
+'''
+This file performs the following tasks:
+1. stores Sigrid responses on disk, compressed, named after the hash of their content
+    (two systems or two dates with the same payload share one file)
+2. keeps an index from (customer, system, endpoint, date range) to the stored payload,
+    together with the snapshot date of the system when it was downloaded
+3. tells the fetchers when a cached payload can be reused without downloading it again:
+    - the system snapshot has not changed since the payload was stored
+      (eg. the maintainabilityDate in <system>_maintainability.json)
+    - the payload covers a date range that had already ended when it was stored
+    - the server answers a conditional request with 304 Not Modified
+4. evicts payloads that are too old, or the least recently used ones when the cache is too big
+5. lets several fetchers share the cache directory: the index is saved under a file lock (index.lock),
+    merged with what the other processes saved, and a process only deletes the payloads it evicted
+
+The cache is used by sigrid_fetch.py and get_osh_results() in write_greenability.py.
+To see what is in the cache, or to evict by hand: python3 sigrid_cache.py [--evict]
+
+This file is structured as follows:
+1. Settings
+2. Reading snapshot dates:
+    snapshot_date()
+3. The cache:
+    ResponseCache
+4. Main
+
+'''
+
+################################
+# Settings
+################################
+
+DEFAULT_CACHE_DIRECTORY = os.path.expanduser(os.getenv('SIGRID_CACHE_DIR', '~/.cache/sigrid'))
+DEFAULT_MAX_BYTES = 2 * 1024**3 # 2 GB of compressed payloads
+DEFAULT_MAX_AGE_DAYS = 30
+
+# fields that hold the date of the snapshot a payload was computed from, in order of preference
+SNAPSHOT_FIELDS = ['maintainabilityDate', 'snapshotDate', 'analysisDate']
+
+################################
+# Reading snapshot dates
+################################
+
+# returns the snapshot date of a Sigrid payload, or None if it does not have one
+def snapshot_date(content):
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        for field in SNAPSHOT_FIELDS:
+            if data.get(field):
+                return data[field]
+        if data.get('snapshotDates'): # changequality results
+            return max(data['snapshotDates'])
+    elif isinstance(data, list): # findings: newest snapshot any finding was seen in
+        dates = [finding.get('lastSeenSnapshotDate') for finding in data if isinstance(finding, dict)]
+        dates = [date for date in dates if date]
+        if dates:
+            return max(dates)
+    return None
+
+################################
+# The cache
+################################
+
+class ResponseCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.index_file = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    @staticmethod
+    def key(customer, system, endpoint, start_date=None, end_date=None):
+        parts = [customer, system, endpoint, start_date or '', end_date or '']
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def object_path(self, content_hash):
+        return os.path.join(self.directory, 'objects', content_hash[:2], content_hash + '.json.gz')
+
+    # the index entry for a request, falling back to the newest entry of the same
+    # (customer, system, endpoint) with a matching snapshot when the date range is new
+    def entry(self, customer, system, endpoint, start_date=None, end_date=None, snapshot=None):
+        with self.lock:
+            entry = self.index.get(self.key(customer, system, endpoint, start_date, end_date))
+            if entry is None and snapshot:
+                candidates = [
+                            e for e in self.index.values()
+                            if (e['customer'], e['system'], e['endpoint'], e['snapshot']) == (customer, system, endpoint, snapshot)
+                            ]
+                if candidates:
+                    entry = max(candidates, key=lambda e: e['stored_at'])
+            if entry is not None and not os.path.isfile(self.object_path(entry['content_hash'])):
+                return None # payload was removed from disk by hand
+            return entry
+
+    # a cached payload can be used without asking the server if the system has not been
+    # re-analysed since, or if its date range was already over when it was downloaded
+    @staticmethod
+    def is_fresh(entry, snapshot=None):
+        if snapshot and entry.get('snapshot') == snapshot:
+            return True
+        if entry.get('end_date'):
+            stored_on = datetime.date.fromtimestamp(entry['stored_at']).isoformat()
+            return entry['end_date'] < stored_on
+        return False
+
+    # headers for asking the server whether the cached payload is still current
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read(self, entry):
+        with gzip.open(self.object_path(entry['content_hash']), 'rb') as f:
+            content = f.read()
+        with self.lock:
+            entry['last_used'] = time.time()
+        return content
+
+    def put(self, customer, system, endpoint, content, start_date=None, end_date=None, snapshot=None, etag=None, last_modified=None):
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self.object_path(content_hash)
+        if not os.path.isfile(path): # same content is only stored once
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f'{path}.{threading.get_ident()}.part'
+            with open(temporary_path, 'wb') as f:
+                f.write(gzip.compress(content))
+            os.replace(temporary_path, path)
+        now = time.time()
+        entry = {
+                'customer': customer,
+                'system': system,
+                'endpoint': endpoint,
+                'start_date': start_date,
+                'end_date': end_date,
+                'content_hash': content_hash,
+                'size': os.path.getsize(path),
+                'raw_size': len(content),
+                'snapshot': snapshot,
+                'payload_snapshot': snapshot_date(content),
+                'etag': etag,
+                'last_modified': last_modified,
+                'stored_at': now,
+                'last_used': now
+                }
+        with self.lock:
+            self.index[self.key(customer, system, endpoint, start_date, end_date)] = entry
+        return entry
+
+    # drop entries older than max_age_days, then the least recently used ones until the
+    # payloads fit in max_bytes, and delete the payloads of the dropped entries that no kept entry points to
+    # (payloads of other processes sharing the cache directory are left alone)
+    def evict(self):
+        with self.lock:
+            oldest_allowed = time.time() - self.max_age_days * 86400
+            entries = sorted(self.index.items(), key=lambda item: item[1]['last_used'], reverse=True)
+            kept = {}
+            kept_hashes = set()
+            total = 0
+            for key, entry in entries:
+                if entry['stored_at'] < oldest_allowed:
+                    continue
+                size = 0 if entry['content_hash'] in kept_hashes else entry['size']
+                if total + size > self.max_bytes:
+                    continue
+                kept[key] = entry
+                kept_hashes.add(entry['content_hash'])
+                total += size
+            evicted_hashes = {entry['content_hash'] for key, entry in self.index.items() if key not in kept} - kept_hashes
+            removed = len(self.index) - len(kept)
+            self.index = kept
+
+        for content_hash in evicted_hashes:
+            if os.path.isfile(self.object_path(content_hash)):
+                os.remove(self.object_path(content_hash))
+        return removed
+
+    # entries on disk that other processes saved meanwhile are merged in (the most recently used entry of a key wins)
+    def merge_saved_index(self):
+        if not os.path.isfile(self.index_file):
+            return
+        with open(self.index_file, 'r') as f:
+            saved = json.load(f)
+        with self.lock:
+            for key, entry in saved.items():
+                if key not in self.index or entry['last_used'] > self.index[key]['last_used']:
+                    self.index[key] = entry
+
+    # greenability fetch, churn fetch and get_osh_results() share the cache directory and can save at the
+    # same time, so the index is merged and written under a file lock; returns the number of evicted entries
+    def save(self):
+        with open(os.path.join(self.directory, 'index.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # released when the file is closed
+            self.merge_saved_index()
+            removed = self.evict()
+            with self.lock:
+                temporary_path = f'{self.index_file}.{os.getpid()}.part'
+                with open(temporary_path, 'w') as f:
+                    json.dump(self.index, f)
+                os.replace(temporary_path, self.index_file)
+        return removed
+
+    def total_size(self):
+        return sum(entry['size'] for entry in {e['content_hash']: e for e in self.index.values()}.values())
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show or evict the Sigrid response cache.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIRECTORY)
+    parser.add_argument('--max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024**2)
+    parser.add_argument('--max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS)
+    parser.add_argument('--evict', action='store_true', help='apply the size and age limits now')
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_dir, int(args.max_mb * 1024**2), args.max_age_days)
+    if args.evict:
+        print(f'Evicted {cache.save()} entries')
+    print(f'{len(cache.index)} entries, {cache.total_size() / 1024**2:.1f} MB compressed')
@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+import os
+import json
+import time
+import argparse
+import datetime
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from sigrid_cache import ResponseCache, snapshot_date, DEFAULT_CACHE_DIRECTORY, DEFAULT_MAX_BYTES, DEFAULT_MAX_AGE_DAYS
+import instrumentation
+from instrumentation import timer, count, count_bytes
+
+'''
+This file performs the following tasks:
+1. builds the list of Sigrid requests that get_greenability.sh and get_churn.sh used to send one by one with curl
+2. sends these requests concurrently over one pooled HTTP session
+3. limits the number of requests per second sent to each host
+4. retries failed requests with exponential backoff
+5. writes every response to the same file layout as the shell scripts, so that
+    write_greenability.py and write_churn.py keep working:
+        greenability/<system>/<system>_<quality>.json
+        greenability/<system>/<system>_internal_reliability-findings.json
+        churn/<system>/churn-<system>-<refactoring>-<n>.json
+6. keeps every response in the cache of sigrid_cache.py, and only downloads a file again
+    when the system has a new snapshot (the small maintainability file is fetched first
+    to find the current snapshot of each system)
+7. records the time and bytes of the requests of every system with instrumentation.py (see --metrics)
+
+To Run file:
+1. Greenability results need your SIGRID_CI_TOKEN in your shell configuration file
+2. Churn results need the SSO_TOKEN in your .env file or as an environment variable
+    (please see write_greenability.py for instructions on retrieving this token)
+3. python3 sigrid_fetch.py greenability --output ~/Desktop/uploads/Sahin/greenability
+   python3 sigrid_fetch.py churn --output ~/Desktop/uploads/Sahin/churn
+
+Use --base-url to point the fetcher at a local stub server instead of Sigrid,
+and --no-cache to download everything again.
+
+This file is structured as follows:
+1. Systems, qualities and refactorings that are fetched
+2. HTTP session, rate limiting and retries:
+    make_session()
+    RateLimiter
+    fetch()
+3. Building the list of jobs:
+    greenability_jobs()
+    churn_jobs()
+    osh_jobs()
+4. Running the jobs:
+    write_response()
+    run_job()
+    run_cached_job()
+    cached_job()
+    run_jobs()
+    run_job_batches()
+5. Main
+
+'''
+
+################################
+# Systems, qualities and refactorings that are fetched
+################################
+
+BASE_URL = 'https://sigrid-says.com'
+CUSTOMER = 'sigdelivery'
+
+QUALITIES = [
+            'maintainability',
+            'security-findings',
+            'reliability-findings',
+            'osh-findings',
+            'architecture-quality'
+            ]
+
+GREENABILITY_SYSTEMS = [
+            'churn2-cbeanutils-original',
+            'churn2-ccollections-original',
+            'churn2-clang-original',
+            'churn2-jodaconvert-original',
+            'churn2-sudoku-original',
+            'churn2-ccli-original',
+            'churn2-cio-original',
+            'churn2-cmath-original',
+            'churn2-jodatime-original'
+            ]
+
+CHURN_SYSTEMS = [
+            'churn2-cbeanutils',
+            'churn2-ccollections',
+            'churn2-clang',
+            'churn2-jodaconvert',
+            'churn2-sudoku',
+            'churn2-ccli',
+            'churn2-cio',
+            'churn2-cmath',
+            'churn2-jodatime'
+            ]
+
+REFACTORINGS = [
+            'extractmethod',
+            'extractvariable',
+            'inline',
+            'introduceindirection',
+            'introducepo',
+            'variabletofield'
+            ]
+
+RUNS = 4
+
+# dates of the two uploads that churn is measured between
+CHURN_START_DATE = '2024-06-11'
+CHURN_END_DATE = '2024-06-13'
+
+# responses worth trying again, everything else fails straight away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+################################
+# HTTP session, rate limiting and retries
+################################
+
+# one session for all requests, so connections are reused instead of opened per request
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# spaces out requests to the same host, shared by all worker threads
+class RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self.next_slot = {} # host -> earliest time the next request may be sent
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# send one request, retrying with exponential backoff, and return the response
+def fetch(session, limiter, method, url, retries=3, backoff=1.0, timeout=60, **kwargs):
+    for attempt in range(retries + 1):
+        limiter.wait(url)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            if attempt == retries:
+                raise
+            print(f'Retrying {url} after {error.__class__.__name__}')
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            # respect the server when it tells us how long to wait
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+            print(f'Retrying {url} after status {response.status_code}')
+            time.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response
+
+################################
+# Building the list of jobs
+################################
+
+# one job per file that get_greenability.sh wrote
+def greenability_jobs(output_directory, systems=GREENABILITY_SYSTEMS, customer=CUSTOMER, base_url=BASE_URL):
+    headers = {'Authorization': f'Bearer {os.getenv("SIGRID_CI_TOKEN")}'}
+    jobs = []
+    for system in systems:
+        system_path = os.path.join(output_directory, system) # eg. greenability/churn2-cbeanutils-original
+
+        # reliability results from internal API
+        jobs.append({
+                    'method': 'GET',
+                    'url': f'{base_url}/rest/analysis-results/api/v1/model-ratings/{customer}/{system}?feature=RELIABILITY',
+                    'headers': headers,
+                    'path': os.path.join(system_path, f'{system}_internal_reliability-findings.json'),
+                    'pretty': True, # this one went through jq
+                    'label': f'{system}: Internal Reliability Rating',
+                    'customer': customer,
+                    'system': system,
+                    'endpoint': 'model-ratings/RELIABILITY'
+                    })
+
+        # all other results from external API
+        for quality in QUALITIES:
+            jobs.append({
+                        'method': 'GET',
+                        'url': f'{base_url}/rest/analysis-results/api/v1/{quality}/{customer}/{system}',
+                        'headers': headers,
+                        'path': os.path.join(system_path, f'{system}_{quality}.json'),
+                        'pretty': False,
+                        'label': f'{system}: {quality}',
+                        'customer': customer,
+                        'system': system,
+                        'endpoint': quality,
+                        'probe': quality == 'maintainability' # small file that tells us the current snapshot
+                        })
+    return jobs
+
+# one job per refactoring run that get_churn.sh fetched
+def churn_jobs(output_directory, systems=CHURN_SYSTEMS, refactorings=REFACTORINGS, runs=RUNS,
+               start_date=CHURN_START_DATE, end_date=CHURN_END_DATE, customer=CUSTOMER, base_url=BASE_URL):
+    load_dotenv()
+    headers = {
+        'content-type': 'application/json',
+        'cookie': f'ssoToken={os.getenv("SSO_TOKEN")}; XSRF-TOKEN=x',
+        'x-xsrf-token': 'x',
+    }
+    body = {
+        'startDate': start_date,
+        'endDate': end_date,
+        'changeQualityType': 'NEW_AND_CHANGED_CODE_QUALITY'
+    }
+    jobs = []
+    for system in systems:
+        system_base = system.removeprefix('churn2-') # eg. cbeanutils
+        for refactoring in refactorings:
+            for i in range(1, runs + 1):
+                name = f'{system}-{refactoring}-{i}'
+                jobs.append({
+                            'method': 'POST',
+                            'url': f'{base_url}/rest/analysis-results/changequality/{customer}/{name}',
+                            'headers': headers,
+                            'json': body,
+                            'path': os.path.join(output_directory, system_base, f'churn-{name.removeprefix("churn2-")}.json'),
+                            'pretty': True,
+                            'label': name,
+                            'customer': customer,
+                            'system': name,
+                            'endpoint': 'changequality',
+                            'start_date': start_date,
+                            'end_date': end_date
+                            })
+    return jobs
+
+# one job per system for the internal open source health API, which get_osh_results() in
+# write_greenability.py used to request one system at a time
+def osh_jobs(input_directory, systems, xsrf_token, sso_token, date=None, customer=CUSTOMER, base_url=BASE_URL):
+    date = date or datetime.date.today().strftime('%Y-%m-%d')
+    headers = {
+        'Content-Type': 'application/json',
+        'cookie': f'XSRF-TOKEN={xsrf_token}; ssoToken={sso_token}',
+    }
+    jobs = []
+    for system in systems:
+        jobs.append({
+                    'method': 'GET',
+                    'url': f'{base_url}/rest/analysis-results/libraryDependencies/{customer}/{system}?startDate={date}&endDate={date}',
+                    'headers': headers,
+                    'path': os.path.join(input_directory, system, f'{system}_internal_osh-findings.json'),
+                    'pretty': False,
+                    'label': f'{system}: OSH results',
+                    'customer': customer,
+                    'system': system,
+                    'endpoint': 'libraryDependencies',
+                    'start_date': date,
+                    'end_date': date
+                    })
+    return jobs
+
+################################
+# Running the jobs
+################################
+
+# write to a temporary file first, so a crashed run never leaves half a json file behind
+def write_response(path, content, pretty):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if pretty:
+        try:
+            content = (json.dumps(json.loads(content), indent=2) + '\n').encode()
+        except ValueError:
+            pass # not json, keep the body as it is
+    temporary_path = path + '.part'
+    with open(temporary_path, 'wb') as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+def request_args(job, extra_headers=None):
+    args = {'headers': {**job['headers'], **(extra_headers or {})}}
+    if 'json' in job:
+        args['json'] = job['json']
+    return args
+
+def run_job(session, limiter, job, retries, backoff):
+    with timer('fetch', job['system']):
+        response = fetch(session, limiter, job['method'], job['url'], retries=retries, backoff=backoff, **request_args(job))
+        write_response(job['path'], response.content, job['pretty'])
+    count_bytes('fetch', len(response.content), job['system'])
+    return 'downloaded'
+
+# like run_job, but only downloads when the cache cannot be trusted for the current snapshot
+def run_cached_job(session, limiter, job, retries, backoff, cache, snapshots):
+    with timer('fetch', job['system']):
+        return cached_job(session, limiter, job, retries, backoff, cache, snapshots)
+
+def cached_job(session, limiter, job, retries, backoff, cache, snapshots):
+    key = (job['customer'], job['system'], job['endpoint'], job.get('start_date'), job.get('end_date'))
+    snapshot = snapshots.get(job['system'])
+    entry = cache.entry(*key, snapshot=snapshot)
+    if entry is not None and not job.get('probe') and cache.is_fresh(entry, snapshot):
+        content = cache.read(entry)
+        write_response(job['path'], content, job['pretty'])
+        count('fetch', 'cached_bytes', len(content), job['system'])
+        return 'cached'
+
+    response = fetch(session, limiter, job['method'], job['url'], retries=retries, backoff=backoff,
+                     **request_args(job, cache.conditional_headers(entry)))
+    if response.status_code == 304:
+        content = cache.read(entry)
+        status = 'not modified'
+        count('fetch', 'cached_bytes', len(content), job['system'])
+    else:
+        content = response.content
+        status = 'downloaded'
+        count_bytes('fetch', len(content), job['system'])
+    if job.get('probe'):
+        snapshot = snapshots[job['system']] = snapshot_date(content)
+    cache.put(job['customer'], job['system'], job['endpoint'], content, job.get('start_date'), job.get('end_date'),
+              snapshot=snapshot, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+    write_response(job['path'], content, job['pretty'])
+    return status
+
+# run all jobs on a pool of threads, returns the list of jobs that failed
+# (snapshots can be given for systems whose current snapshot is already known, eg. from files on disk)
+def run_jobs(jobs, workers=8, requests_per_second=10, retries=3, backoff=1.0, cache=None, snapshots=None):
+    with timer('fetch'):
+        return run_job_batches(jobs, workers, requests_per_second, retries, backoff, cache, snapshots)
+
+def run_job_batches(jobs, workers, requests_per_second, retries, backoff, cache, snapshots):
+    session = make_session(workers)
+    limiter = RateLimiter(requests_per_second)
+    snapshots = dict(snapshots or {}) # system -> current snapshot date, filled in by the probe jobs
+    failed = []
+    counts = {}
+    # probes go first, so the other jobs know whether their system has a new snapshot
+    batches = [[job for job in jobs if job.get('probe')], [job for job in jobs if not job.get('probe')]]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            if cache is None:
+                futures = {executor.submit(run_job, session, limiter, job, retries, backoff): job for job in batch}
+            else:
+                futures = {executor.submit(run_cached_job, session, limiter, job, retries, backoff, cache, snapshots): job for job in batch}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    status = future.result()
+                    counts[status] = counts.get(status, 0) + 1
+                    count('fetch', status.replace(' ', '_'), system=job['system'])
+                    print(f'Sigrid output successfully written for {job["label"]} ({status})')
+                except Exception as error:
+                    print(f'Failed to fetch results from Sigrid for {job["label"]}: {error}')
+                    count('fetch', 'failed', system=job['system'])
+                    failed.append(job)
+    session.close()
+    if cache is not None:
+        cache.save()
+    summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+    print(f'Fetched {len(jobs) - len(failed)}/{len(jobs)} files ({summary})')
+    return failed
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fetch Sigrid results concurrently.')
+    parser.add_argument('experiment', choices=['greenability', 'churn'])
+    parser.add_argument('--output', help='directory the json files are written to')
+    parser.add_argument('--workers', type=int, default=8, help='number of requests sent at the same time')
+    parser.add_argument('--rate', type=float, default=10, help='maximum requests per second per host (0 = no limit)')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=1.0, help='seconds to wait before the first retry')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--customer', default=CUSTOMER)
+    parser.add_argument('--no-cache', action='store_true', help='download every file again')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIRECTORY)
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024**2)
+    parser.add_argument('--cache-max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
+    output_directory = os.path.expanduser(args.output or f'~/Desktop/uploads/Sahin/{args.experiment}')
+    if args.experiment == 'greenability':
+        jobs = greenability_jobs(output_directory, customer=args.customer, base_url=args.base_url)
+    else:
+        jobs = churn_jobs(output_directory, customer=args.customer, base_url=args.base_url)
+
+    cache = None if args.no_cache else ResponseCache(args.cache_dir, int(args.cache_max_mb * 1024**2), args.cache_max_age_days)
+    failed = run_jobs(jobs, args.workers, args.rate, args.retries, args.backoff, cache)
+    raise SystemExit(1 if failed else 0)
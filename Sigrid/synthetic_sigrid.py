@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+import os
+import json
+import random
+import argparse
+
+'''
+This file performs the following tasks:
+1. creates a synthetic greenability tree (<system>/<system>_<quality>.json, the layout of
+    get_greenability.sh and sigrid_fetch.py that write_greenability.py reads), using the json files
+    of the real systems in greenability/ as templates, with randomised metric values and
+    security and reliability findings arrays of any length
+2. creates a synthetic churn tree (<system>/churn-<system>-<refactoring>-<n>.json, the layout of
+    get_churn.sh that write_churn.py reads), with newFiles arrays and empty files for extractvariable
+    runs that were not implemented, like the real exports
+3. system names match between the two trees (greenability churn2-<name>-original, churn <name>),
+    so the trees can be correlated with each other
+
+Both trees are the same for the same seed.
+
+To Run file:
+    python3 synthetic_sigrid.py greenability /tmp/greenability --systems 10000 --findings 200
+    python3 synthetic_sigrid.py churn /tmp/churn --systems 10000 --refactorings 6 --runs 4
+
+This file is structured as follows:
+1. Templates and names
+2. Greenability tree:
+    make_findings()
+    make_greenability_tree()
+3. Churn tree:
+    make_run()
+    make_churn_tree()
+4. Main
+
+'''
+
+################################
+# Templates and names
+################################
+
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'greenability')
+
+TEMPLATE_FILES = [
+                '_maintainability.json',
+                '_architecture-quality.json',
+                '_internal_reliability-findings.json',
+                '_internal_osh-findings.json'
+                ]
+
+FINDINGS_FILES = ['_security-findings.json', '_reliability-findings.json']
+
+REFACTORINGS = ['extractmethod', 'extractvariable', 'inline', 'introduceindirection', 'introducepo', 'variabletofield']
+
+SEVERITIES = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW', 'INFORMATION']
+
+RISK_DELTAS = ['duplicationRiskDelta', 'unitSizeRiskDelta', 'unitComplexityRiskDelta', 'unitInterfacingRiskDelta', 'moduleCouplingRiskDelta']
+
+LOC_PER_MONTH = 750 # Sigrid volume in person-months is lines of code / 750
+
+def system_name(i):
+    return f'synthetic{i:05d}'
+
+def greenability_system(i):
+    return f'churn2-{system_name(i)}-original'
+
+def randomise(value, rng):
+    if isinstance(value, float):
+        return round(rng.uniform(0.5, 5.5), 6)
+    if isinstance(value, dict):
+        return {key: randomise(item, rng) for key, item in value.items()}
+    return value
+
+def template_systems():
+    return sorted(name for name in os.listdir(TEMPLATE_DIRECTORY) if name.startswith('churn2-'))
+
+################################
+# Greenability tree
+################################
+
+# count findings like the ones of the security and reliability findings exports
+def make_findings(system, count, rng):
+    findings = []
+    for i in range(count):
+        severity = rng.choice(SEVERITIES)
+        cwe = f'CWE-{rng.randint(20, 1000)}'
+        line = rng.randint(1, 2000)
+        findings.append({
+                        'id': f'{system}-{i:08d}',
+                        'href': f'https://sigrid-says.com/sigdelivery/{system}/-/security/{system}-{i:08d}',
+                        'firstSeenAnalysisDate': '2024-06-11',
+                        'lastSeenAnalysisDate': '2024-06-12',
+                        'firstSeenSnapshotDate': '2024-06-11',
+                        'lastSeenSnapshotDate': '2024-06-12',
+                        'filePath': f'src/main/java/org/example/File{rng.randint(0, 500)}.java',
+                        'startLine': line,
+                        'endLine': line,
+                        'component': 'src',
+                        'type': 'Synthetic finding',
+                        'cweId': cwe,
+                        'severity': severity,
+                        'impact': severity,
+                        'exploitability': severity,
+                        'severityScore': round(rng.uniform(0, 10), 1),
+                        'impactScore': round(rng.uniform(0, 10), 1),
+                        'exploitabilityScore': round(rng.uniform(0, 10), 1),
+                        'status': 'RAW',
+                        'remark': None,
+                        'toolName': 'Synthetic',
+                        'weaknessIds': [cwe],
+                        'ruleId': 'SyntheticRule',
+                        'isManualFinding': False,
+                        'isSeverityOverridden': False
+                        })
+    return findings
+
+# systems folders churn2-synthetic<i>-original, returns the system names
+def make_greenability_tree(directory, systems, findings=0, seed=0):
+    templates = template_systems()
+    rng = random.Random(seed)
+    names = []
+    for i in range(systems):
+        template = templates[i % len(templates)]
+        system = greenability_system(i)
+        system_path = os.path.join(directory, system)
+        os.makedirs(system_path, exist_ok=True)
+        for suffix in TEMPLATE_FILES:
+            with open(os.path.join(TEMPLATE_DIRECTORY, template, template + suffix), 'r') as f:
+                data = json.load(f)
+            if suffix == '_maintainability.json':
+                data.pop('allRatings', None) # history is not read, keep the tree small
+            with open(os.path.join(system_path, system + suffix), 'w') as f:
+                json.dump(randomise(data, rng), f)
+        for suffix in FINDINGS_FILES:
+            with open(os.path.join(system_path, system + suffix), 'w') as f:
+                json.dump(make_findings(system, findings, rng), f)
+        names.append(system)
+    return names
+
+################################
+# Churn tree
+################################
+
+# summary of one refactoring run, None if the refactoring was not implemented
+def make_run(refactoring, max_files, rng, empty_share):
+    if refactoring == 'extractvariable' and rng.random() < empty_share:
+        return None # not implemented, Sigrid returns nothing
+    files = rng.randint(0, max_files)
+    new_files = []
+    for i in range(files):
+        loc = rng.randint(1, 600)
+        new_files.append({
+                        'moduleId': rng.randint(10 ** 7, 10 ** 8),
+                        'path': f'src/main/java/org/example/File{rng.randint(0, 500)}.java',
+                        'volumeInMonths': round(loc / LOC_PER_MONTH, 3),
+                        'status': rng.choice(['new', 'changed']),
+                        **{delta: round(rng.uniform(-1, 1), 6) for delta in RISK_DELTAS}
+                        })
+    loc = sum(round(new_file['volumeInMonths'] * LOC_PER_MONTH) for new_file in new_files)
+    return {
+            'snapshotDates': ['2024-06-11', '2024-06-13'],
+            'totalNewFiles': files,
+            'totalNewVolumeInMonths': loc / LOC_PER_MONTH,
+            'totalNewVolumeInLoc': loc,
+            'newFiles': new_files
+            }
+
+# system folders synthetic<i> with runs runs of every refactoring, returns the system names
+def make_churn_tree(directory, systems, refactorings=REFACTORINGS, runs=4, max_files=5, empty_share=0.2, seed=0):
+    rng = random.Random(seed)
+    names = []
+    for i in range(systems):
+        system = system_name(i)
+        system_path = os.path.join(directory, system)
+        os.makedirs(system_path, exist_ok=True)
+        for refactoring in refactorings:
+            for n in range(1, runs + 1):
+                data = make_run(refactoring, max_files, rng, empty_share)
+                with open(os.path.join(system_path, f'churn-{system}-{refactoring}-{n}.json'), 'w') as f:
+                    if data is not None:
+                        json.dump(data, f, indent=2)
+        names.append(system)
+    return names
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create synthetic Sigrid exports.')
+    parser.add_argument('tree', choices=['greenability', 'churn'])
+    parser.add_argument('directory')
+    parser.add_argument('--systems', type=int, default=1000)
+    parser.add_argument('--findings', type=int, default=0, help='findings per security and reliability export (greenability)')
+    parser.add_argument('--refactorings', type=int, default=len(REFACTORINGS), help='number of refactorings (churn)')
+    parser.add_argument('--runs', type=int, default=4, help='runs per refactoring (churn)')
+    parser.add_argument('--max-files', type=int, default=5, help='most new files per run (churn)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    directory = os.path.expanduser(args.directory)
+    if args.tree == 'greenability':
+        make_greenability_tree(directory, args.systems, args.findings, args.seed)
+    else:
+        refactorings = (REFACTORINGS + [f'refactoring{i}' for i in range(len(REFACTORINGS), args.refactorings)])[:args.refactorings]
+        make_churn_tree(directory, args.systems, refactorings, args.runs, args.max_files, seed=args.seed)
+    print(f'Created {args.systems} synthetic systems in {directory}')
@@ -0,0 +1,403 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import argparse
+
+SIGRID_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'greenability')) # write_greenability.py and friends
+sys.path.append(os.path.join(SIGRID_DIRECTORY, 'churn')) # write_churn.py
+import write_greenability as wg
+import write_churn as wc
+from manifest import load_manifest, save_manifest, system_state, update_system
+from scoring_model import load_model, score_records
+
+'''
+This file performs the following tasks:
+1. keeps greenability_scores.csv, combined_systems.csv and churn.csv up to date while json files
+    are uploaded, instead of running write_greenability.py and write_churn.py over every folder again
+2. subscribes to filesystem events (inotify) on the greenability and churn directories and on every
+    system folder in them; where inotify is not available (or with --poll) the folders are scanned
+    every --interval seconds instead
+3. waits until a system has had no new events for --debounce seconds, so a fetch that writes several
+    json files, or a file that is still being written, is read once when it is complete; a json file
+    that still cannot be decoded keeps the previous scores until its next event
+4. reads and scores only the system that changed (for churn: only the json files of the refactoring
+    runs that changed), the other systems come from memory
+5. writes the csv files and their typed copies (metric_store.py) to a temporary file first and
+    replaces them, so a reader (the R scripts, score_service.py) never sees half a file
+6. uses the same manifests as the batch scripts (.greenability_manifest.json, .churn_manifest.json),
+    so at start only what changed while nothing was watching is read, and a later batch run
+    reuses everything this file read
+
+The osh results are not fetched here: the osh json files are inputs like the others (see
+write_greenability.py --offline-osh and sigrid_fetch.py).
+
+To Run file:
+    python3 watch_sigrid.py --greenability ~/Desktop/uploads/Sahin/greenability --churn ~/Desktop/uploads/Sahin/churn
+
+This file is structured as follows:
+1. Filesystem events:
+    Inotify
+    Poller
+    open_events()
+2. Watching:
+    SigridWatcher
+3. Main
+
+'''
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# IN_MODIFY is left out: a file counts as changed when it is closed after writing or renamed into place
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len (of the name that follows)
+
+GREENABILITY = 'greenability'
+CHURN = 'churn'
+
+# a json file that is still being written, removed while it is read, or valid but without the fields
+# the readers expect (eg. no 'ratings' yet); the system is read again at its next event
+READ_ERRORS = (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+# the options of a batch run without flags, so both share the manifest
+GREENABILITY_OPTIONS = {'findings': False, 'system_csv': False, 'history': False, 'offline_osh': False}
+
+################################
+# Filesystem events
+################################
+
+# inotify through libc, events are (directory, name, mask); an overflow is (None, None, IN_Q_OVERFLOW)
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC) # AttributeError where libc has no inotify
+        if self.fd < 0:
+            number = ctypes.get_errno()
+            raise OSError(number, os.strerror(number))
+        self.directories = {} # watch descriptor: directory
+
+    def watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            number = ctypes.get_errno()
+            raise OSError(number, os.strerror(number), directory)
+        self.directories[wd] = directory
+
+    # the events that arrive within timeout seconds (None: wait for the first event)
+    def read(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, None, mask))
+            elif mask & IN_IGNORED:
+                self.directories.pop(wd, None) # the folder was removed, so was its watch
+            elif wd in self.directories:
+                events.append((self.directories[wd], name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+# the same events from scanning the watched folders every interval seconds, where there is no inotify
+class Poller:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.directories = {} # directory: {name: (is folder, size, mtime)}
+
+    def scan(self, directory):
+        entries = {}
+        with os.scandir(directory) as scanned:
+            for entry in scanned:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed while scanning, the next scan sees it is gone
+                    continue
+                entries[entry.name] = (entry.is_dir(), stat.st_size, stat.st_mtime_ns)
+        return entries
+
+    def watch(self, directory):
+        self.directories[directory] = self.scan(directory)
+
+    def read(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        events = []
+        for directory, previous in list(self.directories.items()):
+            try:
+                entries = self.scan(directory)
+            except FileNotFoundError:
+                del self.directories[directory]
+                events.append((directory, '', IN_DELETE_SELF))
+                continue
+            for name, entry in entries.items():
+                if previous.get(name) != entry:
+                    events.append((directory, name, (IN_CREATE | IN_ISDIR) if entry[0] else IN_CLOSE_WRITE))
+            for name, entry in previous.items():
+                if name not in entries:
+                    events.append((directory, name, (IN_DELETE | IN_ISDIR) if entry[0] else IN_DELETE))
+            self.directories[directory] = entries
+        return events
+
+    def close(self):
+        pass
+
+# inotify if the kernel has it, polling otherwise
+def open_events(poll=False, interval=1.0):
+    if not poll:
+        try:
+            return Inotify()
+        except (OSError, AttributeError) as error:
+            print(f'inotify is not available ({error}), scanning the folders every {interval}s instead')
+    return Poller(interval)
+
+################################
+# Watching
+################################
+
+# the scored records and churn rows of all systems, updated one changed system at a time
+class SigridWatcher:
+    def __init__(self, greenability_directory, churn_directory, events, model=None, workers=1):
+        self.directories = {GREENABILITY: greenability_directory, CHURN: churn_directory}
+        self.events = events
+        self.model = model or load_model()
+        self.workers = workers
+        self.manifest_files = {
+                            GREENABILITY: os.path.join(greenability_directory, '.greenability_manifest.json'),
+                            CHURN: os.path.join(churn_directory, '.churn_manifest.json')
+                            }
+        self.manifests = {}
+        self.records = {} # system: scored record
+        self.rows = {} # system: rows of churn-<system>.csv
+
+    def trees(self):
+        return [tree for tree, directory in self.directories.items() if os.path.isdir(directory)]
+
+    def list_systems(self, tree):
+        return (wg if tree == GREENABILITY else wc).list_systems(self.directories[tree])
+
+    # like a batch run: read what changed since the last run, write the files if anything did,
+    # and watch every folder
+    def start(self):
+        for tree in self.trees():
+            self.events.watch(self.directories[tree])
+            for system in self.list_systems(tree):
+                self.events.watch(os.path.join(self.directories[tree], system))
+        self.rescan()
+
+    # read every system again whose files changed, after a start or after events were lost
+    def rescan(self):
+        if GREENABILITY in self.trees():
+            directory = self.directories[GREENABILITY]
+            manifest = load_manifest(self.manifest_files[GREENABILITY], GREENABILITY_OPTIONS)
+            records, changed, removed = wg.read_changed_systems(directory, manifest, self.workers, False, self.model)
+            self.manifests[GREENABILITY] = manifest
+            self.records = {record['system']: record for record in records}
+            model_changed = manifest.get('model') != self.model
+            manifest['model'] = self.model
+            if changed or removed or model_changed or not os.path.isfile(os.path.join(directory, 'greenability_scores.csv')):
+                self.write_greenability()
+            save_manifest(self.manifest_files[GREENABILITY], manifest)
+            print(f'{len(changed)} of {len(records)} Greenability systems changed since the last run')
+
+        if CHURN in self.trees():
+            directory = self.directories[CHURN]
+            manifest = load_manifest(self.manifest_files[CHURN])
+            runs, changed, removed = wc.read_changed_runs(directory, manifest)
+            self.manifests[CHURN] = manifest
+            self.rows = {system: entry['result'] for system, entry in manifest['systems'].items()}
+            if changed or removed or not os.path.isfile(os.path.join(directory, 'churn.csv')):
+                self.write_churn(changed)
+            save_manifest(self.manifest_files[CHURN], manifest)
+            print(f'{len(changed)} of {len(manifest["systems"])} churn systems changed since the last run')
+
+    # the (tree, system) an event is about, or None for the files written here and other files
+    def event_system(self, directory, name, mask):
+        for tree in self.trees():
+            root = self.directories[tree]
+            if directory == root:
+                if not mask & IN_ISDIR or name == 'virtualenv':
+                    return None # csv files, manifests and their temporary files
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.events.watch(os.path.join(root, name)) # a new system folder
+                    except OSError:
+                        pass # removed again straight away, update_*() sees it is gone
+                return tree, name
+            if os.path.dirname(directory) == root:
+                if mask & IN_DELETE_SELF or name.endswith('.json'):
+                    return tree, os.path.basename(directory)
+                return None # eg. churn-<system>.csv and <system>.csv.part
+        return None
+
+    # read and score one changed system, returns False if nothing changed or its files cannot be read yet
+    def update_greenability(self, system):
+        directory = self.directories[GREENABILITY]
+        manifest = self.manifests[GREENABILITY]
+        previous = manifest['systems'].get(system)
+        if not wg.is_system(directory, system): # removed, or not a system folder (yet)
+            if previous is None:
+                return False
+            del manifest['systems'][system]
+            self.records.pop(system, None)
+            return True
+        try:
+            state = system_state(os.path.join(directory, system), '.json', previous)
+            if previous and previous['hash'] == state['hash'] and 'result' in previous:
+                return False # touched, but the same content
+            record = wg.read_system(directory, system)
+        except READ_ERRORS as error: # the manifest is not updated, so the next event reads the system again
+            print(f'Kept the previous scores of {system}, its json files cannot be read yet ({error!r})')
+            return False
+        score_records([record], self.model) # the scores of a system only depend on its own metrics
+        update_system(manifest, system, state, record)
+        self.records[system] = record
+        return True
+
+    # read again only the json files of one system whose content changed, returns the number read (None: nothing changed)
+    def update_churn(self, system):
+        directory = self.directories[CHURN]
+        manifest = self.manifests[CHURN]
+        previous = manifest['systems'].get(system)
+        system_path = os.path.join(directory, system)
+        if not wc.is_system(directory, system): # removed, or not a system folder (yet)
+            if previous is None:
+                return None
+            del manifest['systems'][system]
+            self.rows.pop(system, None)
+            return 0
+        try:
+            state = system_state(system_path, '.json', previous)
+            if previous and previous['hash'] == state['hash'] and 'result' in previous:
+                return None
+            # the rows are in the order of the json files, so each row belongs to one file of the previous state
+            previous_rows = {}
+            if previous and 'result' in previous and len(previous['files']) == len(previous['result']):
+                previous_rows = {file: (previous['files'][file]['sha256'], row) for file, row in zip(previous['files'], previous['result'])}
+            rows, read = [], 0
+            for file, file_state in state['files'].items():
+                if file in previous_rows and previous_rows[file][0] == file_state['sha256']:
+                    rows.append(previous_rows[file][1])
+                else:
+                    rows.append(wc.read_run_file(system_path, system, file))
+                    read += 1
+        except READ_ERRORS as error:
+            print(f'Kept the previous churn of {system}, its json files cannot be read yet ({error!r})')
+            return None
+        update_system(manifest, system, state, rows)
+        self.rows[system] = rows
+        return read
+
+    # greenability_scores.csv, combined_systems.csv and their typed copies, from the records in memory
+    def write_greenability(self):
+        directory = self.directories[GREENABILITY]
+        records = [self.records[system] for system in sorted(self.records)] # the order of list_systems()
+        wg.write_greenability_scores(records, os.path.join(directory, 'greenability_scores.csv'), self.model, quiet=True)
+        wg.store_greenability_scores(directory, records)
+        wg.combine_all_metrics(directory, records)
+
+    # churn-<system>.csv of the given systems, and churn.csv
+    def write_churn(self, systems):
+        directory = self.directories[CHURN]
+        rows = [row for system in sorted(self.rows) for row in self.rows[system]]
+        runs = wc.runs_from_rows(rows)
+        wc.write_churn(directory, runs, [system for system in systems if system in self.rows])
+        wc.combine_runs(directory, runs)
+
+    # update the systems in pending ({(tree, system): time of its first event}) and write the files once per tree
+    def update(self, pending):
+        for tree in (GREENABILITY, CHURN):
+            systems = sorted(system for pending_tree, system in pending if pending_tree == tree)
+            if not systems:
+                continue
+            if tree == GREENABILITY:
+                changed = [system for system in systems if self.update_greenability(system)]
+                if changed:
+                    self.write_greenability()
+                    save_manifest(self.manifest_files[tree], self.manifests[tree])
+                described = changed
+            else:
+                read = {system: self.update_churn(system) for system in systems}
+                changed = [system for system in systems if read[system] is not None]
+                if changed:
+                    self.write_churn(changed)
+                    save_manifest(self.manifest_files[tree], self.manifests[tree])
+                described = [f'{system} ({read[system]} runs read)' for system in changed]
+            if changed:
+                first_event = min(pending[(tree, system)] for system in changed)
+                print(f'Updated {tree} of {", ".join(described)} {time.monotonic() - first_event:.3f}s after the first event')
+
+    # wait for events, and update a system once it had no events for debounce seconds
+    def run(self, debounce=0.2):
+        pending = {} # (tree, system): [first event, last event]
+        while True:
+            now = time.monotonic()
+            timeout = max(0.0, min(last for _, last in pending.values()) + debounce - now) if pending else None
+            events = self.events.read(timeout)
+            now = time.monotonic()
+            for directory, name, mask in events:
+                if mask & IN_Q_OVERFLOW:
+                    print('Events were lost, looking for changed systems in all folders')
+                    pending.clear()
+                    self.rescan()
+                    for tree in self.trees(): # folders created meanwhile are not watched yet (watching a folder again changes nothing)
+                        for system in self.list_systems(tree):
+                            self.events.watch(os.path.join(self.directories[tree], system))
+                    continue
+                key = self.event_system(directory, name, mask)
+                if key:
+                    pending.setdefault(key, [now, now])[1] = now
+            quiet = {key: times[0] for key, times in pending.items() if now - times[1] >= debounce}
+            if quiet:
+                for key in quiet:
+                    del pending[key]
+                self.update(quiet)
+
+################################
+# Main
+################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep the Greenability and churn csv files up to date while json files are uploaded.')
+    parser.add_argument('--greenability', default='~/Desktop/uploads/Sahin/greenability')
+    parser.add_argument('--churn', default='~/Desktop/uploads/Sahin/churn')
+    parser.add_argument('--model', help='json or yaml Greenability model (default: greenability_model.json)')
+    parser.add_argument('--debounce', type=float, default=0.2, help='seconds without events before a changed system is read')
+    parser.add_argument('--poll', action='store_true', help='scan the folders instead of using inotify')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between scans with --poll')
+    parser.add_argument('--workers', type=int, default=1, help='processes reading systems at start')
+    args = parser.parse_args()
+
+    events = open_events(args.poll, args.interval)
+    watcher = SigridWatcher(os.path.expanduser(args.greenability), os.path.expanduser(args.churn), events,
+                            load_model(args.model and os.path.expanduser(args.model)), args.workers)
+    watcher.start()
+    print(f'Watching {", ".join(watcher.directories[tree] for tree in watcher.trees())}')
+    try:
+        watcher.run(args.debounce)
+    except KeyboardInterrupt:
+        events.close()